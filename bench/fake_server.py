@@ -0,0 +1,759 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+PAGE_SIZE = 50
+
+
+@dataclass
+class FakeSettings:
+    # Seconds added to every HTTP response, plus up to `jitter` more
+    latency: float = 0.02
+    jitter: float = 0.01
+    # Requests per minute per API key, 0 disables rate limiting
+    rate_limit: int = 240
+    # Power state transitions
+    stop_delay: float = 1.0
+    start_delay: float = 1.0
+    boot_delay: float = 3.0
+    # CPU of each node in percent of one core, 0 for unlimited. A booting server
+    # wants `boot_cpu` and slows down when the node cannot give it that much
+    node_cpu: float = 0
+    boot_cpu: float = 300
+    # Extra slowdown per other server booting on the same node (disk and cache thrash)
+    boot_contention: float = 0
+    # Time a "save" console command takes before the server logs "Saved"
+    save_delay: float = 0.5
+    # Time RustMaps takes to render a submitted map
+    render_delay: float = 2.0
+    websocket: bool = True
+    # Fraction of requests answered with a 503
+    error_rate: float = 0.0
+    # Size of every file, and how fast archives download (bytes/second, 0 unlimited)
+    file_size: int = 64 * 1024
+    download_rate: float = 50 * 1024 * 1024
+
+
+@dataclass
+class FakeGameServer:
+    id: str
+    name: str
+    node: str
+    state: str = "running"
+    paths: Set[str] = field(default_factory=set)
+    variables: Dict[str, str] = field(default_factory=dict)
+    sockets: List["WebsocketConnection"] = field(default_factory=list)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> Tuple[bool, int, float]:
+        """(allowed, remaining, retry after)"""
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, int(self.tokens), 0.0
+        return False, 0, (1 - self.tokens) / self.rate
+
+
+def default_tree(extra_files: int) -> Set[str]:
+    """A Rust server's files, with `extra_files` plugin data files spread over a few folders"""
+    paths = {
+        "server",
+        "server/rust",
+        "server/rust/cfg",
+        "server/rust/cfg/serverauto.cfg",
+        "server/rust/cfg/users.cfg",
+        "server/rust/proceduralmap.3500.1337.258.map",
+        "server/rust/proceduralmap.3500.1337.258.sav",
+        "server/rust/proceduralmap.3500.1337.258.sav.1",
+        "server/rust/proceduralmap.3500.1337.258.sav.2",
+        "server/rust/player.blueprints.5.db",
+        "server/rust/player.deaths.5.db",
+        "server/rust/player.identities.5.db",
+        "server/rust/player.states.258.db",
+        "server/rust/player.tokens.db",
+        "server/rust/sv.files.258.db",
+        "oxide",
+        "oxide/plugins",
+        "oxide/config",
+        "oxide/data",
+        "RustDedicated",
+    }
+    for i in range(10):
+        paths.add(f"oxide/plugins/Plugin{i}.cs")
+        paths.add(f"oxide/config/Plugin{i}.json")
+    for i in range(extra_files):
+        folder = f"oxide/data/Plugin{i % 10}"
+        paths.add(folder)
+        paths.add(f"{folder}/data{i}.json")
+    return paths
+
+
+class WebsocketConnection:
+    """Server side of a Pterodactyl-style websocket, enough for the bot's state watcher"""
+
+    def __init__(self, handler: BaseHTTPRequestHandler, server: FakeGameServer):
+        self.handler = handler
+        self.server = server
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, event: str, args: list | None = None):
+        self.send_frame(0x1, json.dumps({"event": event, "args": args or []}).encode())
+
+    def send_frame(self, opcode: int, payload: bytes):
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(len(payload))
+        elif len(payload) < 2**16:
+            header.append(126)
+            header += struct.pack("!H", len(payload))
+        else:
+            header.append(127)
+            header += struct.pack("!Q", len(payload))
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.handler.wfile.write(bytes(header) + payload)
+                self.handler.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def read_frame(self) -> Tuple[int, bytes] | None:
+        rfile = self.handler.rfile
+        head = rfile.read(2)
+        if len(head) < 2:
+            return None
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", rfile.read(8))[0]
+        mask = rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(rfile.read(length)))
+        return opcode, data
+
+
+class FakeApi:
+    """Emulates the Pterodactyl client API, the RustMaps v4 API and Discord webhooks in one process
+
+    Every request is counted by route, delayed by the configured latency and
+    charged against a per API key token bucket.
+    """
+
+    def __init__(self, settings: FakeSettings | None = None):
+        self.settings = settings or FakeSettings()
+        self.servers: Dict[str, FakeGameServer] = {}
+        self.maps: Dict[str, dict] = {}
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.requests: Counter = Counter()
+        self.rate_limited = 0
+        self.injected_errors = 0
+        self.bytes_downloaded = 0
+        # Servers currently booting on each node, and when each boot finished
+        self.booting: Counter = Counter()
+        self.boots: Set[str] = set()
+        self.running_at: Dict[str, float] = {}
+        # (server id, path) -> size of archives made by /files/compress
+        self.archives: Dict[Tuple[str, str], int] = {}
+        # download token -> archive size
+        self.downloads: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.httpd: ThreadingHTTPServer | None = None
+        self.thread: threading.Thread | None = None
+        self.routes: List[Tuple[str, str, Callable]] = [
+            ("GET", "/api/client", self.list_servers),
+            ("GET", "/api/client/servers/{id}/resources", self.resources),
+            ("GET", "/api/client/servers/{id}/websocket", self.websocket_credentials),
+            ("POST", "/api/client/servers/{id}/power", self.power),
+            ("POST", "/api/client/servers/{id}/command", self.command),
+            ("GET", "/api/client/servers/{id}/files/list", self.list_files),
+            ("POST", "/api/client/servers/{id}/files/delete", self.delete_files),
+            ("GET", "/api/client/servers/{id}/startup", self.startup),
+            ("PUT", "/api/client/servers/{id}/startup/variable", self.set_variable),
+            ("GET", "/v4/maps/filter/{filter}", self.filter_maps),
+            ("POST", "/v4/maps", self.submit_map),
+            ("GET", "/v4/maps/{size}/{seed}", self.map_by_seed),
+            ("GET", "/v4/maps/{id}", self.get_map),
+            ("POST", "/api/client/servers/{id}/files/compress", self.compress),
+            ("GET", "/api/client/servers/{id}/files/download", self.download_url),
+            ("GET", "/download/{token}", self.download),
+            ("POST", "/api/webhooks/{id}/{token}", self.webhook),
+        ]
+        self.patterns = [
+            re.compile(re.sub(r"\{\w+\}", "([^/]+)", template))
+            for _, template, _ in self.routes
+        ]
+
+    # Lifecycle
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, port: int = 0) -> "FakeApi":
+        api = self
+
+        class Handler(RequestHandler):
+            fake = api
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="fake-api", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def add_server(
+        self, server_id: str, name: str, node: str = "node-1", extra_files: int = 100
+    ) -> FakeGameServer:
+        server = FakeGameServer(
+            id=server_id,
+            name=name,
+            node=node,
+            paths=default_tree(extra_files),
+            variables={
+                "SERVER_HOSTNAME": name,
+                "WORLD_SEED": "1337",
+                "WORLD_SIZE": "3500",
+                "MAP_URL": "",
+            },
+        )
+        self.servers[server_id] = server
+        return server
+
+    # State
+
+    def set_state(self, server: FakeGameServer, state: str):
+        with self.lock:
+            server.state = state
+            sockets = list(server.sockets)
+        for socket in sockets:
+            socket.send("status", [state])
+
+    def console(self, server: FakeGameServer, line: str):
+        with self.lock:
+            sockets = list(server.sockets)
+        for socket in sockets:
+            socket.send("console output", [line])
+
+    def run_command(self, server: FakeGameServer, command: str):
+        """Log console output for a command like Rust would, in the background"""
+
+        def run():
+            self.console(server, f"\x1b[0;33m> {command}\x1b[0m")
+            if command == "save":
+                entities = f"{len(server.paths) * 37:,}"
+                self.console(server, f"Saving {entities} entities")
+                time.sleep(self.settings.save_delay)
+                self.console(
+                    server,
+                    f"Saved {entities} ents, cache(0.01), write(0.02), disk({self.settings.save_delay:.2f}).",
+                )
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def boot_share(self, node: str) -> float:
+        """CPU each server booting on `node` gets right now"""
+        settings = self.settings
+        booting = max(1, self.booting[node])
+        if not settings.node_cpu:
+            return settings.boot_cpu
+        return min(settings.boot_cpu, settings.node_cpu / booting)
+
+    def boot(self, server: FakeGameServer):
+        """Start a server in the background, booting slower the busier its node is"""
+        settings = self.settings
+
+        def run():
+            time.sleep(settings.start_delay)
+            with self.lock:
+                self.booting[server.node] += 1
+                self.boots.discard(server.id)
+            self.set_state(server, "starting")
+            work, tick = settings.boot_delay, 0.05
+            while work > 0:
+                time.sleep(tick)
+                with self.lock:
+                    others = self.booting[server.node] - 1
+                    speed = self.boot_share(server.node) / settings.boot_cpu
+                work -= tick * speed / (1 + settings.boot_contention * others)
+            with self.lock:
+                self.booting[server.node] -= 1
+                self.running_at[server.id] = time.monotonic()
+            self.set_state(server, "running")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def transition(self, server: FakeGameServer, steps: List[Tuple[float, str]]):
+        """Move the server through (delay, state) steps in the background"""
+
+        def run():
+            for delay, state in steps:
+                time.sleep(delay)
+                self.set_state(server, state)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def charge(self, key: str) -> Tuple[bool, Dict[str, str]]:
+        if not self.settings.rate_limit:
+            return True, {}
+        with self.lock:
+            bucket = self.buckets.setdefault(key, TokenBucket(self.settings.rate_limit))
+            allowed, remaining, retry_after = bucket.take()
+            if not allowed:
+                self.rate_limited += 1
+        headers = {
+            "X-RateLimit-Limit": str(self.settings.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(math.ceil(retry_after))
+        return allowed, headers
+
+    def report(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.requests)
+
+    # Pterodactyl
+
+    def server(self, server_id: str) -> FakeGameServer | None:
+        return self.servers.get(server_id)
+
+    def list_servers(self, request: "RequestHandler"):
+        page = int(request.query.get("page", ["1"])[0])
+        servers = sorted(self.servers.values(), key=lambda s: s.id)
+        total_pages = max(1, math.ceil(len(servers) / PAGE_SIZE))
+        chunk = servers[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+        return 200, {
+            "object": "list",
+            "data": [
+                {
+                    "object": "server",
+                    "attributes": {"identifier": s.id, "name": s.name, "node": s.node},
+                }
+                for s in chunk
+            ],
+            "meta": {
+                "pagination": {
+                    "total": len(servers),
+                    "per_page": PAGE_SIZE,
+                    "current_page": page,
+                    "total_pages": total_pages,
+                }
+            },
+        }
+
+    def resources(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        with self.lock:
+            cpu = (
+                self.boot_share(server.node) * random.uniform(0.9, 1.0)
+                if server.state == "starting"
+                else random.uniform(5, 20)
+            )
+        return 200, {
+            "object": "stats",
+            "attributes": {
+                "current_state": server.state,
+                "resources": {"cpu_absolute": round(cpu, 2)},
+            },
+        }
+
+    def websocket_credentials(self, request: "RequestHandler", server_id: str):
+        if not self.settings.websocket or not self.server(server_id):
+            return 404, {"errors": []}
+        socket = self.url.replace("http://", "ws://")
+        return 200, {
+            "data": {
+                "token": f"token-{server_id}",
+                "socket": f"{socket}/api/servers/{server_id}/ws",
+            }
+        }
+
+    def power(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        signal = request.json().get("signal")
+        settings = self.settings
+        if signal == "stop" and server.state in ("running", "starting"):
+            self.set_state(server, "stopping")
+            self.transition(server, [(settings.stop_delay, "offline")])
+        elif signal == "start" and server.state == "offline":
+            with self.lock:
+                # A retried start must not boot the server twice
+                if server.id in self.boots:
+                    return 204, None
+                self.boots.add(server.id)
+            self.boot(server)
+        return 204, None
+
+    def command(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        if server.state != "running":
+            return 502, {"errors": [{"code": "HttpException"}]}
+        self.run_command(server, request.json().get("command", ""))
+        return 204, None
+
+    def list_files(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        directory = request.query.get("directory", ["/"])[0].strip("/")
+        prefix = f"{directory}/" if directory else ""
+        with self.lock:
+            children = [
+                path
+                for path in server.paths
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            ]
+            is_directory = {
+                path: any(p.startswith(f"{path}/") for p in server.paths)
+                for path in children
+            }
+        return 200, {
+            "object": "list",
+            "data": [
+                {
+                    "object": "file_object",
+                    "attributes": {
+                        "name": path[len(prefix) :],
+                        "mode": "drwxr-xr-x" if is_directory[path] else "-rw-r--r--",
+                        "mode_bits": "755" if is_directory[path] else "644",
+                        "size": 0 if is_directory[path] else self.settings.file_size,
+                        "is_file": not is_directory[path],
+                        "is_symlink": False,
+                        "mimetype": (
+                            "inode/directory" if is_directory[path] else "text/plain"
+                        ),
+                        "created_at": "2023-01-01T00:00:00+00:00",
+                        "modified_at": "2023-01-01T00:00:00+00:00",
+                    },
+                }
+                for path in sorted(children)
+            ],
+        }
+
+    def delete_files(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        body = request.json()
+        root = body.get("root", "/").strip("/")
+        prefix = f"{root}/" if root else ""
+        deleted = 0
+        with self.lock:
+            for name in body.get("files", []):
+                path = f"{prefix}{name.strip('/')}"
+                doomed = {
+                    p for p in server.paths if p == path or p.startswith(f"{path}/")
+                }
+                server.paths -= doomed
+                deleted += len(doomed)
+        if not deleted:
+            return 422, {"errors": []}
+        return 204, None
+
+    def startup(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        with self.lock:
+            variables = dict(server.variables)
+        return 200, {
+            "object": "list",
+            "data": [
+                {
+                    "object": "egg_variable",
+                    "attributes": {
+                        "env_variable": key,
+                        "server_value": value,
+                        "is_editable": True,
+                    },
+                }
+                for key, value in variables.items()
+            ],
+        }
+
+    def set_variable(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        body = request.json()
+        key, value = body.get("key"), str(body.get("value"))
+        with self.lock:
+            if key not in server.variables:
+                return 422, {"errors": []}
+            server.variables[key] = value
+        return 200, {
+            "object": "egg_variable",
+            "attributes": {"env_variable": key, "server_value": value},
+        }
+
+    def compress(self, request: "RequestHandler", server_id: str):
+        server = self.server(server_id)
+        if not server:
+            return 404, {"errors": []}
+        body = request.json()
+        root = body.get("root", "/").strip("/")
+        prefix = f"{root}/" if root else ""
+        with self.lock:
+            count = 0
+            for name in body.get("files", []):
+                path = f"{prefix}{name.strip('/')}"
+                count += sum(
+                    1 for p in server.paths if p == path or p.startswith(f"{path}/")
+                )
+            name = f"archive-{len(self.archives)}.tar.gz"
+            server.paths.add(f"{prefix}{name}")
+            self.archives[(server_id, f"{prefix}{name}")] = (
+                count * self.settings.file_size
+            )
+        return 200, {
+            "object": "file_object",
+            "attributes": {"name": name, "is_file": True},
+        }
+
+    def download_url(self, request: "RequestHandler", server_id: str):
+        path = request.query.get("file", [""])[0].strip("/")
+        with self.lock:
+            size = self.archives.get((server_id, path))
+            if size is None:
+                return 404, {"errors": []}
+            token = f"{len(self.downloads)}{random.randrange(2**32):08x}"
+            self.downloads[token] = size
+        return 200, {
+            "object": "signed_url",
+            "attributes": {"url": f"{self.url}/download/{token}"},
+        }
+
+    def download(self, request: "RequestHandler", token: str):
+        with self.lock:
+            size = self.downloads.pop(token, None)
+        if size is None:
+            return 404, {"errors": []}
+        return 200, Stream(size)
+
+    # RustMaps
+
+    def map_for(self, size: str, seed: str) -> dict:
+        map_id = f"{size}_{seed}"
+        with self.lock:
+            if map_id not in self.maps:
+                self.maps[map_id] = {
+                    "id": map_id,
+                    "ready_at": time.monotonic() + self.settings.render_delay,
+                }
+            return self.maps[map_id]
+
+    def map_data(self, rendered: dict) -> dict:
+        data = {"id": rendered["id"]}
+        if time.monotonic() >= rendered["ready_at"]:
+            data["imageIconUrl"] = f"{self.url}/img/{rendered['id']}.png"
+        return {"data": data}
+
+    def submit_map(self, request: "RequestHandler"):
+        body = request.json()
+        rendered = self.map_for(str(body.get("size")), str(body.get("seed")))
+        return 201, {"meta": {"status": "Success"}, "data": {"id": rendered["id"]}}
+
+    def map_by_seed(self, request: "RequestHandler", size: str, seed: str):
+        return 200, self.map_data(self.map_for(size, seed))
+
+    def get_map(self, request: "RequestHandler", map_id: str):
+        with self.lock:
+            rendered = self.maps.get(map_id)
+        if not rendered:
+            return 404, {"meta": {"status": "Error"}}
+        return 200, self.map_data(rendered)
+
+    def filter_maps(self, request: "RequestHandler", rustmaps_filter: str):
+        return 200, {
+            "data": [
+                {"seed": str(random.randrange(2**31)), "size": "3500"}
+                for _ in range(20)
+            ]
+        }
+
+    # Discord
+
+    def webhook(self, request: "RequestHandler", webhook_id: str, token: str):
+        embeds = request.json().get("embeds", [])
+        return 200, {"id": str(random.randrange(2**63)), "embeds": embeds}
+
+
+@dataclass
+class Stream:
+    """A response body of `size` bytes, written in chunks at the configured download rate"""
+
+    size: int
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake: FakeApi
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.body = json.loads(raw) if raw else {}
+
+    def json(self) -> dict:
+        return self.body
+
+    def stream(self, status: int, body: Stream):
+        rate = self.fake.settings.download_rate
+        self.send_response(status)
+        self.send_header("Content-Type", "application/gzip")
+        self.send_header("Content-Length", str(body.size))
+        self.end_headers()
+        chunk = b"\0" * (64 * 1024)
+        left = body.size
+        while left > 0:
+            piece = chunk[: min(len(chunk), left)]
+            self.wfile.write(piece)
+            left -= len(piece)
+            with self.fake.lock:
+                self.fake.bytes_downloaded += len(piece)
+            if rate:
+                time.sleep(len(piece) / rate)
+
+    def reply(self, status: int, body, headers: Dict[str, str] | None = None):
+        if isinstance(body, Stream):
+            return self.stream(status, body)
+        payload = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if payload:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_any(self):
+        fake = self.fake
+        parsed = urlparse(self.path)
+        self.query = parse_qs(parsed.query)
+        # Handlers are reused across keep-alive requests, so always read this request's body
+        self.read_body()
+
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            return self.websocket(parsed.path)
+
+        for (method, template, route), pattern in zip(fake.routes, fake.patterns):
+            match = pattern.fullmatch(parsed.path)
+            if method == self.command and match:
+                break
+        else:
+            with fake.lock:
+                fake.requests[f"{self.command} (unknown)"] += 1
+            return self.reply(404, {"errors": [{"detail": "Not found"}]})
+
+        with fake.lock:
+            fake.requests[f"{method} {template}"] += 1
+        settings = fake.settings
+        time.sleep(settings.latency + random.uniform(0, settings.jitter))
+
+        key = self.headers.get("Authorization") or self.headers.get("X-API-Key") or ""
+        allowed, headers = fake.charge(key) if key else (True, {})
+        if not allowed:
+            return self.reply(429, {"errors": [{"code": "TooManyRequests"}]}, headers)
+        if random.random() < settings.error_rate:
+            with fake.lock:
+                fake.injected_errors += 1
+            return self.reply(503, {"errors": [{"code": "ServiceUnavailable"}]})
+        status, body = route(self, *match.groups())
+        self.reply(status, body, headers)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+    def websocket(self, path: str):
+        fake = self.fake
+        match = re.fullmatch(r"/api/servers/(\w+)/ws", path)
+        server = fake.server(match.group(1)) if match else None
+        if not server or not fake.settings.websocket:
+            return self.reply(404, None)
+        with fake.lock:
+            fake.requests["WS connect"] += 1
+        accept = base64.b64encode(
+            hashlib.sha1(
+                (self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode()
+            ).digest()
+        ).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        connection = WebsocketConnection(self, server)
+        with fake.lock:
+            server.sockets.append(connection)
+        try:
+            while True:
+                frame = connection.read_frame()
+                if frame is None:
+                    break
+                if frame[0] == 0x8:
+                    # Echo the close frame, the client waits for it
+                    connection.send_frame(0x8, frame[1][:2])
+                    break
+                opcode, data = frame
+                if opcode != 0x1:
+                    continue
+                message = json.loads(data)
+                event = message.get("event")
+                if event == "auth":
+                    connection.send("auth success")
+                elif event == "send stats":
+                    connection.send("stats", [json.dumps({"state": server.state})])
+                elif event == "send command" and server.state == "running":
+                    fake.run_command(server, (message.get("args") or [""])[0])
+        except (OSError, ValueError):
+            pass
+        finally:
+            connection.closed = True
+            with fake.lock:
+                server.sockets.remove(connection)
+            self.close_connection = True
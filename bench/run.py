@@ -0,0 +1,374 @@
+"""Wipe simulated servers against a local stand-in for Pterodactyl, RustMaps and Discord
+
+    python -m bench.run --servers 24 --hosts 3 --latency 0.05
+
+Reports wall time, request counts and requests/second, and exits non-zero when
+a wipe fails or a --max-* budget is exceeded, so it can gate performance changes.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_server import FakeApi, FakeSettings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILES_TO_DELETE = [
+    "server/rust/*.map",
+    "server/rust/*.sav*",
+    "server/rust/player.*.db",
+    "server/rust/sv.files.*.db",
+    "oxide/data/**/*.json",
+]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.run", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "--servers", type=int, default=12, help="simulated servers in total"
+    )
+    parser.add_argument(
+        "--hosts", type=int, default=2, help="panels the servers are spread over"
+    )
+    parser.add_argument(
+        "--files", type=int, default=200, help="extra plugin data files per server"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds added to every response"
+    )
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=240,
+        help="requests per minute per API key, 0 disables",
+    )
+    parser.add_argument("--stop-delay", type=float, default=1.0)
+    parser.add_argument("--start-delay", type=float, default=1.0)
+    parser.add_argument("--boot-delay", type=float, default=3.0)
+    parser.add_argument("--render-delay", type=float, default=2.0)
+    parser.add_argument("--nodes", type=int, default=4, help="nodes servers run on")
+    parser.add_argument(
+        "--node-cpu",
+        type=float,
+        default=0,
+        help="CPU of each node in percent of one core, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--boot-cpu", type=float, default=300, help="CPU a booting server wants"
+    )
+    parser.add_argument(
+        "--boot-contention",
+        type=float,
+        default=0,
+        help="extra boot slowdown per other server booting on the node",
+    )
+    parser.add_argument(
+        "--max-boots",
+        type=int,
+        default=2,
+        help="max_concurrent_boots of every host",
+    )
+    parser.add_argument(
+        "--boot-cpu-budget",
+        type=float,
+        default=0,
+        help="boot_cpu_budget of every host, 0 disables CPU-based admission",
+    )
+    parser.add_argument(
+        "--save-delay",
+        type=float,
+        default=0.5,
+        help='seconds between a "save" command and the "Saved" console line',
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with a 503",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="archive and download files before deleting them",
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=64 * 1024, help="bytes per simulated file"
+    )
+    parser.add_argument(
+        "--download-rate",
+        type=float,
+        default=50 * 1024 * 1024,
+        help="archive download speed in bytes/second, 0 is unlimited",
+    )
+    parser.add_argument(
+        "--no-websocket", action="store_true", help="make the bot fall back to polling"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="give up waiting for announcements"
+    )
+    parser.add_argument(
+        "--max-seconds", type=float, help="fail if the run takes longer"
+    )
+    parser.add_argument(
+        "--max-requests", type=int, help="fail if more requests are sent"
+    )
+    parser.add_argument(
+        "--max-startup-seconds",
+        type=float,
+        help="fail if a one-shot CLI command takes longer to start",
+    )
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def build_config(args, panels, rustmaps: FakeApi) -> dict:
+    hosts = []
+    for h, panel in enumerate(panels):
+        servers = []
+        for s in range(h, args.servers, len(panels)):
+            server_id = f"{s:08x}"
+            panel.add_server(
+                server_id, f"Bench {s}", f"node-{s % args.nodes}", args.files
+            )
+            # Rotate through every map source the bot supports
+            source = s % 3
+            servers.append(
+                {
+                    "id": server_id,
+                    "name": f"Bench {s}",
+                    "connect_address": f"127.0.0.1:{28015 + s}",
+                    "wipe_on_force_wipe": True,
+                    "discord": {
+                        "webhook": f"{rustmaps.url}/api/webhooks/{h}/token",
+                        "ping_everyone": False,
+                        "ping_role": None,
+                        "embed": {"description": "Benchmark wipe", "color": "#ff0000"},
+                    },
+                    "pick_random_map": True,
+                    "seeds_file": "bench.csv" if source == 1 else None,
+                    "rustmaps_seeds_filter": "bench" if source == 2 else None,
+                    "custom_maps": (
+                        [
+                            {
+                                "map_url": f"{rustmaps.url}/maps/{s}.map",
+                                "image_url": f"{rustmaps.url}/maps/{s}.png",
+                            }
+                        ]
+                        if source == 0
+                        else []
+                    ),
+                    "files_to_delete": FILES_TO_DELETE,
+                    "archive_before_delete": args.archive,
+                    "startup_variables": {"SERVER_HOSTNAME": f"Bench {s} | Just wiped"},
+                }
+            )
+        hosts.append(
+            {
+                "name": f"bench-{h}",
+                "url": panel.url,
+                "api_token": f"bench-token-{h}",
+                "servers": servers,
+                "max_concurrent_boots": args.max_boots,
+                "boot_cpu_budget": args.boot_cpu_budget,
+            }
+        )
+    return {
+        "log_level": "WARNING",
+        "rustmaps_api_token": "bench-rustmaps",
+        "rustmaps_url": rustmaps.url,
+        "hosts": hosts,
+    }
+
+
+def write_workdir(directory: str, config: dict):
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    os.makedirs(os.path.join(directory, "seeds"))
+    with open(os.path.join(directory, "seeds", "bench.csv"), "w") as f:
+        f.write("seed,size\n")
+        for i in range(1000):
+            f.write(f"{1000 + i},{3000 + (i % 4) * 500}\n")
+
+
+def wait_for_announcements(timeout: float) -> bool:
+    # Imported late: the bot keeps its config and state files in the working directory
+    from utils import notify, wipe
+
+    started = time.monotonic()
+    if not wipe.wait_for_wipes(timeout):
+        return False
+    return notify.dispatcher.flush(max(0, timeout - (time.monotonic() - started)))
+
+
+def measure_startup(arguments, runs: int = 5) -> float:
+    """Median wall time of a one-shot CLI command, interpreter start included"""
+    timings = []
+    for _ in range(runs):
+        started = time.monotonic()
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, "main.py"), *arguments],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.monotonic() - started)
+    return statistics.median(timings)
+
+
+def run(args) -> dict:
+    settings = FakeSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        stop_delay=args.stop_delay,
+        start_delay=args.start_delay,
+        boot_delay=args.boot_delay,
+        render_delay=args.render_delay,
+        save_delay=args.save_delay,
+        node_cpu=args.node_cpu,
+        boot_cpu=args.boot_cpu,
+        boot_contention=args.boot_contention,
+        websocket=not args.no_websocket,
+        error_rate=args.error_rate,
+        file_size=args.file_size,
+        download_rate=args.download_rate,
+    )
+    panels = [FakeApi(settings).start() for _ in range(max(1, args.hosts))]
+    rustmaps = FakeApi(settings).start()
+    apis = panels + [rustmaps]
+
+    workdir = tempfile.mkdtemp(prefix="wipe-bench-")
+    write_workdir(workdir, build_config(args, panels, rustmaps))
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    startup = {
+        "help": measure_startup(["--help"]),
+        "status": measure_startup(["--plain", "status"]),
+    }
+
+    started = time.monotonic()
+    import setup_logger
+    from utils import verify, wipe
+    from utils.config import registry
+    from utils.journal import journal
+
+    imported = time.monotonic()
+    config = registry.config
+    setup_logger.setup(config.log_level)
+    if not verify.verify_servers(config):
+        raise SystemExit("Simulated servers failed verification")
+    targets = [(host, server) for host in config.hosts for server in host.servers]
+    results = wipe.wipe_servers(config, targets, force=True)
+    announced = wait_for_announcements(args.timeout)
+    finished = time.monotonic()
+    downtimes = [
+        record.state["downtime_seconds"]
+        for record in map(journal.latest, results)
+        if record and "downtime_seconds" in record.state
+    ]
+
+    for api in apis:
+        api.stop()
+    running = [at for api in panels for at in api.running_at.values()]
+
+    requests = {}
+    for api in apis:
+        for route, count in api.report().items():
+            requests[route] = requests.get(route, 0) + count
+    total = sum(requests.values())
+    wall = finished - started
+    return {
+        "servers": len(targets),
+        "hosts": len(panels),
+        "succeeded": sum(results.values()),
+        "announced": announced,
+        "wall_seconds": round(wall, 3),
+        "import_seconds": round(imported - started, 3),
+        "cli_help_seconds": round(startup["help"], 3),
+        "cli_status_seconds": round(startup["status"], 3),
+        "all_running_seconds": (
+            round(max(running) - started, 3) if len(running) == len(targets) else None
+        ),
+        "downtime_median_seconds": (
+            round(statistics.median(downtimes), 3) if downtimes else None
+        ),
+        "downtime_max_seconds": round(max(downtimes), 3) if downtimes else None,
+        "requests": total,
+        "requests_per_second": round(total / wall, 2) if wall else 0,
+        "rate_limited": sum(api.rate_limited for api in apis),
+        "injected_errors": sum(api.injected_errors for api in apis),
+        "bytes_downloaded": sum(api.bytes_downloaded for api in apis),
+        "by_route": dict(sorted(requests.items(), key=lambda item: -item[1])),
+        "workdir": workdir,
+    }
+
+
+def print_summary(summary: dict):
+    from rich import print
+    from rich.table import Table
+
+    table = Table(title="Wipe benchmark")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    for key, value in summary.items():
+        if key not in ("by_route", "failures"):
+            table.add_row(key, str(value))
+    print(table)
+
+    routes = Table(title="Requests by route")
+    routes.add_column("Route")
+    routes.add_column("Count", justify="right")
+    for route, count in summary["by_route"].items():
+        routes.add_row(route, str(count))
+    print(routes)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    summary = run(args)
+
+    failures = []
+    if summary["succeeded"] < summary["servers"]:
+        failures.append(f"{summary['servers'] - summary['succeeded']} wipe(s) failed")
+    if not summary["announced"]:
+        failures.append("announcements did not finish in time")
+    if args.max_seconds is not None and summary["wall_seconds"] > args.max_seconds:
+        failures.append(
+            f"took {summary['wall_seconds']}s, budget is {args.max_seconds}s"
+        )
+    slowest_startup = max(summary["cli_help_seconds"], summary["cli_status_seconds"])
+    if (
+        args.max_startup_seconds is not None
+        and slowest_startup > args.max_startup_seconds
+    ):
+        failures.append(
+            f"CLI took {slowest_startup}s to run, budget is {args.max_startup_seconds}s"
+        )
+    if args.max_requests is not None and summary["requests"] > args.max_requests:
+        failures.append(
+            f"sent {summary['requests']} requests, budget is {args.max_requests}"
+        )
+    summary["failures"] = failures
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
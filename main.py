@@ -1,347 +1,496 @@
-import datetime
-import random
-import threading
-import time
-from typing import Union
-
-import requests
-from discord_webhook import DiscordEmbed, DiscordWebhook
-from rich import inspect, print
-from rich.traceback import install
-
-import models
-from models import Config
+"""Entry point. Heavy modules are imported inside the command that needs them,
+so one-shot commands run from cron or systemd start quickly."""
+
+import argparse
+import sys
+from typing import List, Tuple
+
+import setup_logger
 from setup_logger import log
-from utils import ptero, utils
 
-install(show_locals=True)
+verified_version: int | None = None
+log_level_override: str | None = None
 
 
 def send_prompt():
     return input("> ")
 
 
+def load_config(refresh: bool = False, verify_servers: bool = True):
+    """Reload config.json if it changed, re-verifying servers only for a new config or on refresh"""
+    global verified_version
+    from utils.config import registry
+
+    try:
+        registry.reload(force=refresh)
+    except (ValueError, OSError) as e:
+        if registry.snapshot is None:
+            log.error(e)
+            exit(1)
+        log.error(f"{e}\nKeeping the previous config.")
+    snapshot = registry.current()
+    if not log_level_override:
+        setup_logger.set_level(snapshot.config.log_level)
+    if verify_servers and (snapshot.version != verified_version or refresh):
+        from utils import verify
+
+        # Verify each server exists on the host
+        if not verify.verify_servers(snapshot.config):
+            exit(1)
+        verified_version = snapshot.version
+    return snapshot.config
+
+
+def find_targets(
+    config, server_ids: List[str], everything: bool = False
+) -> List[Tuple] | None:
+    """(host, server) for each id, or every server. None if an id is unknown"""
+    from utils.config import registry
+
+    if everything:
+        return [(host, server) for host in config.hosts for server in host.servers]
+    targets = []
+    for server_id in server_ids:
+        target = registry.find(server_id)
+        if not target:
+            log.error(f'Server ID "{server_id}" not found in config.json')
+            return None
+        log.info(f'Found server "{target[1].name}" - ID: "{target[1].id}"')
+        targets.append(target)
+    return targets
+
+
 def main(command):
-    with open("config.json", "r") as f:
-        config_json_str = f.read()
-    config = Config.from_json(config_json_str)
-
-    # Verify each server exists on the host
-    for host in config.hosts:
-        log.info(f'Getting servers from host "{host.name}"...')
-        # Global Ptoerdactyl headers
-        headers = {
-            "Authorization": f"Bearer {host.api_token}",
-            "Content-Type": "application/json",
-            "Accept": "Application/vnd.pterodactyl.v1+json",
-        }
-
-        response = requests.get(f"{host.url}/api/client", headers=headers)
-        data = response.json()
-
-        # Check if each server id exists in Pterodactyl server list JSON
-        for server in host.servers:
-            if any(s["attributes"]["identifier"] == server.id for s in data["data"]):
-                log.info(
-                    f'ID "{server.id}" - "{server.name}" found on host "{host.name}"'
-                )
-            else:
-                log.error(
-                    f'ID "{server.id}" - "{server.name}" not found on host "{host.name}". Check config.json file.'
-                )
-                exit(1)
+    config = load_config(refresh=command.strip() == "refresh")
 
     log.info("Commands:")
-    log.info("wipe <server id> [force] - Wipes server")
-
-    for host in config.hosts:
-        if " " not in command and command != "quit":
-            if command != "":
-                log.error("Usage: wipe <server id> [force]")
-            break
-
-        server = None
-        # Split args via space character
-        args = command.split(" ")
-        # trim all arguments
-        args = [arg.strip() for arg in args]
-        # if argument is empty, remove it
-        args = [arg for arg in args if arg != ""]
-        if len(args) < 1:
-            log.error("Usage: wipe <server id> [force]")
-        log.info(f"Command arguments: {args}")
-        if args[0]:
-            if args[0] == "quit":
-                log.info("Exiting...")
-                exit(0)
-            if args[0] == "wipe":
-                if len(args) <= 1:
-                    if command == "":
-                        log.error("Usage: wipe <server id> [force]")
-                    break
-                server_id = args[1]
-                # find server in any host that corresponds to server_id
-                for h in config.hosts:
-                    for s in h.servers:
-                        if s.id == server_id:
-                            server = s
-                            break
-                    if server:
-                        break
-                if not server:
-                    log.error(f'Server ID "{server_id}" not found in config.json')
-                    break
-                log.info(f'Found server "{server.name}" - ID: "{server.id}"')
-                first_thursday = False
-                today = datetime.date.today()
-                if (
-                    today.weekday() == 3
-                    and today.day <= 7
-                    and not server.wipe_on_force_wipe
-                    and "force" not in args
-                ):
-                    first_thursday = True
-                    log.error(
-                        "Today is the first Thursday of the month. Cancelling wipe."
-                    )
-                    log.error('Run with "force" at the end to force wipe')
-                    break
-            # Global Ptoerdactyl headers
-            # "host" must be equal to a host which holds the correct "server_id"
-            for h in config.hosts:
-                for s in h.servers:
-                    if s.id == server.id:
-                        host = h
-                        break
-            headers = {
-                "Authorization": f"Bearer {host.api_token}",
-                "Content-Type": "application/json",
-                "Accept": "Application/vnd.pterodactyl.v1+json",
-            }
-            log.info(
-                f'Starting wipe process for server "{server.name}" - ID: "{server.id}"'
+    log.info("wipe <server id> [<server id> ...] [force] - Wipes one or more servers")
+    log.info("wipe-all [force] - Wipes every configured server")
+    log.info("files <server id> [<server id> ...] - Lists files a wipe would delete")
+    log.info("prepare <server id> [<server id> ...] - Picks and renders the next map")
+    log.info("prepare-all - Prepares the next map for every configured server")
+    log.info("resume <server id> [<server id> ...] - Continues a failed wipe")
+    log.info("abandon <server id> [<server id> ...] - Gives up on a failed wipe")
+    log.info("refresh - Reloads config.json and re-verifies servers")
+    log.info("report - Prints p50/p95 timings per wipe step")
+
+    # Split args via space character
+    args = command.split(" ")
+    # trim all arguments
+    args = [arg.strip() for arg in args]
+    # if argument is empty, remove it
+    args = [arg for arg in args if arg != ""]
+    if len(args) < 1:
+        return
+    log.info(f"Command arguments: {args}")
+
+    if args[0] == "quit":
+        log.info("Exiting...")
+        exit(0)
+    if args[0] == "refresh":
+        return
+    if args[0] == "report":
+        print_report()
+        return
+
+    force = "force" in args[1:]
+    server_ids = [arg for arg in args[1:] if arg != "force"]
+
+    if (
+        args[0] in ("wipe", "files", "prepare", "resume", "abandon")
+        and len(server_ids) < 1
+    ):
+        log.error(f"Usage: {args[0]} <server id> [<server id> ...]")
+        return
+
+    if args[0] in ("wipe-all", "prepare-all"):
+        targets = find_targets(config, [], everything=True)
+    elif args[0] in ("wipe", "files", "prepare", "resume", "abandon"):
+        targets = find_targets(config, server_ids)
+        if targets is None:
+            return
+    else:
+        log.error("Usage: wipe <server id> [<server id> ...] [force]")
+        return
+
+    if args[0] == "files":
+        list_files(targets)
+        return
+
+    if args[0] in ("prepare", "prepare-all"):
+        from utils import prepare
+
+        prepare.prepare_servers(config, targets)
+        return
+
+    from utils import wipe
+
+    if args[0] == "abandon":
+        for _, server in targets:
+            wipe.abandon_wipe(server)
+        return
+    wipe.wipe_servers(config, targets, force, resume=args[0] == "resume")
+
+
+def list_files(targets):
+    from utils import ptero
+
+    for host, server in targets:
+        ptero.delete_files(host, server, server.files_to_delete, dry_run=True)
+
+
+def print_report():
+    """Print p50/p95 latency per wipe step and per call across past wipes"""
+    from rich import print
+    from rich.table import Table
+
+    from utils import metrics, wipe
+
+    spans = metrics.load_spans()
+    if not spans:
+        log.info("No timing data recorded yet")
+        return
+    step_order = {step: i for i, step in enumerate(wipe.Wipe.STEPS)}
+    sections = [
+        ("Whole wipe per host", "wipe", "host"),
+        ("Wipe step", "wipe_step", "step"),
+        ("Call", "call", "function"),
+        ("HTTP client", "http", "client"),
+        ("Waiting for state", "wait_state", "states"),
+        ("Sleep", "sleep", "reason"),
+    ]
+    for title, name, group_by in sections:
+        rows = metrics.summarize(spans, name, group_by)
+        if not rows:
+            continue
+        rows.sort(key=lambda row: (step_order.get(row[0], len(step_order)), row[0]))
+        table = Table(title=f"{title} latency (seconds)")
+        for column in (title, "count", "p50", "p95", "max"):
+            table.add_column(column, justify="left" if column == title else "right")
+        for group, count, p50, p95, maximum in rows:
+            table.add_row(
+                group, str(count), f"{p50:.2f}", f"{p95:.2f}", f"{maximum:.2f}"
             )
-            log.info(f"Saving server")
-            if not ptero.send_command(host, server, "save"):
-                log.warning(f'Failed to send "save" command to server')
-            time.sleep(2)
-            log.info(f"Stopping server")
-            if not ptero.stop_server(host, server):
-                log.warning(f"Failed to stop server (Maybe it's already stopped?)")
-            else:
-                log.info(f"Stopped server")
-
-            time.sleep(3)
-
-            status = "unset"
-            # if status is not "offline", keep requesting until it is
-            while status != "offline":
-                response = requests.get(
-                    f"{host.url}/api/client/servers/{server.id}/resources",
-                    headers=headers,
-                )
-                status = response.json()["attributes"]["current_state"]
-                if status == "offline":
-                    log.debug(f'ID: "{server.id}" - Server status: "{status}"')
-                else:
-                    log.debug(
-                        f'ID: "{server.id}" - Server status: "{status}" (waiting for "offline" status)'
-                    )
-                time.sleep(1)
-
-            log.info(f"Server is offline")
-
-            if not ptero.delete_files(host, server, server.files_to_delete):
-                log.warning("Failed to delete server files")
-            log.info("Deleted server files")
-
-            # Custom map
-            custom_map: models.CustomMap | None = None
-            if len(server.custom_maps) > 0:
-                if server.pick_random_map:
-                    custom_map: models.CustomMap = random.choice(server.custom_maps)
-                else:
-                    # TODO: Figure out how to rotate maps
-                    custom_map: models.CustomMap = server.custom_maps[0]
-                log.info(f'Using custom map url "{custom_map.map_url}"')
-                if not ptero.change_custom_map(host, server, custom_map):
-                    log.warning("Failed to change custom map")
-                log.info(
-                    f"Changed custom map. Map URL: {custom_map.map_url} - Image URL: {custom_map.image_url}"
-                )
-
-            # Use procedural
-            if not custom_map:
-                seed = None
-                if server.rustmaps_seeds_filter:
-                    seed = utils.get_random_map_from_filter(
-                        config, server.rustmaps_seeds_filter
-                    )
-                    log.info(f"Using seed from RustMaps.com filter: {seed}")
-                if server.seeds_file:
-                    seed = utils.pick_random_seed(server)
-                    log.info(f"Using seed from {server.seeds_file} file: {seed}")
-                if not ptero.change_seed(
-                    host, server, str(seed["seed"]), str(seed["size"])
-                ):
-                    log.warning("Failed to change seed")
-                log.info(f"Changed seed. Seed: {seed['seed']} - Size: {seed['size']}")
-                # Submit map generation request to RustMaps.com
-                generated_map_id = utils.generate_rustmaps_map(
-                    config, seed["seed"], seed["size"]
-                )
-                if not generated_map_id:
-                    log.warning(
-                        f'Failed to submit map generation request for seed {seed["seed"]} - size {seed["size"]}'
-                    )
-                log.info(
-                    f'Submitted map generation request for seed {seed["seed"]} - size {seed["size"]}'
-                )
-
-            # change map really here
-            log.info("Starting server")
-            if not ptero.start_server(host, server):
-                log.warning("Server failed to start")
-            log.info("Server started")
-            status = "unset"
-            while status != "starting":
-                response = requests.get(
-                    f"{host.url}/api/client/servers/{server.id}/resources",
-                    headers=headers,
-                )
-                status = response.json()["attributes"]["current_state"]
-                if status == "starting":
-                    log.debug(f'ID: "{server.id}" - Server status: "{status}"')
-                else:
-                    log.debug(
-                        f'ID: "{server.id}" - Server status: "{status}" (waiting for "starting" status)'
-                    )
-                time.sleep(1)
-            log.info(f"Server is now starting")
-
-            def send_discord_webhook(
-                host: models.Host,
-                server: models.Server,
-                custom_map: models.CustomMap = None,
-            ):
-                webhook = DiscordWebhook(url=server.discord.webhook)
-                if server.discord.ping_role:
-                    webhook.set_content(f"<@&{server.discord.ping_role}>")
-                if server.discord.ping_everyone:
-                    webhook.set_content("@everyone")
-                embed_description = None
-                if not custom_map:
-                    embed_description = f"{server.discord.embed.description}\n\n**🗺️ Map Link**\nClick [here](https://rustmaps.com/map/{seed['size']}_{seed['seed']}) to view the map"
-                else:
-                    embed_description = f"{server.discord.embed.description}\n\n**🗺️ Map Type**\nCustom Map"
-                embed = DiscordEmbed(
-                    title=f"**{server.name} just wiped!**",
-                    description=embed_description,
-                )
-                if not custom_map:
-                    generated_map_url = None
-                    while not generated_map_url:
-                        log.debug(
-                            f'ID: "{server.id}" - Waiting for generated map image url for seed {seed["seed"]} - size {seed["size"]}'
-                        )
-                        generated_map_url = utils.get_generated_map_url(
-                            config, generated_map_id
-                        )
-                        if generated_map_url:
-                            embed.set_image(url=generated_map_url)
-                            log.debug(
-                                f'ID: "{server.id}" - Retrieved generated map image url "{generated_map_url[:25] + "..."}"'
-                            )
-                if custom_map:
-                    embed.set_image(url=custom_map.image_url)
-                if not custom_map:
-                    embed.add_embed_field(
-                        name="🌱 Seed", value=f"```{seed['seed']}```", inline=True
-                    )
-                    embed.add_embed_field(
-                        name="📏 Size", value=f"```{seed['size']}```", inline=True
-                    )
-                embed.add_embed_field(
-                    name="🖥️ Connect",
-                    value=f"```{server.connect_address}```",
-                    inline=False,
-                )
-                embed.add_embed_field(
-                    name="🔗 Direct Join",
-                    value=f"steam://connect/{server.connect_address}",
-                    inline=False,
-                )
-                embed.set_color(server.discord.embed.color[1:])
-                webhook.add_embed(embed)
-                # wait until server is "running", then send webhook
-                status = "unset"
-                running_count = 1
-                while status != "running":
-                    response = requests.get(
-                        f"{host.url}/api/client/servers/{server.id}/resources",
-                        headers=headers,
-                    )
-                    status = response.json()["attributes"]["current_state"]
-                    if running_count % 5 == 0:
-                        if status == "running":
-                            log.debug(f'ID: "{server.id}" - Server status: "{status}"')
-                        else:
-                            log.debug(
-                                f'ID: "{server.id}" - Server status: "{status}" (waiting for "running" status)'
-                            )
-                    time.sleep(1)
-                    running_count = running_count + 1
-                log.info(f"\nServer {server.name} is now running. Sending webhook...")
-
-                webhook_resp = webhook.execute()
-                if webhook_resp.status_code != 200:
-                    log.warning(
-                        f"Failed to send webhook. Status code: {webhook_resp.status_code}"
-                    )
-                else:
-                    log.info(f"Sent Discord webhook")
-                    log.info(
-                        f'Wipe complete for server "{server.name}" - ID: "{server.id}"'
-                    )
-
-            if custom_map:
-                webhook_thread = threading.Thread(
-                    target=send_discord_webhook,
-                    args=(
-                        host,
-                        server,
-                        custom_map,
-                    ),
-                    daemon=True,
-                )
-            else:
-                webhook_thread = threading.Thread(
-                    target=send_discord_webhook,
-                    args=(
-                        host,
-                        server,
-                    ),
-                    daemon=True,
-                )
-            webhook_thread.start()
-            break
+        print(table)
 
 
-if __name__ == "__main__":
+def print_status(limit: int, live: bool):
+    """Print recent wipes from the journal, and optionally each server's current state"""
+    from rich import print
+    from rich.table import Table
+
+    from utils.journal import journal
+
+    table = Table(title="Recent wipes")
+    for column in (
+        "ID",
+        "Server",
+        "Status",
+        "Last step",
+        "Started",
+        "Updated",
+        "Error",
+    ):
+        table.add_column(column)
+    for record in journal.recent(limit):
+        table.add_row(
+            str(record.id),
+            record.server_id,
+            record.status,
+            record.step or "-",
+            record.started_at[:19],
+            record.updated_at[:19],
+            record.error or "",
+        )
+    print(table)
+
+    if not live:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    from utils import ptero
+
+    config = load_config(verify_servers=False)
+    targets = find_targets(config, [], everything=True)
+
+    def get_state(target) -> str:
+        try:
+            return ptero.get_server_state(*target)
+        except Exception as e:
+            return f"unreachable ({e.__class__.__name__})"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(targets)))) as executor:
+        states = list(executor.map(get_state, targets))
+    table = Table(title="Servers")
+    for column in ("Host", "ID", "Name", "State"):
+        table.add_column(column)
+    for (host, server), state in zip(targets, states):
+        table.add_row(host.name, server.id, server.name, state)
+    print(table)
+
+
+def run_daemon():
+    from utils import scheduler, wipe
+
+    def current_config():
+        # load_config exits on a bad config, the daemon should keep its schedule
+        try:
+            return load_config()
+        except SystemExit:
+            raise RuntimeError("config.json is invalid or a server failed verification")
+
+    config = load_config()
+    wipe.resume_wipes(config)
+    daemon = scheduler.Scheduler(config, load_config=current_config)
+    try:
+        daemon.run()
+    finally:
+        daemon.stop()
+
+
+def run_api(args: argparse.Namespace):
+    from utils import api, wipe
+
+    def current_config():
+        # load_config exits on a bad config, the API should only fail the request
+        try:
+            return load_config()
+        except SystemExit:
+            raise RuntimeError("config.json is invalid or a server failed verification")
+
+    token = None
+    if args.token_file:
+        with open(args.token_file, "r") as f:
+            token = f.read().strip()
+    wipe.resume_wipes(load_config())
+    host, _, port = args.listen.rpartition(":")
+    api.run(current_config, host or "127.0.0.1", int(port), args.unix, token)
+
+
+def run_shell():
+    from utils import wipe
+
+    wipe.resume_wipes(load_config())
+    command = ""
+    count = 0
+    while True:
+        if count < 1:
+            count = count + 1
+            main(command)
+        else:
+            command = send_prompt()
+            main(command)
+
+
+def run_command(args: argparse.Namespace) -> int:
+    """Run a one-shot subcommand, returning the process exit code"""
+    if args.command == "status":
+        print_status(args.limit, args.live)
+        return 0
+    if args.command == "report":
+        print_report()
+        return 0
+    if args.command == "batch":
+        return run_batch(args)
+
+    config = load_config()
+    if args.command == "verify":
+        # load_config exits if verification fails
+        return 0
+
+    if args.command in ("wipe", "prepare", "files", "resume", "abandon"):
+        if not args.server_ids and not getattr(args, "all", False):
+            log.error(f"Usage: {args.command} <server id> [<server id> ...] | --all")
+            return 2
+        targets = find_targets(config, args.server_ids, getattr(args, "all", False))
+        if targets is None:
+            return 2
+
+    if args.command == "files":
+        list_files(targets)
+        return 0
+    if args.command == "prepare":
+        from utils import prepare
+
+        results = prepare.prepare_servers(config, targets)
+    elif args.command == "abandon":
+        from utils import wipe
+
+        results = {server.id: wipe.abandon_wipe(server) for _, server in targets}
+    elif args.command == "resume":
+        from utils import wipe
+
+        results = wipe.wipe_servers(config, targets, resume=True)
+    else:
+        from utils import wipe
+
+        wipe.resume_wipes(config)
+        results = wipe.wipe_servers(config, targets, args.force)
+    return 0 if all(results.values()) else 1
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    """Validate a whole plan against the config, then run it and write a JSON summary"""
+    import json
+
+    from utils import plan
+    from utils.config import registry
+
+    load_config()
+    if args.plan == "-":
+        text, name = sys.stdin.read(), "stdin"
+    else:
+        with open(args.plan, "r") as f:
+            text, name = f.read(), args.plan
+    try:
+        batch = plan.parse_plan(text, name)
+    except plan.PlanError as e:
+        log.error(e)
+        return 2
+    snapshot = registry.current()
+    problems = plan.validate_plan(batch, snapshot)
+    if not batch.entries:
+        problems.append("The plan is empty")
+    if problems:
+        log.error("Invalid plan, nothing was run:\n" + "\n".join(problems))
+        return 2
+
+    summary = plan.run_plan(snapshot, batch, args.parallel)
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0 if summary["failed"] == 0 else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="main.py", description="Wipe Rust servers hosted on Pterodactyl"
+    )
+    parser.add_argument("--config", default="config.json", help="path to config.json")
+    parser.add_argument("--log-level", help="overrides log_level from config.json")
+    parser.add_argument(
+        "--plain", action="store_true", help="plain log lines instead of rich output"
+    )
+    parser.add_argument(
+        "--log-file",
+        help="also write logs here as JSON lines, with server and step fields",
+    )
+    parser.add_argument(
+        "--rich-tracebacks",
+        action="store_true",
+        help="render uncaught exceptions with rich, including local variables",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    wipe_parser = commands.add_parser("wipe", help="wipe one or more servers")
+    wipe_parser.add_argument("server_ids", nargs="*", metavar="server_id")
+    wipe_parser.add_argument(
+        "--all", action="store_true", help="every configured server"
+    )
+    wipe_parser.add_argument(
+        "--force", action="store_true", help="wipe even on force wipe day"
+    )
+
+    prepare_parser = commands.add_parser(
+        "prepare", help="pick and render the next map ahead of a wipe"
+    )
+    prepare_parser.add_argument("server_ids", nargs="*", metavar="server_id")
+    prepare_parser.add_argument(
+        "--all", action="store_true", help="every configured server"
+    )
+
+    files_parser = commands.add_parser(
+        "files", help="list the files a wipe would delete"
+    )
+    files_parser.add_argument("server_ids", nargs="+", metavar="server_id")
+
+    resume_parser = commands.add_parser(
+        "resume", help="continue the failed or interrupted wipe of servers"
+    )
+    resume_parser.add_argument("server_ids", nargs="+", metavar="server_id")
+    abandon_parser = commands.add_parser(
+        "abandon", help="give up on the failed wipe of servers so it is never resumed"
+    )
+    abandon_parser.add_argument("server_ids", nargs="+", metavar="server_id")
+
+    commands.add_parser("verify", help="check every configured server exists")
+
+    batch_parser = commands.add_parser(
+        "batch", help="run a wipe plan (JSON, YAML or one command per line)"
+    )
+    batch_parser.add_argument(
+        "plan", nargs="?", default="-", help="plan file, - (the default) reads stdin"
+    )
+    batch_parser.add_argument(
+        "--parallel", type=int, help="most wipes to run at once, overrides the plan"
+    )
+    batch_parser.add_argument(
+        "--output", help="write the JSON summary here instead of stdout"
+    )
+
+    status_parser = commands.add_parser("status", help="show recent wipes")
+    status_parser.add_argument("--limit", type=int, default=20)
+    status_parser.add_argument(
+        "--live", action="store_true", help="also query each server's current state"
+    )
+
+    commands.add_parser("report", help="print p50/p95 timings per wipe step")
+    commands.add_parser("daemon", help="wipe and prepare servers on their schedules")
+    api_parser = commands.add_parser(
+        "api", help="serve the local HTTP control API (list, wipe, progress events)"
+    )
+    api_parser.add_argument(
+        "--listen",
+        default="127.0.0.1:8765",
+        metavar="HOST:PORT",
+        help="address to bind, keep it on localhost",
+    )
+    api_parser.add_argument(
+        "--unix", metavar="PATH", help="listen on a unix socket instead"
+    )
+    api_parser.add_argument(
+        "--token-file",
+        metavar="PATH",
+        help='require "Authorization: Bearer <token>" with the token in this file',
+    )
+    commands.add_parser("shell", help="interactive prompt (the default)")
+    return parser
+
+
+def cli(argv: List[str] | None = None) -> int:
+    global log_level_override
+
+    args = build_parser().parse_args(argv)
+    log_level_override = args.log_level
+    setup_logger.setup(
+        args.log_level or "INFO", rich=not args.plain, log_file=args.log_file
+    )
+    if args.rich_tracebacks:
+        from rich.traceback import install
+
+        install(show_locals=True)
+    if args.config != "config.json":
+        from utils.config import registry
+
+        registry.path = args.config
+
     log.info("STARTED")
     try:
-        command = ""
-        count = 0
-        while True:
-            if count < 1:
-                count = count + 1
-                main(command)
-            else:
-                command = input("> ")
-                main(command)
+        if args.command in (None, "shell"):
+            run_shell()
+        elif args.command == "daemon":
+            run_daemon()
+        elif args.command == "api":
+            run_api(args)
+        else:
+            return run_command(args)
     except KeyboardInterrupt:
         log.info("Exiting...")
+    return 0
 
-# hosts = [Host.from_json(json.dumps(h)) for h in config_json['hosts']]
 
-# hosts: Hosts = Hosts.from_json(json.dumps(config_json))
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from dataclasses import dataclass
 
 from dataclass_wizard import JSONWizard
@@ -17,19 +17,19 @@ class PteroFile(JSONWizard):
     modified_at: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CustomMap:
     map_url: str
     image_url: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DiscordEmbed:
     description: str
     color: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Discord:
     webhook: str
     ping_everyone: bool
@@ -37,7 +37,17 @@ class Discord:
     embed: DiscordEmbed
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
+class Schedule:
+    # 5-field cron expression, evaluated in `timezone`
+    cron: str
+    timezone: str = "UTC"
+    # "HH:MM" to wipe at on force wipe day, requires wipe_on_force_wipe
+    force_wipe_time: str | None = None
+    prepare_minutes_before: int = 60
+
+
+@dataclass(frozen=True, slots=True)
 class Server:
     id: str
     name: str
@@ -49,18 +59,44 @@ class Server:
     rustmaps_seeds_filter: str | None
     custom_maps: List[CustomMap]
     files_to_delete: List[str]
+    seeds_size: int | None = None
+    schedule: Schedule | None = None
+    # Extra startup variables (e.g. SERVER_HOSTNAME) applied with the map on every wipe
+    startup_variables: Dict[str, str] | None = None
+    # Download a server-side archive of the matched files before deleting them
+    archive_before_delete: bool = False
 
 
 @dataclass
+class PreparedMap(JSONWizard):
+    server_id: str
+    prepared_at: str
+    custom_map: CustomMap | None = None
+    seed: str | None = None
+    size: str | None = None
+    generated_map_id: str | None = None
+    image_url: str | None = None
+
+
+@dataclass(frozen=True, slots=True)
 class Host(JSONWizard):
     name: str
     url: str
     api_token: str
     servers: List[Server]
+    max_concurrent_wipes: int = 4
+    max_concurrent_downloads: int = 2
+    # Servers booting at once on each of the host's nodes
+    max_concurrent_boots: int = 2
+    # Hold further boots on a node while its booting servers use this much CPU
+    # (percent of one core, summed), 0 to only use max_concurrent_boots
+    boot_cpu_budget: float = 0
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config(JSONWizard):
     log_level: str
     rustmaps_api_token: str
     hosts: List[Host]
+    # Overridable so the bot can be pointed at a stand-in API (see bench/)
+    rustmaps_url: str = "https://api.rustmaps.com"
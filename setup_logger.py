@@ -1,20 +1,139 @@
+import atexit
+import contextvars
+import copy
+import datetime
+import json
 import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
 
-from rich.logging import RichHandler
+log = logging.getLogger("rich")
 
-from models import Config
+# Fields describing the work in progress (which server, which wipe step), added
+# to every record logged under log_context() as attributes of the same name
+CONTEXT_FIELDS = ("server_id", "step")
+context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar(
+    "log_context", default={}
+)
 
-with open("config.json", "r") as f:
-    config_json_str = f.read()
-config = Config.from_json(config_json_str)
+# Renders records on a background thread, so slow console output never stalls a wipe
+listener: QueueListener | None = None
 
-# Setup logging
-logging.getLogger("requests").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
-logging.basicConfig(
-    level=config.log_level,
-    format="%(message)s",
-    datefmt="[%X]",
-    handlers=[RichHandler()],
-)
-log = logging.getLogger("rich")
+sampled_at: Dict[str, float] = {}
+sampled_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach `fields` (see CONTEXT_FIELDS) to every record logged in the enclosed block"""
+    token = context.set({**context.get(), **fields})
+    try:
+        yield
+    finally:
+        context.reset(token)
+
+
+def sampled_debug(key: str, interval: float, message: str, *args):
+    """log.debug at most once per `interval` seconds for `key`, for logs inside polling loops"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    now = time.monotonic()
+    with sampled_lock:
+        if now - sampled_at.get(key, -interval) < interval:
+            return
+        sampled_at[key] = now
+    log.debug(message, *args, stacklevel=2)
+
+
+class ContextQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so exc_info is kept for the handlers
+        # to render. The message is resolved now in case its arguments change later.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        fields = context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, fields.get(field))
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for shipping logs somewhere searchable"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "at": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def setup(level: str = "INFO", rich: bool = True, log_file: str | None = None):
+    """Configure logging. Called by the entry point once it knows the log level
+
+    RichHandler is only imported when it is wanted, plain output suits cron and systemd.
+    Logs go to stderr so commands can print machine-readable output on stdout, and
+    to `log_file` as JSON lines if given. Records are queued by the logging thread
+    and written by a background listener.
+    """
+    global listener
+    stop()
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    if rich:
+        from rich.console import Console
+        from rich.logging import RichHandler
+
+        console = RichHandler(console=Console(stderr=True))
+        console.setFormatter(logging.Formatter("%(message)s", datefmt="[%X]"))
+    else:
+        console = logging.StreamHandler()
+        console.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(message)s", datefmt="[%X]")
+        )
+    handlers = [console]
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    logging.basicConfig(
+        level=level, handlers=[ContextQueueHandler(records)], force=True
+    )
+
+
+def stop():
+    """Write out queued records and stop the listener"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+
+atexit.register(stop)
+
+
+def set_level(level: str):
+    logging.getLogger().setLevel(level)
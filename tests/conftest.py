@@ -0,0 +1,88 @@
+import json
+import queue
+
+import pytest
+
+import models
+from utils import metrics, state
+
+
+class WebSocketTimeoutException(Exception):
+    """Named like websocket-client's, which the read loop treats as an idle socket"""
+
+
+class FakeConnection:
+    """Stands in for a panel websocket: answers auth and stats, events are pushed by the test"""
+
+    def __init__(self, state: str = "offline"):
+        self.state = state
+        self.incoming: queue.Queue = queue.Queue()
+        self.sent = []
+
+    def push(self, event: str, *args):
+        self.incoming.put(json.dumps({"event": event, "args": list(args)}))
+
+    def drop(self):
+        """Simulate the panel closing the connection"""
+        self.incoming.put(ConnectionResetError("connection reset"))
+
+    def send(self, raw: str):
+        message = json.loads(raw)
+        self.sent.append(message)
+        if message["event"] == "auth":
+            self.push("auth success")
+        elif message["event"] == "send stats":
+            self.push("stats", json.dumps({"state": self.state}))
+
+    def recv(self) -> str:
+        try:
+            item = self.incoming.get(timeout=0.05)
+        except queue.Empty:
+            raise WebSocketTimeoutException()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.incoming.put(ConnectionAbortedError("closed"))
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    # Spans would otherwise be written to metrics/ in the working directory
+    monkeypatch.setattr(metrics, "record", lambda *args, **kwargs: None)
+
+
+@pytest.fixture
+def server() -> models.Server:
+    return models.Server(
+        id="abc123",
+        name="Test",
+        connect_address="127.0.0.1:28015",
+        wipe_on_force_wipe=True,
+        discord=models.Discord(
+            webhook="",
+            ping_everyone=False,
+            ping_role=None,
+            embed=models.DiscordEmbed(description="", color=""),
+        ),
+        pick_random_map=True,
+        seeds_file=None,
+        rustmaps_seeds_filter=None,
+        custom_maps=[],
+        files_to_delete=[],
+    )
+
+
+@pytest.fixture
+def host(server) -> models.Host:
+    return models.Host(name="host", url="http://panel", api_token="", servers=[server])
+
+
+@pytest.fixture
+def connection(monkeypatch) -> FakeConnection:
+    """A fake websocket handed out by the `connect` passed to ServerSocket"""
+    monkeypatch.setattr(
+        state.ServerSocket, "_credentials", lambda self: ("ws://panel", "token")
+    )
+    return FakeConnection()
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from utils import ptero
+from utils.state import ConsoleReader, ServerSocket
+
+
+@pytest.fixture
+def console(host, server, connection):
+    socket = ServerSocket(host, server, connect=lambda url, origin: connection)
+    reader = ConsoleReader(socket)
+    assert socket.start()
+    assert reader.wait_until_live(1)
+    yield reader
+    socket.close()
+
+
+def reply_to(connection, monkeypatch, *lines):
+    """Make send_command log `lines` to the console, as the server would"""
+    sent = []
+
+    def send_command(host, server, command):
+        sent.append(command)
+        for line in lines:
+            connection.push("console output", line)
+        return True
+
+    monkeypatch.setattr(ptero, "send_command", send_command)
+    return sent
+
+
+def test_command_returns_matching_line(host, connection, console, monkeypatch):
+    sent = reply_to(
+        connection,
+        monkeypatch,
+        "Saving 41,290 entities",
+        "Saved 41,290 ents, cache(0.12), write(0.03), disk(0.01).",
+    )
+    line = console.command(host, "save", r"^Saved [\d,]+ ents", 1)
+    assert line.startswith("Saved 41,290 ents")
+    assert sent == ["save"]
+    assert console.waiters == []
+
+
+def test_command_strips_ansi_prefix(host, connection, console, monkeypatch):
+    reply_to(connection, monkeypatch, "\x1b[0m\x1b[33;1mSaved 12 ents\x1b[0m\r\n")
+    assert console.command(host, "save", r"^Saved \d+ ents", 1) == "Saved 12 ents"
+
+
+def test_command_splits_multi_line_output(host, connection, console, monkeypatch):
+    reply_to(connection, monkeypatch, "first line\nSaved 3 ents\nlast line")
+    assert console.command(host, "save", r"^Saved", 1) == "Saved 3 ents"
+
+
+def test_command_times_out(host, connection, console, monkeypatch):
+    reply_to(connection, monkeypatch, "Saving...")
+    with pytest.raises(TimeoutError, match="did not log"):
+        console.command(host, "save", r"^Saved", 0.2)
+    assert console.waiters == []
+
+
+def test_command_fails_when_not_sent(host, console, monkeypatch):
+    monkeypatch.setattr(ptero, "send_command", lambda *args: False)
+    with pytest.raises(ConnectionError):
+        console.command(host, "save", r"^Saved", 1)
+    assert console.waiters == []
+
+
+def test_disconnect_while_waiting(host, connection, console, monkeypatch):
+    reply_to(connection, monkeypatch)
+    threading.Timer(0.1, connection.drop).start()
+    with pytest.raises(TimeoutError, match="closed while waiting"):
+        console.command(host, "save", r"^Saved", 5)
+    assert not console.live
@@ -0,0 +1,115 @@
+import pytest
+
+from utils import files
+
+
+def matches(patterns, path):
+    return files.compile_patterns(patterns).match(path) is not None
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("server/rust/proceduralmap.map", True),
+        ("server/rust/backup/proceduralmap.map", False),
+        ("server/rust/.map", True),
+        ("server/rust/proceduralmap.map.bak", False),
+    ],
+)
+def test_star_stays_in_segment(path, expected):
+    assert matches(["server/rust/*.map"], path) is expected
+
+
+def test_question_mark_stays_in_segment():
+    assert matches(["logs/?.txt"], "logs/a.txt")
+    assert not matches(["logs/?.txt"], "logs/ab.txt")
+    assert not matches(["logs/?x"], "logs//x")
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("oxide/data/Kits.json", True),
+        ("oxide/data/Kits/players.json", True),
+        ("oxide/data/a/b/c.json", True),
+        ("oxide/data/Kits.json.bak", False),
+        ("oxide/dataKits.json", False),
+    ],
+)
+def test_double_star_slash_spans_zero_or_more_directories(path, expected):
+    assert matches(["oxide/data/**/*.json"], path) is expected
+
+
+def test_trailing_double_star_matches_everything_below():
+    assert matches(["oxide/logs/**"], "oxide/logs/a.txt")
+    assert matches(["oxide/logs/**"], "oxide/logs/a/b/c.txt")
+    assert not matches(["oxide/logs/**"], "oxide/log/a.txt")
+
+
+def test_character_classes():
+    assert matches(["player.[0-9].db"], "player.3.db")
+    assert not matches(["player.[0-9].db"], "player.x.db")
+    assert matches(["sv.files.[!0].db"], "sv.files.1.db")
+    assert not matches(["sv.files.[!0].db"], "sv.files.0.db")
+
+
+def test_unclosed_bracket_is_literal():
+    assert matches(["weird[name"], "weird[name")
+    assert not matches(["weird[name"], "weirdn")
+
+
+def test_regex_characters_are_literal():
+    assert matches(["a+b(1).txt"], "a+b(1).txt")
+    assert not matches(["a+b(1).txt"], "aab1.txt")
+
+
+def test_leading_slash_is_ignored():
+    assert matches(["/server/rust/*.sav"], "server/rust/map.sav")
+    assert files.split_pattern("/server/rust/*.sav") == ("server/rust/", "*.sav")
+    assert files.group_patterns(["/oxide/data/*.json", "oxide/data/**/*.json"]) == {
+        "oxide/data/": ["oxide/data/*.json", "oxide/data/**/*.json"]
+    }
+
+
+def test_any_pattern_matches():
+    patterns = ["server/rust/*.map", "oxide/data/**/*.json"]
+    assert matches(patterns, "server/rust/x.map")
+    assert matches(patterns, "oxide/data/x/y.json")
+    assert not matches(patterns, "server/rust/x.json")
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("oxide/data/**/*.json", ("oxide/data/", "**/*.json")),
+        ("server/rust/*.map", ("server/rust/", "*.map")),
+        ("server/*/player.db", ("server/", "*/player.db")),
+        ("*.log", ("", "*.log")),
+        ("server/rust/proceduralmap.map", ("server/rust/", "proceduralmap.map")),
+    ],
+)
+def test_split_pattern(pattern, expected):
+    assert files.split_pattern(pattern) == expected
+
+
+def test_is_recursive():
+    assert files.is_recursive("oxide/data/**/*.json")
+    assert files.is_recursive("server/*/player.db")
+    assert not files.is_recursive("server/rust/*.map")
+
+
+def test_drop_nested():
+    paths = [
+        "oxide/data/Kits",
+        "oxide/data/Kits/players.json",
+        "oxide/data/Kits/sub/more.json",
+        "oxide/data/Kits.json",
+        "oxide/data/KitsExtra/a.json",
+        "server/rust/x.map",
+    ]
+    assert files.drop_nested(paths) == [
+        "oxide/data/Kits",
+        "oxide/data/Kits.json",
+        "oxide/data/KitsExtra/a.json",
+        "server/rust/x.map",
+    ]
@@ -0,0 +1,180 @@
+import dataclasses
+import datetime
+
+import pytest
+
+import models
+from utils.cron import Cron
+from utils.scheduler import FakeClock, InlineExecutor, Scheduler, next_wipe
+
+UTC = datetime.timezone.utc
+
+
+def make_server(server_id: str = "1", **schedule) -> models.Server:
+    return models.Server(
+        id=server_id,
+        name=f"Server {server_id}",
+        connect_address="127.0.0.1:28015",
+        wipe_on_force_wipe=True,
+        discord=models.Discord(
+            webhook="",
+            ping_everyone=False,
+            ping_role=None,
+            embed=models.DiscordEmbed(description="", color=""),
+        ),
+        pick_random_map=True,
+        seeds_file=None,
+        rustmaps_seeds_filter=None,
+        custom_maps=[],
+        files_to_delete=[],
+        schedule=models.Schedule(**{"cron": "0 20 * * 4", **schedule}),
+    )
+
+
+def make_config(*servers: models.Server) -> models.Config:
+    host = models.Host(name="host", url="", api_token="", servers=list(servers))
+    return models.Config(log_level="INFO", rustmaps_api_token="", hosts=[host])
+
+
+def at(*args) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+def test_cron_next_after():
+    cron = Cron("30 18 * * 4")
+    # 2026-11-05 is a Thursday
+    assert cron.next_after(datetime.datetime(2026, 11, 5, 18, 29)) == (
+        datetime.datetime(2026, 11, 5, 18, 30)
+    )
+    assert cron.next_after(datetime.datetime(2026, 11, 5, 18, 30)) == (
+        datetime.datetime(2026, 11, 12, 18, 30)
+    )
+
+
+def test_cron_sunday_as_seven():
+    assert Cron("0 0 * * 7").weekdays == Cron("0 0 * * 0").weekdays == {0}
+
+
+def test_cron_day_fields_either_match():
+    cron = Cron("0 12 1 * 1")
+    # 2026-11-01 is a Sunday and the 1st, 2026-11-02 a Monday
+    assert cron.next_after(datetime.datetime(2026, 10, 31)) == (
+        datetime.datetime(2026, 11, 1, 12)
+    )
+    assert cron.next_after(datetime.datetime(2026, 11, 1, 12)) == (
+        datetime.datetime(2026, 11, 2, 12)
+    )
+
+
+@pytest.mark.parametrize("expression", ["0 20 * *", "60 * * * *", "*/0 * * * *"])
+def test_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        Cron(expression)
+
+
+def test_next_wipe_plain():
+    planned = next_wipe(make_server(), at(2026, 11, 6))
+    assert planned == next_wipe(make_server(), at(2026, 11, 5, 20))
+    assert planned.at == at(2026, 11, 12, 20) and not planned.force
+
+
+def test_next_wipe_force_before_cron_time():
+    # The cron time on force wipe day is replaced by the earlier force wipe
+    planned = next_wipe(make_server(force_wipe_time="19:00"), at(2026, 11, 4))
+    assert planned.at == at(2026, 11, 5, 19) and planned.force
+
+
+def test_next_wipe_force_after_cron_time():
+    planned = next_wipe(make_server(force_wipe_time="21:00"), at(2026, 11, 4))
+    assert planned.at == at(2026, 11, 5, 21) and planned.force
+    after = next_wipe(make_server(force_wipe_time="21:00"), planned.at)
+    assert after.at == at(2026, 11, 12, 20) and not after.force
+
+
+def test_next_wipe_skips_force_day():
+    server = dataclasses.replace(make_server(), wipe_on_force_wipe=False)
+    planned = next_wipe(server, at(2026, 11, 4))
+    assert planned.at == at(2026, 11, 12, 20) and not planned.force
+
+
+def test_next_wipe_timezone():
+    server = make_server(cron="0 20 * * 4", timezone="Europe/London")
+    # London is on GMT again in November, on BST in October
+    assert next_wipe(server, at(2026, 11, 10)).at == at(2026, 11, 12, 20)
+    assert next_wipe(server, at(2026, 10, 20)).at == at(2026, 10, 22, 19)
+
+
+def simulate(config, start, until, **kwargs):
+    wiped, prepared = [], []
+    scheduler = Scheduler(
+        config,
+        clock=FakeClock(start),
+        wipe_servers=lambda _, targets, force, force_wipe_day: wiped.extend(
+            (server.id, scheduler.clock.now(), force) for _, server in targets
+        ),
+        prepare_servers=lambda _, targets: prepared.extend(
+            (server.id, scheduler.clock.now()) for _, server in targets
+        ),
+        executor=InlineExecutor(),
+        **kwargs,
+    )
+    scheduler.run(until=until)
+    return wiped, prepared
+
+
+def test_scheduler_month():
+    config = make_config(make_server(force_wipe_time="19:00"))
+    wiped, prepared = simulate(config, at(2026, 11, 1), at(2026, 11, 30))
+    assert wiped == [
+        ("1", at(2026, 11, 5, 19), True),
+        ("1", at(2026, 11, 12, 20), False),
+        ("1", at(2026, 11, 19, 20), False),
+        ("1", at(2026, 11, 26, 20), False),
+    ]
+    assert [when for _, when in prepared] == [
+        when - datetime.timedelta(hours=1) for _, when, _ in wiped
+    ]
+
+
+def test_scheduler_reload_replans_changed_servers():
+    configs = [make_config(make_server("1"), make_server("2"))]
+    calls = []
+
+    def load_config():
+        calls.append(None)
+        # Server 1 moves to Fridays after the first pass, server 2 is unchanged
+        if len(calls) == 2:
+            configs.append(
+                make_config(make_server("1", cron="0 20 * * 5"), make_server("2"))
+            )
+        return configs[-1]
+
+    wiped, _ = simulate(
+        configs[0], at(2026, 11, 9), at(2026, 11, 14), load_config=load_config
+    )
+    assert sorted(wiped) == [
+        ("1", at(2026, 11, 13, 20), False),
+        ("2", at(2026, 11, 12, 20), False),
+    ]
+
+
+def test_scheduler_reload_keeps_untouched_servers_on_the_host():
+    config = make_config(make_server("1"), make_server("2"))
+    scheduler = Scheduler(config, clock=FakeClock(at(2026, 11, 12, 19, 30)))
+    scheduler.prepared_for["2"] = scheduler.planned["2"].at
+    # Only server 1 changes, server 2 shares its host
+    scheduler.load_config = lambda: make_config(
+        make_server("1", cron="0 20 * * 5"), make_server("2")
+    )
+    scheduler.reload()
+    assert scheduler.planned["1"].at == at(2026, 11, 13, 20)
+    assert scheduler.prepared_for == {"2": at(2026, 11, 12, 20)}
+
+
+def test_next_wipe_force_wipe_day_in_schedule_timezone():
+    # Wednesday 23:30 in Los Angeles is already the first Thursday in UTC
+    server = make_server(cron="30 23 * * 3", timezone="America/Los_Angeles")
+    planned = next_wipe(server, at(2026, 11, 4))
+    assert planned.at == at(2026, 11, 5, 7, 30)
+    assert not planned.force_wipe_day
+    assert next_wipe(make_server(), at(2026, 11, 4)).force_wipe_day
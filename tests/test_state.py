@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from utils import ptero, state
+from utils.state import StateWatcher
+
+
+@pytest.fixture
+def polled_states(monkeypatch):
+    """States get_server_state returns in turn, repeating the last one"""
+    states = []
+    calls = []
+
+    def get_server_state(host, server):
+        calls.append(server.id)
+        return states.pop(0) if len(states) > 1 else states[0]
+
+    monkeypatch.setattr(ptero, "get_server_state", get_server_state)
+    monkeypatch.setattr(state, "POLL_INITIAL_INTERVAL", 0.01)
+    monkeypatch.setattr(state, "POLL_MAX_INTERVAL", 0.01)
+    return states, calls
+
+
+@pytest.fixture
+def watcher(host, server, connection):
+    watcher = StateWatcher(host, server, connect=lambda url, origin: connection).start()
+    yield watcher
+    watcher.close()
+
+
+def test_websocket_status_events(connection, watcher, polled_states):
+    _, calls = polled_states
+    assert watcher.live
+    threading.Timer(0.05, connection.push, ("status", "starting")).start()
+    threading.Timer(0.1, connection.push, ("status", "running")).start()
+    assert watcher.wait_for("running", 5) == "running"
+    assert watcher.wait_for(("starting", "running"), 5) == "running"
+    assert calls == []
+
+
+def test_initial_state_from_stats(connection, watcher):
+    # The watcher asks for a stats frame once authenticated
+    assert watcher.wait_for("offline", 1) == "offline"
+    assert {"event": "send stats", "args": []} in connection.sent
+
+
+def test_falls_back_to_polling_after_disconnect(connection, watcher, polled_states):
+    states, calls = polled_states
+    states.extend(["starting", "starting", "running"])
+    threading.Timer(0.1, connection.drop).start()
+    assert watcher.wait_for("running", 5) == "running"
+    assert not watcher.live
+    assert len(calls) == 3
+
+
+def test_polls_when_websocket_unavailable(host, server, monkeypatch, polled_states):
+    states, calls = polled_states
+    states.extend(["stopping", "offline"])
+
+    def refuse(url, origin):
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(
+        state.ServerSocket, "_credentials", lambda self: ("ws://panel", "token")
+    )
+    watcher = StateWatcher(host, server, connect=refuse).start()
+    assert not watcher.live
+    assert watcher.wait_for("offline", 5) == "offline"
+    assert calls == [server.id, server.id]
+
+
+def test_websocket_timeout(watcher, polled_states):
+    _, calls = polled_states
+    with pytest.raises(TimeoutError, match='last status "offline"'):
+        watcher.wait_for("running", 0.2)
+    assert calls == []
+
+
+def test_polling_timeout(connection, watcher, polled_states):
+    states, _ = polled_states
+    states.append("starting")
+    connection.drop()
+    with pytest.raises(TimeoutError, match='last status "starting"'):
+        watcher.wait_for("running", 0.2)
@@ -0,0 +1,121 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import models
+from setup_logger import log
+from utils import deadline, metrics, ptero, verify
+
+# Seconds between CPU samples of a node's booting servers, and between boots
+# admitted on CPU headroom so the last one has time to ramp up
+CPU_SAMPLE_INTERVAL = 5.0
+
+
+class NodeAdmission:
+    """Queues server boots on one node so they don't all load their maps at once"""
+
+    def __init__(self, name: str, limit: int, cpu_budget: float = 0):
+        self.name = name
+        self.limit = max(1, limit)
+        self.cpu_budget = cpu_budget
+        # Server id -> (host, server) of every admitted boot
+        self.booting: Dict[str, Tuple[models.Host, models.Server]] = {}
+        self.cpu_load = 0.0
+        self.sampled_at = 0.0
+        self.admitted_at = 0.0
+        self.sampling = False
+        self.condition = threading.Condition()
+
+    def _sample(self, booting: List[Tuple[models.Host, models.Server]]) -> float:
+        """Sum the CPU use of the booting servers. Called with the condition released"""
+        load = 0.0
+        for host, server in booting:
+            try:
+                resources = ptero.get_server_resources(host, server)
+            except Exception as e:
+                log.debug('Node "%s" - Failed to read resources: %s', self.name, e)
+                resources = None
+            if resources:
+                load += resources.get("resources", {}).get("cpu_absolute", 0)
+        return load
+
+    def _has_room(self) -> bool:
+        if not self.booting:
+            return True
+        if len(self.booting) >= self.limit:
+            return False
+        if not self.cpu_budget:
+            return True
+        # Only trust a recent sample taken after the last boot had time to ramp up
+        return (
+            self.sampled_at - self.admitted_at >= CPU_SAMPLE_INTERVAL
+            and time.monotonic() - self.sampled_at < CPU_SAMPLE_INTERVAL
+            and self.cpu_load < self.cpu_budget
+        )
+
+    def acquire(self, host: models.Host, server: models.Server, timeout: float) -> bool:
+        """Wait for a boot slot. False if none freed up within `timeout` seconds"""
+        timeout = deadline.cap(timeout)
+        give_up_at = time.monotonic() + timeout
+        with metrics.span("boot_queue", node=self.name, server=server.id):
+            with self.condition:
+                queued = False
+                while not self._has_room():
+                    if not queued:
+                        log.info(
+                            f'ID: "{server.id}" - Waiting for a boot slot on node "{self.name}" ({len(self.booting)} booting)'
+                        )
+                        queued = True
+                    left = give_up_at - time.monotonic()
+                    if left <= 0:
+                        return False
+                    now = time.monotonic()
+                    due = (
+                        len(self.booting) < self.limit
+                        and now - self.admitted_at >= CPU_SAMPLE_INTERVAL
+                        and now - self.sampled_at >= CPU_SAMPLE_INTERVAL
+                    )
+                    if self.cpu_budget and due and not self.sampling:
+                        self.sampling = True
+                        booting = list(self.booting.values())
+                        self.condition.release()
+                        try:
+                            load = self._sample(booting)
+                        finally:
+                            self.condition.acquire()
+                            self.sampling = False
+                        self.cpu_load, self.sampled_at = load, time.monotonic()
+                        log.debug(
+                            'Node "%s" - Booting servers use %.0f%% CPU (budget %.0f%%)',
+                            self.name,
+                            load,
+                            self.cpu_budget,
+                        )
+                        continue
+                    self.condition.wait(min(left, CPU_SAMPLE_INTERVAL))
+                self.booting[server.id] = (host, server)
+                self.admitted_at = time.monotonic()
+                return True
+
+    def release(self, server: models.Server):
+        with self.condition:
+            if self.booting.pop(server.id, None) is not None:
+                self.condition.notify_all()
+
+
+nodes: Dict[str, NodeAdmission] = {}
+nodes_lock = threading.Lock()
+
+
+def get_admission(host: models.Host, server: models.Server) -> NodeAdmission | None:
+    """The admission queue of the node a server runs on, None if the node is unknown"""
+    node = verify.server_index.get(server.id, {}).get("node")
+    if node is None:
+        return None
+    name = f"{host.name}/{node}"
+    with nodes_lock:
+        if name not in nodes:
+            nodes[name] = NodeAdmission(
+                name, host.max_concurrent_boots, host.boot_cpu_budget
+            )
+        return nodes[name]
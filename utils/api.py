@@ -0,0 +1,359 @@
+"""Local HTTP control API: list servers, start wipes, follow their progress.
+
+Runs on its own asyncio loop. Wipes and anything else that blocks (journal
+reads, panel requests) run on worker threads, so slow clients never hold up
+a wipe and a busy wipe never stalls a client.
+
+    GET  /servers            configured servers with their last wipe
+    GET  /servers/<id>       one server, add ?live=1 for its current panel state
+    GET  /wipes?limit=20     recent wipes from the journal
+    POST /wipes              {"servers": ["<id>", ...] | "all": true, "force": false}
+    GET  /events             server-sent events for every wipe step, ?server=<id> to filter
+
+Requests over TCP must name a loopback address (or the bound address) in their
+Host header, so a web page can't reach the API through DNS rebinding. POSTs
+must be sent as application/json, which browsers can't do cross-origin without
+a preflight. With a token, every request needs "Authorization: Bearer <token>".
+"""
+
+import asyncio
+import hmac
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http import HTTPStatus
+from typing import Callable, Dict, List, Set, Tuple
+from urllib.parse import parse_qs, urlparse, urlsplit
+
+import models
+from setup_logger import log
+from utils import progress
+
+MAX_BODY = 64 * 1024
+# Seconds a client may take to send its request
+REQUEST_TIMEOUT = 10
+# Seconds between SSE keep-alive comments
+HEARTBEAT_INTERVAL = 15
+# Events buffered per SSE client before it is considered stuck and dropped
+MAX_PENDING_EVENTS = 1000
+# Threads for blocking work done on behalf of requests (wipes run separately)
+WORKERS = 8
+LOOPBACK_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        url = urlparse(target)
+        self.path = url.path.rstrip("/") or "/"
+        self.query = parse_qs(url.query)
+        self.headers = headers
+        self.body = body
+
+    def param(self, name: str, default: str | None = None) -> str | None:
+        return self.query.get(name, [default])[0]
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            return json.loads(self.body)
+        except ValueError as e:
+            raise HttpError(400, f"Invalid JSON body: {e}")
+
+
+class ControlApi:
+    def __init__(
+        self, load_config: Callable[[], models.Config], token: str | None = None
+    ):
+        # Called for each request that needs the config, may reload config.json
+        self.load_config = load_config
+        self.token = token
+        # Host header values accepted over TCP, None on a unix socket
+        self.allowed_hosts: Set[str] | None = None
+        self.workers = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="api")
+        self.wipes = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-wipe")
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.subscribers: List[Tuple[asyncio.Queue, str | None]] = []
+        self.routes = [
+            ("GET", "/servers", self.list_servers),
+            ("GET", "/servers/{id}", self.get_server),
+            ("GET", "/wipes", self.list_wipes),
+            ("POST", "/wipes", self.start_wipes),
+        ]
+
+    async def call(self, function: Callable, *args):
+        """Run blocking work on a worker thread"""
+        return await self.loop.run_in_executor(self.workers, function, *args)
+
+    # Progress events arrive on wipe threads and are handed to the loop
+
+    def on_progress(self, event: dict):
+        self.loop.call_soon_threadsafe(self.broadcast, event)
+
+    def broadcast(self, event: dict):
+        for queue, server_id in list(self.subscribers):
+            if server_id and event["server"] != server_id:
+                continue
+            if queue.full():
+                # A client that stopped reading is cut off rather than buffered forever
+                # Drop its oldest event to make room for the sentinel that ends the stream
+                self.subscribers.remove((queue, server_id))
+                queue.get_nowait()
+                queue.put_nowait(None)
+                continue
+            queue.put_nowait(event)
+
+    # Handlers
+
+    def describe(self, host: models.Host, server: models.Server) -> dict:
+        """Blocking: reads the journal"""
+        from utils import verify, wipe
+        from utils.journal import journal
+
+        record = journal.latest(server.id)
+        with wipe.running_wipes_lock:
+            wiping = server.id in wipe.running_wipes
+        return {
+            "id": server.id,
+            "name": server.name,
+            "host": host.name,
+            "node": verify.server_index.get(server.id, {}).get("node"),
+            "wiping": wiping,
+            "last_wipe": asdict(record) if record else None,
+        }
+
+    def targets(self, config: models.Config) -> List[Tuple[models.Host, models.Server]]:
+        return [(host, server) for host in config.hosts for server in host.servers]
+
+    async def list_servers(self, request: Request):
+        config = await self.call(self.load_config)
+        return 200, await self.call(
+            lambda: [self.describe(*target) for target in self.targets(config)]
+        )
+
+    async def get_server(self, request: Request, server_id: str):
+        from utils import ptero
+
+        config = await self.call(self.load_config)
+        target = next((t for t in self.targets(config) if t[1].id == server_id), None)
+        if target is None:
+            raise HttpError(404, f'Server "{server_id}" is not in config.json')
+        result = await self.call(self.describe, *target)
+        if request.param("live") in ("1", "true"):
+            try:
+                result["state"] = await self.call(ptero.get_server_state, *target)
+            except Exception as e:
+                result["state"] = None
+                result["state_error"] = str(e)
+        return 200, result
+
+    async def list_wipes(self, request: Request):
+        from utils.journal import journal
+
+        try:
+            limit = int(request.param("limit", "20"))
+        except ValueError:
+            raise HttpError(400, '"limit" must be a number')
+        records = await self.call(journal.recent, limit)
+        return 200, [asdict(record) for record in records]
+
+    async def start_wipes(self, request: Request):
+        from utils import wipe
+
+        body = request.json()
+        if not isinstance(body, dict):
+            raise HttpError(400, "Expected a JSON object")
+        config = await self.call(self.load_config)
+        targets = self.targets(config)
+        if body.get("all"):
+            selected = targets
+        else:
+            server_ids = body.get("servers")
+            if not isinstance(server_ids, list) or not server_ids:
+                raise HttpError(400, 'Give "servers": [<id>, ...] or "all": true')
+            by_id = {server.id: (host, server) for host, server in targets}
+            unknown = [str(i) for i in server_ids if i not in by_id]
+            if unknown:
+                raise HttpError(404, f"Not in config.json: {', '.join(unknown)}")
+            selected = [by_id[i] for i in dict.fromkeys(server_ids)]
+        with wipe.running_wipes_lock:
+            busy = [
+                server.id for _, server in selected if server.id in wipe.running_wipes
+            ]
+        if busy:
+            raise HttpError(409, f"Already wiping: {', '.join(busy)}")
+
+        force = bool(body.get("force", False))
+        log.info(f"API: wiping {len(selected)} server(s)")
+        future = self.wipes.submit(wipe.wipe_servers, config, selected, force)
+        future.add_done_callback(self.log_failure)
+        return 202, {"accepted": [server.id for _, server in selected], "force": force}
+
+    def log_failure(self, future):
+        if future.exception():
+            log.error(f"API: wipe batch failed: {future.exception()!r}")
+
+    async def stream_events(self, request: Request, writer: asyncio.StreamWriter):
+        server_id = request.param("server")
+        queue: asyncio.Queue = asyncio.Queue(MAX_PENDING_EVENTS)
+        subscriber = (queue, server_id)
+        self.subscribers.append(subscriber)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    if event is None:
+                        break
+                    data = json.dumps(event)
+                    writer.write(f"event: {event['event']}\ndata: {data}\n\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    # HTTP
+
+    def authorize(self, request: Request):
+        """Refuse requests a web page open in a local browser could have made"""
+        if self.allowed_hosts is not None:
+            host = urlsplit(f"//{request.headers.get('host', '')}").hostname
+            if host not in self.allowed_hosts:
+                raise HttpError(403, "Host header must be a loopback address")
+        if self.token:
+            expected = f"Bearer {self.token}".encode()
+            given = request.headers.get("authorization", "").encode()
+            if not hmac.compare_digest(given, expected):
+                raise HttpError(401, "Missing or wrong API token")
+        if request.method != "GET":
+            media_type = request.headers.get("content-type", "").split(";")[0]
+            if media_type.strip().lower() != "application/json":
+                raise HttpError(415, "Content-Type must be application/json")
+
+    def route(self, request: Request):
+        path_exists = False
+        for method, template, handler in self.routes:
+            parts, wanted = request.path.split("/"), template.split("/")
+            if len(parts) != len(wanted):
+                continue
+            args = []
+            for part, want in zip(parts, wanted):
+                if want.startswith("{"):
+                    args.append(part)
+                elif part != want:
+                    break
+            else:
+                if method == request.method:
+                    return handler, args
+                path_exists = True
+        if path_exists:
+            raise HttpError(405, f"{request.method} is not allowed here")
+        raise HttpError(404, f"No such endpoint: {request.path}")
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Request:
+        line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = line.split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers: Dict[str, str] = {}
+        while True:
+            header = (await reader.readline()).decode("latin-1").strip()
+            if not header:
+                break
+            key, _, value = header.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method.upper(), target, headers, body)
+
+    def respond(self, writer: asyncio.StreamWriter, status: int, body):
+        payload = json.dumps(body, indent=2).encode() + b"\n"
+        reason = HTTPStatus(status).phrase
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + payload
+        )
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    self.read_request(reader), REQUEST_TIMEOUT
+                )
+                self.authorize(request)
+                if request.method == "GET" and request.path == "/events":
+                    return await self.stream_events(request, writer)
+                handler, args = self.route(request)
+                status, body = await handler(request, *args)
+            except HttpError as e:
+                status, body = e.status, {"error": e.message}
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                status, body = 400, {"error": "Bad request"}
+            except Exception as e:
+                log.exception("API: request failed")
+                status, body = 500, {"error": repr(e)}
+            self.respond(writer, status, body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(
+        self, host: str = "127.0.0.1", port: int = 8765, unix: str | None = None
+    ):
+        self.loop = asyncio.get_running_loop()
+        progress.subscribe(self.on_progress)
+        try:
+            if unix:
+                if os.path.exists(unix):
+                    os.remove(unix)
+                server = await asyncio.start_unix_server(self.handle, unix)
+                # Only the bot's own user may control it
+                os.chmod(unix, 0o600)
+                log.info(f"API listening on {unix}")
+            else:
+                self.allowed_hosts = LOOPBACK_HOSTS | {host.strip("[]").lower()}
+                server = await asyncio.start_server(self.handle, host, port)
+                log.info(f"API listening on http://{host}:{port}")
+            async with server:
+                await server.serve_forever()
+        finally:
+            progress.unsubscribe(self.on_progress)
+            self.workers.shutdown(wait=False)
+            self.wipes.shutdown(wait=True)
+
+
+def run(
+    load_config: Callable[[], models.Config],
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix: str | None = None,
+    token: str | None = None,
+):
+    """Serve the API until interrupted"""
+    asyncio.run(ControlApi(load_config, token).serve(host, port, unix))
@@ -0,0 +1,62 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any
+
+CACHE_FILE = "cache.sqlite3"
+
+
+class Cache:
+    """Small persistent key/value store with per-entry expiry, backed by SQLite"""
+
+    def __init__(self, path: str = CACHE_FILE):
+        self.path = path
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # Expired entries are only skipped by get(), drop them once per process
+            self.connection.execute(
+                "DELETE FROM cache WHERE expires_at < ?", (time.time(),)
+            )
+            self.connection.commit()
+        return self.connection
+
+    def get(self, key: str) -> Any | None:
+        with self.lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?",
+                    (key,),
+                )
+                .fetchone()
+            )
+        if not row or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self.lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+            connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+cache = Cache()
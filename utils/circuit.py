@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Dict
+
+import requests
+
+from setup_logger import log
+
+# Consecutive failures (connection errors, timeouts, 5xx) before a host is cut off
+FAILURE_THRESHOLD = 5
+# How long calls fail fast before a single trial request is let through
+RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host that keeps failing"""
+
+
+class CircuitBreaker:
+    """Stops calls to a failing host so one dead node fails fast instead of stalling every wipe"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def before_request(self) -> bool:
+        """Raise CircuitOpenError unless a request may be sent now
+
+        Returns True if this request is the half-open trial. The caller must then
+        record its outcome or, if it never sends it, call release_trial().
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            left = self.opened_at + self.reset_timeout - time.monotonic()
+            if left > 0 or self.trial_running:
+                raise CircuitOpenError(
+                    f'"{self.name}" is failing, not sending requests for another {max(left, 0):.0f}s'
+                )
+            # Half-open: let one request through to see if the host recovered
+            self.trial_running = True
+            return True
+
+    def release_trial(self):
+        """Give up the trial slot without judging the host, e.g. the deadline ran out first"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                log.info(f'"{self.name}" is responding again')
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (
+                self.opened_at is None and self.failures >= self.failure_threshold
+            ):
+                log.error(
+                    f'"{self.name}" failed {self.failures} time(s) in a row, pausing requests for {self.reset_timeout:.0f}s'
+                )
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the shared breaker for a host (or API) name, creating it on first use"""
+    with breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name)
+        return breakers[name]
@@ -0,0 +1,245 @@
+import atexit
+import os
+import random
+import re
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import models
+from setup_logger import log
+from utils import deadline, metrics
+from utils.circuit import CircuitBreaker, get_breaker
+from utils.ratelimit import RUSTMAPS_BURST, RUSTMAPS_RATE, get_limiter
+
+POOL_SIZE = 16
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10
+# Methods that are safe to send twice. Other calls opt in with idempotent=True
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Panel paths about a single server, which Wings on that server's node answers
+SERVER_PATH = re.compile(r"^/api/client/servers/([^/]+)/")
+
+
+class HttpClient:
+    """Keep-alive HTTP session against a single base url, paced by a shared rate limiter"""
+
+    def __init__(self, base_url: str, headers: Dict[str, str], limiter_name: str):
+        self.base_url = base_url
+        self.limiter_name = limiter_name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers)
+
+    @property
+    def limiter(self):
+        return get_limiter(self.limiter_name)
+
+    def breaker_for(self, path: str) -> CircuitBreaker:
+        return get_breaker(self.limiter_name)
+
+    def backoff(self, attempt: int):
+        """Sleep with full jitter, never past the current deadline"""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+        metrics.sleep(deadline.cap(delay), "retry", client=self.limiter_name)
+
+    def request(
+        self, method: str, path: str, idempotent: bool | None = None, **kwargs
+    ) -> requests.Response:
+        """Send a request with timeouts, retrying failures that are safe to retry
+
+        Connection errors and 5xx responses are only retried for idempotent calls,
+        except connect timeouts, which never reached the server. 429s are always
+        retried. Raises CircuitOpenError while the host, or for server requests the
+        server's node, is failing and DeadlineExceeded once the current deadline has passed.
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        limiter, breaker = self.limiter, self.breaker_for(path)
+        url = f"{self.base_url}{path}"
+        for attempt in range(MAX_ATTEMPTS):
+            last_attempt = attempt == MAX_ATTEMPTS - 1
+            deadline.check()
+            trial = breaker.before_request()
+            try:
+                waited = limiter.acquire()
+                if waited:
+                    metrics.record("ratelimit_wait", waited, client=self.limiter_name)
+                deadline.check()
+                kwargs["timeout"] = (
+                    deadline.cap(CONNECT_TIMEOUT),
+                    deadline.cap(READ_TIMEOUT),
+                )
+                try:
+                    with metrics.span(
+                        "http", client=self.limiter_name, method=method, attempt=attempt
+                    ):
+                        response = self.session.request(method, url, **kwargs)
+                except requests.RequestException as e:
+                    breaker.record_failure()
+                    retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                    if not retryable or last_attempt:
+                        raise
+                    log.warning(f"{method} {url} failed ({e}), retrying")
+                    self.backoff(attempt)
+                    continue
+
+                limiter.update(response)
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            finally:
+                # Recording an outcome already ended the trial, this covers
+                # the limiter or deadline raising before the request went out
+                if trial:
+                    breaker.release_trial()
+
+            if last_attempt:
+                break
+            if response.status_code == 429:
+                # The limiter already holds back the next attempt for Retry-After
+                continue
+            if response.status_code in RETRY_STATUS_CODES and idempotent:
+                log.warning(f"{method} {url} returned {response.status_code}, retrying")
+                self.backoff(attempt)
+                continue
+            break
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class PteroClient(HttpClient):
+    """Client for a single Pterodactyl host with auth headers baked in"""
+
+    def __init__(self, host: models.Host):
+        self.host = host
+        super().__init__(
+            host.url,
+            {
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {host.api_token}",
+            },
+            host.url,
+        )
+
+    def breaker_for(self, path: str) -> CircuitBreaker:
+        """One breaker per node for server requests, so a dead node doesn't cut off the panel"""
+        from utils import verify
+
+        match = SERVER_PATH.match(path)
+        node = match and verify.server_index.get(match.group(1), {}).get("node")
+        if node is None:
+            return super().breaker_for(path)
+        return get_breaker(f"{self.limiter_name} node {node}")
+
+
+class RustMapsClient(HttpClient):
+    """Client for the RustMaps.com API"""
+
+    def __init__(self, config: models.Config):
+        super().__init__(
+            config.rustmaps_url,
+            {
+                "accept": "application/json",
+                "Content-Type": "application/json",
+                "X-API-Key": config.rustmaps_api_token,
+            },
+            "rustmaps",
+        )
+
+    @property
+    def limiter(self):
+        return get_limiter(self.limiter_name, RUSTMAPS_RATE, RUSTMAPS_BURST)
+
+
+clients: Dict[Tuple[str, str], HttpClient] = {}
+clients_lock = threading.Lock()
+
+
+def get_client(host: models.Host) -> PteroClient:
+    """Return the shared client for a host, creating it on first use"""
+    key = (host.url, host.api_token)
+    with clients_lock:
+        if key not in clients:
+            clients[key] = PteroClient(host)
+        return clients[key]
+
+
+def get_rustmaps_client(config: models.Config) -> RustMapsClient:
+    key = (config.rustmaps_url, config.rustmaps_api_token)
+    with clients_lock:
+        if key not in clients:
+            clients[key] = RustMapsClient(config)
+        return clients[key]
+
+
+download_session: requests.Session | None = None
+
+
+def close_clients():
+    """Close every pooled connection, run at exit"""
+    global download_session
+    with clients_lock:
+        for client in clients.values():
+            client.close()
+        clients.clear()
+        if download_session is not None:
+            download_session.close()
+            download_session = None
+
+
+atexit.register(close_clients)
+
+
+def download(url: str, destination: str) -> int:
+    """Stream `url` to `destination` a chunk at a time, returning the bytes written
+
+    Uses its own session: signed download urls point at the node, which must not
+    receive the panel API key.
+    """
+    global download_session
+    with clients_lock:
+        if download_session is None:
+            download_session = requests.Session()
+    partial = f"{destination}.part"
+    written = 0
+    try:
+        with download_session.get(
+            url,
+            stream=True,
+            timeout=(deadline.cap(CONNECT_TIMEOUT), deadline.cap(READ_TIMEOUT)),
+        ) as response:
+            response.raise_for_status()
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+                    deadline.check()
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, destination)
+    return written
@@ -0,0 +1,98 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+import models
+from utils.cron import Cron
+
+CONFIG_FILE = "config.json"
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigSnapshot:
+    config: models.Config
+    # server id -> (host, server)
+    servers: Dict[str, Tuple[models.Host, models.Server]]
+    mtime: float
+    version: int
+
+
+def validate(config: models.Config) -> List[str]:
+    """Return a list of problems with the config, empty if it is valid"""
+    problems = []
+    seen: Dict[str, str] = {}
+    for host in config.hosts:
+        for server in host.servers:
+            if server.id in seen:
+                problems.append(
+                    f'Server ID "{server.id}" is configured on both "{seen[server.id]}" and "{host.name}"'
+                )
+            seen[server.id] = host.name
+            if not (
+                server.custom_maps or server.seeds_file or server.rustmaps_seeds_filter
+            ):
+                problems.append(
+                    f'Server ID "{server.id}" needs custom_maps, seeds_file or rustmaps_seeds_filter'
+                )
+            if server.schedule:
+                try:
+                    Cron(server.schedule.cron)
+                    ZoneInfo(server.schedule.timezone)
+                except Exception as e:
+                    problems.append(
+                        f'Server ID "{server.id}" has an invalid schedule: {e}'
+                    )
+    return problems
+
+
+class ConfigRegistry:
+    """Parses config.json once, indexes servers by id and hot-reloads when the file changes"""
+
+    def __init__(self, path: str = CONFIG_FILE):
+        self.path = path
+        self.snapshot: ConfigSnapshot | None = None
+        self.lock = threading.Lock()
+
+    def reload(self, force: bool = False) -> bool:
+        """Re-read the file if it changed. Returns True if a new config was swapped in
+
+        Raises ValueError if the new config is invalid, leaving the current one in place.
+        """
+        with self.lock:
+            mtime = os.stat(self.path).st_mtime
+            current = self.snapshot
+            if current is not None and current.mtime == mtime and not force:
+                return False
+            with open(self.path, "r") as f:
+                config = models.Config.from_json(f.read())
+            problems = validate(config)
+            if problems:
+                raise ValueError("Invalid config.json:\n" + "\n".join(problems))
+            self.snapshot = ConfigSnapshot(
+                config=config,
+                servers={
+                    server.id: (host, server)
+                    for host in config.hosts
+                    for server in host.servers
+                },
+                mtime=mtime,
+                version=current.version + 1 if current else 1,
+            )
+            return True
+
+    def current(self) -> ConfigSnapshot:
+        if self.snapshot is None:
+            self.reload()
+        return self.snapshot
+
+    @property
+    def config(self) -> models.Config:
+        return self.current().config
+
+    def find(self, server_id: str) -> Tuple[models.Host, models.Server] | None:
+        return self.current().servers.get(server_id)
+
+
+registry = ConfigRegistry()
@@ -0,0 +1,83 @@
+import datetime
+from typing import Set
+
+# (minimum, maximum) for minute, hour, day of month, month and day of week
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+def parse_field(field: str, minimum: int, maximum: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f'Invalid cron step "{step_str}"')
+        if part == "*":
+            start, end = minimum, maximum
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = maximum if step > 1 else start
+        if start < minimum or end > maximum or start > end:
+            raise ValueError(f'Cron value "{part}" out of range {minimum}-{maximum}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Standard 5-field cron expression (minute hour day-of-month month day-of-week)"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression "{expression}" must have 5 fields')
+        self.expression = expression
+        # Cron allows 7 for Sunday as well as 0
+        fields[4] = ",".join(
+            "0" if part == "7" else part for part in fields[4].split(",")
+        )
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_field(field, *FIELD_RANGES[i]) for i, field in enumerate(fields)
+        )
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def matches_day(self, date: datetime.date) -> bool:
+        # cron weekday: Sunday = 0, Python weekday: Monday = 0
+        weekday_match = (date.weekday() + 1) % 7 in self.weekdays
+        day_match = date.day in self.days
+        # When both day fields are restricted either one matching is enough
+        if not self.any_day and not self.any_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_after(self, after: datetime.datetime) -> datetime.datetime:
+        """First naive wall-clock time strictly after `after` that matches the expression"""
+        current = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Bounded so an impossible expression (e.g. Feb 31st) can't loop forever
+        limit = current + datetime.timedelta(days=366 * 5)
+        while current < limit:
+            if current.month not in self.months:
+                year = current.year + (current.month == 12)
+                month = current.month % 12 + 1
+                current = current.replace(
+                    year=year, month=month, day=1, hour=0, minute=0
+                )
+                continue
+            if not self.matches_day(current.date()):
+                current = (current + datetime.timedelta(days=1)).replace(
+                    hour=0, minute=0
+                )
+                continue
+            if current.hour not in self.hours:
+                current = (current + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if current.minute not in self.minutes:
+                current += datetime.timedelta(minutes=1)
+                continue
+            return current
+        raise ValueError(f'Cron expression "{self.expression}" never matches')
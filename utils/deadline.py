@@ -0,0 +1,77 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# Deadline of the work running on each thread, as a time.monotonic() value
+local = threading.local()
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float, label: str):
+    """Give the enclosed block `seconds` to finish. Nested deadlines can only shorten it"""
+    previous = getattr(local, "at", None)
+    previous_label = getattr(local, "label", None)
+    at = time.monotonic() + seconds
+    if previous is None or at < previous:
+        local.at, local.label = at, f"{label} ({seconds:.0f}s)"
+    try:
+        yield
+    finally:
+        local.at, local.label = previous, previous_label
+
+
+def remaining() -> float | None:
+    """Seconds left before the current deadline, None if there is none"""
+    at = getattr(local, "at", None)
+    return None if at is None else at - time.monotonic()
+
+
+def cap(seconds: float | None) -> float | None:
+    """Shorten a timeout so it does not run past the current deadline
+
+    Raises DeadlineExceeded if the deadline has already passed, a timeout of 0
+    would mean "don't wait" to some callers and is rejected by others.
+    """
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline for {local.label} exceeded")
+    return left if seconds is None else min(seconds, left)
+
+
+def check():
+    """Raise DeadlineExceeded if the current deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline for {local.label} exceeded")
+
+
+def propagate(function: Callable) -> Callable:
+    """Wrap `function` so it runs under the caller's deadline on a worker thread
+
+    The caller's context variables, such as the log context, come along too.
+    """
+    at = getattr(local, "at", None)
+    label = getattr(local, "label", None)
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = getattr(local, "at", None)
+        previous_label = getattr(local, "label", None)
+        local.at, local.label = at, label
+        try:
+            # A context can only be entered by one thread at a time
+            return context.copy().run(function, *args, **kwargs)
+        finally:
+            local.at, local.label = previous, previous_label
+
+    return wrapper
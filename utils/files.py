@@ -0,0 +1,86 @@
+import re
+from typing import Dict, List, Pattern, Tuple
+
+GLOB_CHARS = "*?["
+
+
+def split_pattern(pattern: str) -> Tuple[str, str]:
+    """Split a glob into the literal directory it starts in and the rest of the pattern
+
+    "oxide/data/**/*.json" -> ("oxide/data/", "**/*.json")
+    """
+    pattern = pattern.lstrip("/")
+    parts = pattern.split("/")
+    base: List[str] = []
+    for part in parts[:-1]:
+        if any(c in part for c in GLOB_CHARS):
+            break
+        base.append(part)
+    directory = "".join(f"{part}/" for part in base)
+    return directory, pattern[len(directory) :]
+
+
+def is_recursive(pattern: str) -> bool:
+    """Whether matching the pattern requires listing below its base directory"""
+    _, rest = split_pattern(pattern)
+    return "/" in rest
+
+
+def group_patterns(patterns: List[str]) -> Dict[str, List[str]]:
+    """Group patterns by the directory they need listed"""
+    groups: Dict[str, List[str]] = {}
+    for pattern in patterns:
+        directory, _ = split_pattern(pattern)
+        groups.setdefault(directory, []).append(pattern.lstrip("/"))
+    return groups
+
+
+def drop_nested(paths: List[str]) -> List[str]:
+    """Drop paths that sit below another path in the list, since deleting a directory removes its contents"""
+    path_set = set(paths)
+    return [
+        path
+        for path in paths
+        if not any(path[:i] in path_set for i, c in enumerate(path) if c == "/")
+    ]
+
+
+def translate(pattern: str) -> str:
+    """Translate a glob to a regex. "*" and "?" stay within a path segment, "**" spans segments"""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1 : end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end + 1
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+def compile_patterns(patterns: List[str]) -> Pattern:
+    """Compile every pattern into one regex so each path is matched in a single pass"""
+    alternatives = "|".join(f"(?:{translate(p.lstrip('/'))})" for p in patterns)
+    return re.compile(rf"(?:{alternatives})\Z")
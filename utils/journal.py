@@ -0,0 +1,294 @@
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+JOURNAL_FILE = "journal.sqlite3"
+# Seconds between heartbeats of the process running a wipe, and how long one may
+# go silent before its running wipes count as crashed and another process takes over
+HEARTBEAT_INTERVAL = 10
+LEASE_TIMEOUT = 60
+
+
+@dataclass
+class WipeRecord:
+    id: int
+    server_id: str
+    force: bool
+    # Last step that completed, None before the first one
+    step: str | None
+    status: str
+    state: Dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+    started_at: str = ""
+    updated_at: str = ""
+    # "hostname:pid" of the process running the wipe, and its last heartbeat (epoch seconds)
+    owner: str | None = None
+    heartbeat_at: float = 0.0
+
+
+def now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def process_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner: str | None) -> bool:
+    """False if `owner` is a process on this machine that has exited"""
+    if not owner:
+        return False
+    hostname, _, pid = owner.rpartition(":")
+    if hostname != socket.gethostname() or not pid.isdigit():
+        # Another machine sharing the journal, only its heartbeat can tell
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class Journal:
+    """Durable record of each wipe's progress, so an interrupted wipe can resume
+
+    Each running wipe is leased to the process running it, which keeps the lease
+    alive with heartbeats. Another process (a cron "wipe" next to the daemon)
+    only takes over a running wipe once its owner has exited or gone silent.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE):
+        self.path = path
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+        self.owner = process_owner()
+        self.heartbeat: threading.Thread | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=FULL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS wipes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    server_id TEXT NOT NULL,
+                    force INTEGER NOT NULL,
+                    step TEXT,
+                    status TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    started_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    owner TEXT,
+                    heartbeat_at REAL NOT NULL DEFAULT 0
+                )""")
+            columns = {
+                row[1] for row in self.connection.execute("PRAGMA table_info(wipes)")
+            }
+            if "owner" not in columns:
+                self.connection.execute("ALTER TABLE wipes ADD COLUMN owner TEXT")
+                self.connection.execute(
+                    "ALTER TABLE wipes ADD COLUMN heartbeat_at REAL NOT NULL DEFAULT 0"
+                )
+            self.connection.commit()
+        return self.connection
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            connection = self._connect()
+            cursor = connection.execute(sql, params)
+            connection.commit()
+            return cursor
+
+    def _record(self, row) -> WipeRecord:
+        return WipeRecord(
+            id=row[0],
+            server_id=row[1],
+            force=bool(row[2]),
+            step=row[3],
+            status=row[4],
+            state=json.loads(row[5]),
+            error=row[6],
+            started_at=row[7],
+            updated_at=row[8],
+            owner=row[9],
+            heartbeat_at=row[10],
+        )
+
+    def _start_heartbeat(self):
+        with self.lock:
+            if self.heartbeat is not None:
+                return
+            self.heartbeat = threading.Thread(
+                target=self._beat, name="journal-heartbeat", daemon=True
+            )
+        self.heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self._execute(
+                    "UPDATE wipes SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                    (time.time(), self.owner),
+                )
+            except sqlite3.Error:
+                # A busy database just delays this beat, the lease has slack
+                pass
+
+    def owned_elsewhere(self, record: WipeRecord) -> bool:
+        """True if another live process is running this wipe"""
+        return (
+            record.status == "running"
+            and record.owner != self.owner
+            and time.time() - record.heartbeat_at < LEASE_TIMEOUT
+            and owner_alive(record.owner)
+        )
+
+    def claim(self, record: WipeRecord) -> bool:
+        """Take over a wipe for this process. False if another live process owns it
+
+        The update only applies if nobody claimed the record since it was read.
+        """
+        if record.owner == self.owner:
+            return True
+        if self.owned_elsewhere(record):
+            return False
+        heartbeat_at = time.time()
+        cursor = self._execute(
+            "UPDATE wipes SET owner = ?, heartbeat_at = ?, status = 'running' WHERE id = ? AND owner IS ? AND heartbeat_at = ?",
+            (self.owner, heartbeat_at, record.id, record.owner, record.heartbeat_at),
+        )
+        if cursor.rowcount != 1:
+            return False
+        record.owner, record.heartbeat_at = self.owner, heartbeat_at
+        record.status = "running"
+        self._start_heartbeat()
+        return True
+
+    def begin(self, server_id: str, force: bool) -> WipeRecord | None:
+        """Record a new wipe owned by this process. None if the server already has a running wipe"""
+        timestamp = now()
+        heartbeat_at = time.time()
+        cursor = self._execute(
+            "INSERT INTO wipes (server_id, force, step, status, state, started_at, updated_at, owner, heartbeat_at) "
+            "SELECT ?, ?, NULL, 'running', '{}', ?, ?, ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM wipes WHERE server_id = ? AND status = 'running')",
+            (
+                server_id,
+                int(force),
+                timestamp,
+                timestamp,
+                self.owner,
+                heartbeat_at,
+                server_id,
+            ),
+        )
+        if cursor.rowcount != 1:
+            return None
+        self._start_heartbeat()
+        return WipeRecord(
+            id=cursor.lastrowid,
+            server_id=server_id,
+            force=force,
+            step=None,
+            status="running",
+            started_at=timestamp,
+            updated_at=timestamp,
+            owner=self.owner,
+            heartbeat_at=heartbeat_at,
+        )
+
+    def complete_step(self, record: WipeRecord, step: str):
+        record.step = step
+        record.status = "running"
+        record.error = None
+        record.updated_at = now()
+        self._execute(
+            "UPDATE wipes SET step = ?, status = 'running', state = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (step, json.dumps(record.state), record.updated_at, record.id),
+        )
+
+    def finish(self, record: WipeRecord, status: str, error: str | None = None):
+        record.status = status
+        record.error = error
+        record.updated_at = now()
+        self._execute(
+            "UPDATE wipes SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, record.updated_at, record.id),
+        )
+
+    def abandon(self, record: WipeRecord) -> bool:
+        """Mark a wipe abandoned so it is never resumed. False if it changed since it was read"""
+        cursor = self._execute(
+            "UPDATE wipes SET status = 'abandoned', updated_at = ? WHERE id = ? AND status = ? AND owner IS ? AND heartbeat_at = ?",
+            (now(), record.id, record.status, record.owner, record.heartbeat_at),
+        )
+        if cursor.rowcount != 1:
+            return False
+        record.status = "abandoned"
+        return True
+
+    def latest(self, server_id: str) -> WipeRecord | None:
+        with self.lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT * FROM wipes WHERE server_id = ? ORDER BY id DESC LIMIT 1",
+                    (server_id,),
+                )
+                .fetchone()
+            )
+        return self._record(row) if row else None
+
+    def active(self, server_id: str) -> WipeRecord | None:
+        """The server's latest wipe if it was still running when its process stopped
+
+        Failed wipes are not active, they are only picked up again by an explicit resume.
+        """
+        record = self.latest(server_id)
+        if not record or record.status != "running":
+            return None
+        return record
+
+    def resumable(self, server_id: str) -> WipeRecord | None:
+        """The server's latest wipe if it failed or was interrupted part way"""
+        record = self.latest(server_id)
+        if not record or record.status not in ("running", "failed"):
+            return None
+        return record
+
+    def in_flight(self) -> List[WipeRecord]:
+        """Wipes still marked running whose process has exited or stopped heartbeating"""
+        with self.lock:
+            rows = (
+                self._connect()
+                .execute("SELECT * FROM wipes WHERE status = 'running' ORDER BY id")
+                .fetchall()
+            )
+        records = [self._record(row) for row in rows]
+        return [
+            record
+            for record in records
+            if record.owner != self.owner and not self.owned_elsewhere(record)
+        ]
+
+    def recent(self, limit: int = 100) -> List[WipeRecord]:
+        with self.lock:
+            rows = (
+                self._connect()
+                .execute("SELECT * FROM wipes ORDER BY id DESC LIMIT ?", (limit,))
+                .fetchall()
+            )
+        return [self._record(row) for row in rows]
+
+
+journal = Journal()
@@ -0,0 +1,179 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Dict, List, Tuple
+
+METRICS_DIRECTORY = "metrics"
+SPANS_FILE = os.path.join(METRICS_DIRECTORY, "spans.jsonl")
+PROMETHEUS_FILE = os.path.join(METRICS_DIRECTORY, "metrics.prom")
+# The spans file is rotated to spans.jsonl.1 at this size, older spans are dropped
+MAX_SPANS_BYTES = 16 * 1024 * 1024
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+lock = threading.Lock()
+# (span name, labels) -> [count, total seconds, errors]
+totals: Dict[LabelKey, List[float]] = {}
+
+# Appends span lines on a background thread, so file I/O never stalls a wipe.
+# Started by the first record().
+writer: QueueListener | None = None
+pending: queue.SimpleQueue = queue.SimpleQueue()
+
+
+def start_writer():
+    global writer
+    os.makedirs(METRICS_DIRECTORY, exist_ok=True)
+    handler = RotatingFileHandler(
+        SPANS_FILE, maxBytes=MAX_SPANS_BYTES, backupCount=1, encoding="utf-8"
+    )
+    writer = QueueListener(pending, handler)
+    writer.start()
+
+
+def stop():
+    """Write out queued spans and stop the writer"""
+    global writer
+    with lock:
+        if writer is not None:
+            writer.stop()
+            for handler in writer.handlers:
+                handler.close()
+            writer = None
+
+
+atexit.register(stop)
+
+
+def record(name: str, duration: float, error: bool = False, **labels):
+    """Record a finished span to the in-memory totals and queue it for the JSON lines log"""
+    labels = {key: str(value) for key, value in labels.items() if value is not None}
+    line = json.dumps(
+        {
+            "name": name,
+            "at": time.time(),
+            "duration": round(duration, 6),
+            "error": error,
+            **labels,
+        }
+    )
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        total = totals.setdefault(key, [0, 0.0, 0])
+        total[0] += 1
+        total[1] += duration
+        total[2] += int(error)
+        if writer is None:
+            start_writer()
+    pending.put_nowait(logging.makeLogRecord({"msg": line}))
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Time the enclosed block"""
+    started = time.monotonic()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(name, time.monotonic() - started, error, **labels)
+
+
+def timed(function):
+    """Record a "call" span around every call of the decorated function"""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span("call", function=f"{function.__module__}.{function.__name__}"):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def sleep(seconds: float, reason: str, **labels):
+    """time.sleep that is accounted for as a "sleep" span"""
+    with span("sleep", reason=reason, **labels):
+        time.sleep(seconds)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """Render the totals in the Prometheus text exposition format"""
+    lines = [
+        "# TYPE ptero_wipe_span_seconds summary",
+        "# TYPE ptero_wipe_span_errors_total counter",
+    ]
+    with lock:
+        items = sorted(totals.items())
+    for (name, labels), (count, seconds, errors) in items:
+        label_text = ",".join(
+            [f'span="{name}"'] + [f'{key}="{escape(value)}"' for key, value in labels]
+        )
+        lines.append(f"ptero_wipe_span_seconds_count{{{label_text}}} {count}")
+        lines.append(f"ptero_wipe_span_seconds_sum{{{label_text}}} {seconds:.6f}")
+        lines.append(f"ptero_wipe_span_errors_total{{{label_text}}} {errors}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file():
+    os.makedirs(METRICS_DIRECTORY, exist_ok=True)
+    text = prometheus_text()
+    # Wipes finish concurrently, so each writer needs its own temporary file
+    temporary = f"{PROMETHEUS_FILE}.{threading.get_ident()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, PROMETHEUS_FILE)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_spans(path: str = SPANS_FILE) -> List[dict]:
+    """Spans from the rotated file and the current one, oldest first"""
+    spans = []
+    for name in (f"{path}.1", path):
+        if not os.path.exists(name):
+            continue
+        with open(name, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    return spans
+
+
+def summarize(
+    spans: List[dict], name: str, group_by: str
+) -> List[Tuple[str, int, float, float, float]]:
+    """(group, count, p50, p95, max) for spans called `name`, grouped by a label"""
+    groups: Dict[str, List[float]] = {}
+    for s in spans:
+        if s.get("name") == name and group_by in s:
+            groups.setdefault(s[group_by], []).append(s["duration"])
+    return [
+        (
+            group,
+            len(durations),
+            percentile(durations, 0.5),
+            percentile(durations, 0.95),
+            max(durations),
+        )
+        for group, durations in groups.items()
+    ]
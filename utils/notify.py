@@ -0,0 +1,178 @@
+import atexit
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+from discord_webhook import DiscordEmbed, DiscordWebhook
+
+from setup_logger import log
+
+# Discord allows up to 10 embeds per message
+MAX_EMBEDS = 10
+# How long to wait for other announcements to the same webhook before sending
+COALESCE_WINDOW = 2
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1
+WEBHOOK_TIMEOUT = 15
+
+
+@dataclass
+class Announcement:
+    webhook_url: str
+    embed: DiscordEmbed
+    server_id: str
+    server_name: str
+    ping_everyone: bool = False
+    ping_role: int | None = None
+
+
+def build_content(announcements: List[Announcement]) -> str | None:
+    """Combine the pings of every announcement in a message"""
+    if any(a.ping_everyone for a in announcements):
+        return "@everyone"
+    roles = dict.fromkeys(a.ping_role for a in announcements if a.ping_role)
+    return " ".join(f"<@&{role}>" for role in roles) or None
+
+
+class WebhookDispatcher:
+    """Queues Discord announcements, batching them per webhook and honouring rate limits"""
+
+    def __init__(self):
+        self.queue: "queue.Queue[Announcement | None]" = queue.Queue()
+        self.blocked_until: Dict[str, float] = {}
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="webhook-dispatcher", daemon=True
+                )
+                self.thread.start()
+
+    def submit(self, announcement: Announcement):
+        self.start()
+        self.queue.put(announcement)
+
+    def _collect(self, first: Announcement) -> List[Announcement] | None:
+        """Gather announcements arriving shortly after `first`. Returns None on shutdown"""
+        batch = [first]
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return batch
+            try:
+                item = self.queue.get(timeout=left)
+            except queue.Empty:
+                return batch
+            if item is None:
+                # Shutdown: send what we have, then stop
+                self.queue.task_done()
+                self._send_batch(batch)
+                return None
+            batch.append(item)
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                self.queue.task_done()
+                return
+            batch = self._collect(first)
+            if batch is None:
+                return
+            self._send_batch(batch)
+
+    def _send_batch(self, batch: List[Announcement]):
+        by_webhook: Dict[str, List[Announcement]] = {}
+        for announcement in batch:
+            by_webhook.setdefault(announcement.webhook_url, []).append(announcement)
+        for url, announcements in by_webhook.items():
+            for i in range(0, len(announcements), MAX_EMBEDS):
+                chunk = announcements[i : i + MAX_EMBEDS]
+                try:
+                    self._send(url, chunk)
+                except Exception:
+                    log.exception("Failed to send Discord webhook")
+        for _ in batch:
+            self.queue.task_done()
+
+    def _send(self, url: str, announcements: List[Announcement]):
+        servers = ", ".join(f'"{a.server_name}"' for a in announcements)
+        for attempt in range(MAX_RETRIES):
+            wait = self.blocked_until.get(url, 0) - time.monotonic()
+            if wait > 0:
+                log.debug("Waiting %.1fs for Discord webhook rate limit", wait)
+                time.sleep(wait)
+
+            webhook = DiscordWebhook(
+                url=url, content=build_content(announcements), timeout=WEBHOOK_TIMEOUT
+            )
+            for announcement in announcements:
+                webhook.add_embed(announcement.embed)
+            try:
+                response = webhook.execute()
+            except Exception as e:
+                log.warning(f"Failed to send webhook for {servers}: {e}")
+                time.sleep(RETRY_BASE_DELAY * 2**attempt + random.random())
+                continue
+
+            self._update_bucket(url, response)
+            if response.status_code in (200, 204):
+                log.info(f"Sent Discord webhook for {servers}")
+                for announcement in announcements:
+                    log.info(
+                        f'Wipe complete for server "{announcement.server_name}" - ID: "{announcement.server_id}"'
+                    )
+                return
+            if response.status_code == 429:
+                continue
+            if response.status_code < 500:
+                log.warning(
+                    f"Failed to send webhook for {servers}. Status code: {response.status_code}"
+                )
+                return
+            time.sleep(RETRY_BASE_DELAY * 2**attempt + random.random())
+        log.error(f"Giving up on webhook for {servers} after {MAX_RETRIES} attempts")
+
+    def _update_bucket(self, url: str, response):
+        """Track Discord's per-webhook bucket from its rate limit headers"""
+        now = time.monotonic()
+        headers = response.headers
+        reset_after = None
+        if response.status_code == 429:
+            try:
+                reset_after = float(response.json().get("retry_after"))
+            except (ValueError, TypeError, AttributeError):
+                reset_after = float(headers.get("Retry-After", 1))
+            log.warning(f"Discord webhook rate limited, retrying in {reset_after:.1f}s")
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = float(headers.get("X-RateLimit-Reset-After", 1))
+        if reset_after is not None:
+            self.blocked_until[url] = now + reset_after
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait for queued announcements to be sent. Returns False on timeout"""
+        if self.thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def stop(self, timeout: float | None = 30):
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+dispatcher = WebhookDispatcher()
+atexit.register(dispatcher.stop)
@@ -0,0 +1,293 @@
+import datetime
+import json
+import shlex
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import models
+from setup_logger import log
+from utils.config import ConfigSnapshot
+
+ACTIONS = ("wipe", "prepare")
+ENTRY_KEYS = {"id", "action", "force", "seed", "size", "custom_map"}
+
+
+@dataclass(frozen=True, slots=True)
+class PlanEntry:
+    server_id: str
+    action: str = "wipe"
+    force: bool = False
+    seed: str | None = None
+    size: str | None = None
+    custom_map: models.CustomMap | None = None
+    # Where the entry came from, for error messages
+    source: str = ""
+
+    @property
+    def has_override(self) -> bool:
+        return bool(self.seed or self.size or self.custom_map)
+
+
+@dataclass(frozen=True, slots=True)
+class Plan:
+    entries: List[PlanEntry]
+    parallelism: int | None = None
+
+
+class PlanError(ValueError):
+    pass
+
+
+def parse_entry(data: Any, source: str) -> PlanEntry:
+    if isinstance(data, str):
+        data = {"id": data}
+    if not isinstance(data, dict):
+        raise PlanError(f"{source}: expected a server id or an object")
+    unknown = set(data) - ENTRY_KEYS
+    if unknown:
+        raise PlanError(f"{source}: unknown key(s) {', '.join(sorted(unknown))}")
+    if "id" not in data:
+        raise PlanError(f'{source}: missing "id"')
+    custom_map = data.get("custom_map")
+    if custom_map is not None:
+        if (
+            not isinstance(custom_map, dict)
+            or not custom_map.get("map_url")
+            or not custom_map.get("image_url")
+        ):
+            raise PlanError(f'{source}: "custom_map" needs map_url and image_url')
+        custom_map = models.CustomMap(
+            map_url=custom_map["map_url"], image_url=custom_map["image_url"]
+        )
+    return PlanEntry(
+        server_id=str(data["id"]),
+        action=str(data.get("action", "wipe")),
+        force=bool(data.get("force", False)),
+        seed=None if data.get("seed") is None else str(data["seed"]),
+        size=None if data.get("size") is None else str(data["size"]),
+        custom_map=custom_map,
+        source=source,
+    )
+
+
+def parse_document(document: Any, name: str) -> Plan:
+    """A plan from parsed JSON/YAML: a list of entries, or {"parallelism": n, "servers": [...]}"""
+    parallelism = None
+    if isinstance(document, dict):
+        parallelism = document.get("parallelism")
+        default_force = bool(document.get("force", False))
+        entries = document.get("servers")
+        if not isinstance(entries, list):
+            raise PlanError(f'{name}: expected a "servers" list')
+    elif isinstance(document, list):
+        default_force = False
+        entries = document
+    else:
+        raise PlanError(f"{name}: expected a list or an object")
+    parsed = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, dict) and default_force and "force" not in entry:
+            entry = {**entry, "force": True}
+        elif isinstance(entry, str) and default_force:
+            entry = {"id": entry, "force": True}
+        parsed.append(parse_entry(entry, f"{name} entry {i + 1}"))
+    return Plan(entries=parsed, parallelism=parallelism)
+
+
+def parse_lines(text: str, name: str) -> Plan:
+    """A plan written as prompt commands, one per line:
+
+    wipe <server id> [force] [seed=<seed> size=<size>] [map_url=<url> image_url=<url>]
+    prepare <server id>
+    """
+    entries = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        source = f"{name} line {number}"
+        try:
+            words = shlex.split(line, comments=True)
+        except ValueError as e:
+            raise PlanError(f"{source}: {e}")
+        if not words:
+            continue
+        action, *rest = words
+        options: Dict[str, Any] = {"action": action}
+        custom_map: Dict[str, str] = {}
+        for word in rest:
+            key, separator, value = word.partition("=")
+            if not separator:
+                if word == "force":
+                    options["force"] = True
+                elif "id" not in options:
+                    options["id"] = word
+                else:
+                    raise PlanError(f'{source}: unexpected "{word}"')
+            elif key in ("map_url", "image_url"):
+                custom_map[key] = value
+            elif key in ("seed", "size"):
+                options[key] = value
+            else:
+                raise PlanError(f'{source}: unknown option "{key}"')
+        if custom_map:
+            options["custom_map"] = custom_map
+        entries.append(parse_entry(options, source))
+    return Plan(entries=entries)
+
+
+def parse_plan(text: str, name: str) -> Plan:
+    """Parse a plan, picking the format from the file name or, for stdin, the content"""
+    if name.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise PlanError("Reading YAML plans needs PyYAML: pip install pyyaml")
+        try:
+            return parse_document(yaml.safe_load(text), name)
+        except yaml.YAMLError as e:
+            raise PlanError(f"{name}: {e}")
+    if name.endswith(".json") or text.lstrip().startswith(("{", "[")):
+        try:
+            return parse_document(json.loads(text), name)
+        except json.JSONDecodeError as e:
+            raise PlanError(f"{name}: {e}")
+    return parse_lines(text, name)
+
+
+def validate_plan(
+    plan: Plan, snapshot: ConfigSnapshot, today: datetime.date | None = None
+) -> List[str]:
+    """Return every problem with the plan, empty if it can run"""
+    from utils.wipe import is_force_wipe_day
+
+    problems = []
+    force_wipe_day = is_force_wipe_day(today)
+    if plan.parallelism is not None and (
+        not isinstance(plan.parallelism, int) or plan.parallelism < 1
+    ):
+        problems.append(
+            f'"parallelism" must be a positive integer, got {plan.parallelism!r}'
+        )
+    seen: Dict[Tuple[str, str], str] = {}
+    for entry in plan.entries:
+        where = f"{entry.source} ({entry.server_id})"
+        if entry.action not in ACTIONS:
+            problems.append(
+                f'{where}: unknown action "{entry.action}", expected one of {", ".join(ACTIONS)}'
+            )
+        key = (entry.action, entry.server_id)
+        if key in seen:
+            problems.append(f"{where}: server is already listed at {seen[key]}")
+        seen[key] = entry.source
+        target = snapshot.servers.get(entry.server_id)
+        if not target:
+            problems.append(f"{where}: server is not in config.json")
+            continue
+        _, server = target
+        if entry.has_override and entry.action != "wipe":
+            problems.append(f"{where}: map overrides only apply to wipes")
+        if entry.custom_map and (entry.seed or entry.size):
+            problems.append(
+                f"{where}: give either a custom map or a seed and size, not both"
+            )
+        if bool(entry.seed) != bool(entry.size):
+            problems.append(f"{where}: seed and size must be given together")
+        for field in ("seed", "size"):
+            value = getattr(entry, field)
+            if value is not None and not value.isdigit():
+                problems.append(f'{where}: {field} must be a number, got "{value}"')
+        if (
+            entry.action == "wipe"
+            and force_wipe_day
+            and not entry.force
+            and not server.wipe_on_force_wipe
+        ):
+            problems.append(
+                f"{where}: today is force wipe day and the server does not wipe on it, add force to wipe anyway"
+            )
+    return problems
+
+
+def map_override(entry: PlanEntry) -> models.PreparedMap | None:
+    if not entry.has_override:
+        return None
+    return models.PreparedMap(
+        server_id=entry.server_id,
+        prepared_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        custom_map=entry.custom_map,
+        seed=entry.seed,
+        size=entry.size,
+        image_url=entry.custom_map.image_url if entry.custom_map else None,
+    )
+
+
+def run_plan(
+    snapshot: ConfigSnapshot, plan: Plan, parallelism: int | None = None
+) -> Dict[str, Any]:
+    """Run a validated plan: prepares first, then wipes. Returns a JSON-serialisable summary"""
+    from utils import notify, prepare, wipe
+    from utils.journal import journal
+
+    config = snapshot.config
+    parallelism = parallelism or plan.parallelism
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    results: List[Dict[str, Any]] = []
+
+    prepares = [e for e in plan.entries if e.action == "prepare"]
+    if prepares:
+        outcome = prepare.prepare_servers(
+            config, [snapshot.servers[e.server_id] for e in prepares], parallelism
+        )
+        for entry in prepares:
+            results.append(
+                {
+                    "server": entry.server_id,
+                    "action": "prepare",
+                    "ok": outcome[entry.server_id],
+                }
+            )
+
+    wipes = [e for e in plan.entries if e.action == "wipe"]
+    if wipes:
+        outcome = wipe.wipe_servers(
+            config,
+            [snapshot.servers[e.server_id] for e in wipes],
+            forced={e.server_id for e in wipes if e.force},
+            map_overrides={
+                e.server_id: map_override(e) for e in wipes if e.has_override
+            },
+            parallelism=parallelism,
+        )
+        # Announcements finish in the background, the summary should include them
+        wipe.wait_for_wipes()
+        notify.dispatcher.flush()
+        for entry in wipes:
+            record = journal.latest(entry.server_id)
+            ok = (
+                outcome[entry.server_id]
+                and record is not None
+                and record.status == "done"
+            )
+            result = {"server": entry.server_id, "action": "wipe", "ok": ok}
+            if record:
+                result.update(
+                    journal_id=record.id,
+                    status=record.status,
+                    step=record.step,
+                    error=record.error,
+                    started_at=record.started_at,
+                    finished_at=record.updated_at,
+                    downtime_seconds=record.state.get("downtime_seconds"),
+                )
+            results.append(result)
+
+    finished_at = datetime.datetime.now(datetime.timezone.utc)
+    succeeded = sum(result["ok"] for result in results)
+    log.info(f"Plan finished: {succeeded}/{len(results)} succeeded")
+    return {
+        "started_at": started_at.isoformat(),
+        "finished_at": finished_at.isoformat(),
+        "duration_seconds": round((finished_at - started_at).total_seconds(), 3),
+        "parallelism": parallelism,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
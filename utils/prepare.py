@@ -0,0 +1,138 @@
+import datetime
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import models
+from setup_logger import log
+from utils import utils
+
+PREPARED_DIRECTORY = "prepared"
+# Prepared maps older than this are ignored at wipe time
+MAX_PREPARED_AGE = datetime.timedelta(days=7)
+
+
+def choose_map(
+    config: models.Config, server: models.Server
+) -> Tuple[models.CustomMap | None, utils.Seed | None]:
+    """Pick the custom map or procedural seed the server should wipe to"""
+    if len(server.custom_maps) > 0:
+        if server.pick_random_map:
+            return random.choice(server.custom_maps), None
+        # TODO: Figure out how to rotate maps
+        return server.custom_maps[0], None
+
+    seed = None
+    if server.rustmaps_seeds_filter:
+        seed = utils.get_random_map_from_filter(config, server.rustmaps_seeds_filter)
+        log.info(f'ID: "{server.id}" - Using seed from RustMaps.com filter: {seed}')
+    if server.seeds_file:
+        seed = utils.pick_random_seed(server)
+        log.info(
+            f'ID: "{server.id}" - Using seed from {server.seeds_file} file: {seed}'
+        )
+    return None, seed
+
+
+def prepared_path(server: models.Server) -> str:
+    return os.path.join(PREPARED_DIRECTORY, f"{server.id}.json")
+
+
+def load_prepared(server: models.Server) -> models.PreparedMap | None:
+    path = prepared_path(server)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        prepared = models.PreparedMap.from_json(f.read())
+    prepared_at = datetime.datetime.fromisoformat(prepared.prepared_at)
+    if datetime.datetime.now(datetime.timezone.utc) - prepared_at > MAX_PREPARED_AGE:
+        log.warning(
+            f'ID: "{server.id}" - Ignoring prepared map from {prepared.prepared_at}, it is too old'
+        )
+        return None
+    return prepared
+
+
+def save_prepared(prepared: models.PreparedMap):
+    os.makedirs(PREPARED_DIRECTORY, exist_ok=True)
+    path = os.path.join(PREPARED_DIRECTORY, f"{prepared.server_id}.json")
+    # Write then rename so a crash never leaves a half-written file behind
+    with open(f"{path}.tmp", "w") as f:
+        f.write(prepared.to_json())
+    os.replace(f"{path}.tmp", path)
+
+
+def discard_prepared(server: models.Server):
+    path = prepared_path(server)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def prepare_server(
+    config: models.Config, server: models.Server
+) -> models.PreparedMap | None:
+    """Pick the next map for a server, have RustMaps render it and store the result"""
+    log.info(f'Preparing map for server "{server.name}" - ID: "{server.id}"')
+    custom_map, seed = choose_map(config, server)
+    prepared = models.PreparedMap(
+        server_id=server.id,
+        prepared_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        custom_map=custom_map,
+    )
+    if custom_map:
+        prepared.image_url = custom_map.image_url
+    elif seed:
+        prepared.seed = str(seed["seed"])
+        prepared.size = str(seed["size"])
+        prepared.generated_map_id = utils.generate_rustmaps_map(
+            config, prepared.seed, prepared.size
+        )
+        if not prepared.generated_map_id:
+            log.warning(
+                f'ID: "{server.id}" - Failed to submit map generation request for seed {prepared.seed} - size {prepared.size}'
+            )
+        else:
+            prepared.image_url = utils.wait_for_generated_map_url(
+                config, prepared.generated_map_id
+            )
+    else:
+        log.error(f'ID: "{server.id}" - No map source configured')
+        return None
+
+    save_prepared(prepared)
+    log.info(
+        f'ID: "{server.id}" - Prepared map'
+        + (
+            f" {custom_map.map_url}"
+            if custom_map
+            else f" seed {prepared.seed} - size {prepared.size}"
+        )
+    )
+    return prepared
+
+
+def prepare_servers(
+    config: models.Config,
+    targets: List[Tuple[models.Host, models.Server]],
+    parallelism: int | None = None,
+) -> Dict[str, bool]:
+    def run(server: models.Server) -> bool:
+        try:
+            return prepare_server(config, server) is not None
+        except Exception:
+            log.exception(f'ID: "{server.id}" - Prepare failed')
+            return False
+
+    if not targets:
+        return {}
+
+    with ThreadPoolExecutor(
+        max_workers=min(len(targets), parallelism or len(targets)),
+        thread_name_prefix="prepare",
+    ) as executor:
+        futures = {server.id: executor.submit(run, server) for _, server in targets}
+        results = {server_id: f.result() for server_id, f in futures.items()}
+
+    log.info(f"Prepared {sum(results.values())}/{len(results)} server(s)")
+    return results
@@ -0,0 +1,41 @@
+import datetime
+import threading
+from typing import Callable, List
+
+from setup_logger import log
+
+Listener = Callable[[dict], None]
+
+listeners: List[Listener] = []
+listeners_lock = threading.Lock()
+
+
+def subscribe(listener: Listener):
+    """Call `listener` with every progress event. It runs on the wipe's thread, so keep it quick"""
+    with listeners_lock:
+        listeners.append(listener)
+
+
+def unsubscribe(listener: Listener):
+    with listeners_lock:
+        if listener in listeners:
+            listeners.remove(listener)
+
+
+def publish(event: str, server_id: str, **fields):
+    """Send a progress event, e.g. publish("step", "abc123", step="stop", status="done")"""
+    with listeners_lock:
+        current = list(listeners)
+    if not current:
+        return
+    message = {
+        "event": event,
+        "server": server_id,
+        "at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        **fields,
+    }
+    for listener in current:
+        try:
+            listener(message)
+        except Exception:
+            log.exception("Progress listener failed")
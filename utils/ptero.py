@@ -1,29 +1,86 @@
-import fnmatch
+import logging
+import os
+import threading
 import time
-from typing import List
-
-import requests
-from discord_webhook import DiscordWebhook
-from rich import inspect, print
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Set, Tuple
 
 import models
 from setup_logger import log
+from utils import deadline, files, metrics
+from utils.client import download, get_client
 
+# Concurrent directory listings / delete batches per server
+LIST_WORKERS = 8
+# Most file names sent in one delete or compress request
+DELETE_BATCH_SIZE = 250
+ARCHIVE_DIRECTORY = "archives"
+
+# Per-host semaphores limiting concurrent archive downloads from its nodes
+download_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+download_semaphores_lock = threading.Lock()
+
+
+def get_download_semaphore(host: models.Host) -> threading.BoundedSemaphore:
+    with download_semaphores_lock:
+        if host.name not in download_semaphores:
+            download_semaphores[host.name] = threading.BoundedSemaphore(
+                max(1, host.max_concurrent_downloads)
+            )
+        return download_semaphores[host.name]
+
+
+@metrics.timed
+def get_server_state(host: models.Host, server: models.Server) -> str:
+    """Current power state. Raises requests.HTTPError if the panel answers with an error"""
+    response = get_client(host).get(f"/api/client/servers/{server.id}/resources")
+    # Error bodies (429, 5xx, 409 while the server is busy) have no attributes
+    response.raise_for_status()
+    return response.json()["attributes"]["current_state"]
+
+
+@metrics.timed
+def get_server_resources(host: models.Host, server: models.Server) -> dict | None:
+    """Current state and resource usage (cpu_absolute, memory_bytes, ...), None on failure"""
+    response = get_client(host).get(f"/api/client/servers/{server.id}/resources")
+    if response.status_code != 200:
+        return None
+    return response.json()["attributes"]
 
-def send_command(host: models.Host, server: models.Server, command: str) -> bool:
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
-    }
 
-    time.sleep(1)
+@metrics.timed
+def list_servers(host: models.Host) -> List[dict]:
+    """List every server the API key can see, following pagination"""
+    client = get_client(host)
+
+    def get_page(page: int) -> dict:
+        response = client.get("/api/client", params={"page": page})
+        response.raise_for_status()
+        return response.json()
+
+    first_page = get_page(1)
+    servers = list(first_page["data"])
+    total_pages = first_page.get("meta", {}).get("pagination", {}).get("total_pages", 1)
+    if total_pages > 1:
+        with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+            for page in executor.map(
+                deadline.propagate(get_page), range(2, total_pages + 1)
+            ):
+                servers.extend(page["data"])
+    return servers
+
+
+@metrics.timed
+def send_command(host: models.Host, server: models.Server, command: str) -> bool:
+    client = get_client(host)
     log.debug(
-        f'Sending command: "{command}" to server: "{server.name}" - ID: "{server.id}"'
+        'Sending command: "%s" to server: "%s" - ID: "%s"',
+        command,
+        server.name,
+        server.id,
     )
-    response = requests.post(
-        f"{host.url}/api/client/servers/{server.id}/command",
-        headers=headers,
+    response = client.post(
+        f"/api/client/servers/{server.id}/command",
         json={"command": command},
     )
     if response.status_code == 204:
@@ -32,155 +89,383 @@ def send_command(host: models.Host, server: models.Server, command: str) -> bool
         return False
 
 
-def delete_files(
-    host: models.Host, server: models.Server, file_list: List[str]
-) -> bool:
-    matched_files = []
+@metrics.timed
+def list_directory(
+    host: models.Host, server: models.Server, directory: str
+) -> List[models.PteroFile]:
+    log.debug(
+        'Getting file list for directory: %s on server: "%s" - ID: "%s"',
+        directory or "/",
+        server.name,
+        server.id,
+    )
+    response = get_client(host).get(
+        f"/api/client/servers/{server.id}/files/list",
+        params={"directory": directory or "/"},
+    )
+    if response.status_code != 200:
+        log.debug(
+            'Failed to list directory: %s on server: "%s" - ID: "%s" (status code %s)',
+            directory or "/",
+            server.name,
+            server.id,
+            response.status_code,
+        )
+        return []
+    return [
+        models.PteroFile.from_dict(file_data["attributes"])
+        for file_data in response.json()["data"]
+    ]
+
+
+def list_paths(
+    host: models.Host,
+    server: models.Server,
+    directories: Dict[str, bool],
+    cache: Dict[str, List[models.PteroFile]] | None = None,
+    prefetch: Iterable[str] = (),
+) -> List[str]:
+    """List every path in `directories` (directory -> recursive), listing each directory once.
+
+    Directories on the same level are listed concurrently. Listings are kept in
+    `cache` so callers can share them between calls. Directories in `prefetch`,
+    e.g. from an earlier listing, are listed along with the first level so a
+    deep tree isn't listed one level at a time.
+    """
+    cache = {} if cache is None else cache
+    paths: Set[str] = set()
+    pending = dict(directories)
+    extra = list(prefetch)
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+        while pending:
+            to_list = [
+                directory
+                for directory in dict.fromkeys([*pending, *extra])
+                if directory not in cache
+            ]
+            extra = []
+            listings = executor.map(
+                deadline.propagate(
+                    lambda directory: list_directory(host, server, directory)
+                ),
+                to_list,
+            )
+            for directory, listing in zip(to_list, listings):
+                cache[directory] = listing
+            next_pending: Dict[str, bool] = {}
+            for directory, recursive in pending.items():
+                for file in cache[directory]:
+                    path = f"{directory}{file.name}"
+                    paths.add(path)
+                    if recursive and not file.is_file and not file.is_symlink:
+                        next_pending[f"{path}/"] = True
+            pending = next_pending
+    return sorted(paths)
+
 
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
+@metrics.timed
+def list_files(
+    host: models.Host,
+    server: models.Server,
+    file_list: List[str],
+    cache: Dict[str, List[models.PteroFile]],
+) -> int:
+    """List every directory the glob patterns in `file_list` look in, filling `cache`.
+
+    Lets a wipe do the slow listing while the server is still running and hand
+    the listings to delete_files. Returns the number of paths found.
+    """
+    groups = files.group_patterns(file_list)
+    directories = {
+        directory: any(files.is_recursive(pattern) for pattern in patterns)
+        for directory, patterns in groups.items()
     }
+    return len(list_paths(host, server, directories, cache))
 
-    # file_list: List[models.PteroFile] = []
-    file_paths: List[str] = []
 
-    for file in file_list:
-        directory = f"{file.rsplit('/', 1)[0]}/"
-        time.sleep(1)
-        log.debug(
-            f'Getting file list for directory: {directory} on server: "{server.name}" - ID: "{server.id}"'
+@metrics.timed
+def compress_files(
+    host: models.Host, server: models.Server, root: str, file_list: List[str]
+) -> str | None:
+    """Have the panel archive files in `root`. Returns the archive's name, created in `root`"""
+    response = get_client(host).post(
+        f"/api/client/servers/{server.id}/files/compress",
+        json={"root": f"/{root}", "files": file_list},
+    )
+    if response.status_code != 200:
+        log.error(
+            f'ID: "{server.id}" - Failed to archive {len(file_list)} file(s) in "/{root}" (status code {response.status_code})'
         )
-        response = requests.get(
-            f"{host.url}/api/client/servers/{server.id}/files/list?directory={directory}",
-            headers=headers,
+        return None
+    return response.json()["attributes"]["name"]
+
+
+@metrics.timed
+def download_file(
+    host: models.Host, server: models.Server, path: str, destination: str
+) -> int | None:
+    """Stream a server file to `destination`. Returns the bytes written, None on failure"""
+    response = get_client(host).get(
+        f"/api/client/servers/{server.id}/files/download", params={"file": f"/{path}"}
+    )
+    if response.status_code != 200:
+        log.error(
+            f'ID: "{server.id}" - Failed to get a download link for "/{path}" (status code {response.status_code})'
         )
-        for file_data in response.json()["data"]:
-            file_name = file_data["attributes"]["name"]
-            file_paths.append(f"{directory}{file_name}")
-        break
-
-    for file_path in file_paths:
-        for pattern in file_list:
-            if fnmatch.fnmatch(file_path, pattern):
-                log.debug(f"Matched {pattern} with {file_path}")
-                matched_files.append(file_path)
-                break
-
-    for file in matched_files:
-        log.info(f"Matched file: {file}")
-
-    json_data = {
-        "root": "/",
-        "files": matched_files,
-    }
+        return None
+    url = response.json()["attributes"]["url"]
+    with get_download_semaphore(host):
+        with metrics.span("download", host=host.name):
+            return download(url, destination)
 
-    time.sleep(1)
-    log.debug(
-        f'Deleting files: {matched_files} on server: "{server.name}" - ID: "{server.id}"'
+
+def archive_batch(
+    host: models.Host,
+    server: models.Server,
+    root: str,
+    batch: List[str],
+    archive_directory: str,
+) -> Tuple[str, int] | None:
+    """Archive files server-side and download the archive. Returns (archive name, bytes)"""
+    archive = compress_files(host, server, root, batch)
+    if not archive:
+        return None
+    os.makedirs(archive_directory, exist_ok=True)
+    prefix = root.strip("/").replace("/", "_") or "root"
+    size = download_file(
+        host,
+        server,
+        f"{root}{archive}",
+        os.path.join(archive_directory, f"{prefix}-{archive}"),
     )
-    response = requests.post(
-        f"{host.url}/api/client/servers/{server.id}/files/delete",
-        headers=headers,
-        json=json_data,
+    if size is None:
+        return None
+    return archive, size
+
+
+@metrics.timed
+def delete_files(
+    host: models.Host,
+    server: models.Server,
+    file_list: List[str],
+    dry_run: bool = False,
+    cache: Dict[str, List[models.PteroFile]] | None = None,
+    archive_directory: str | None = None,
+    prefetch: Iterable[str] = (),
+) -> bool:
+    """Delete files matching the glob patterns in `file_list`.
+
+    `cache` and `prefetch` are passed to list_paths. With `archive_directory`, each batch is first archived on the server and the
+    archive downloaded there. A batch is only deleted once its archive is safe.
+    Returns False if any matched file could not be archived or deleted, finding
+    nothing to delete is not a failure.
+    """
+    client = get_client(host)
+    cache = {} if cache is None else cache
+    timings: Dict[str, float] = {}
+
+    started = time.monotonic()
+    groups = files.group_patterns(file_list)
+    directories = {
+        directory: any(files.is_recursive(pattern) for pattern in patterns)
+        for directory, patterns in groups.items()
+    }
+    file_paths = list_paths(host, server, directories, cache, prefetch)
+    timings["list"] = time.monotonic() - started
+
+    started = time.monotonic()
+    matcher = files.compile_patterns(file_list)
+    matched_files = files.drop_nested(
+        [path for path in file_paths if matcher.match(path)]
     )
+    timings["match"] = time.monotonic() - started
 
-    if response.status_code == 422:
-        log.warn(f"No files matched for deletion.")
-        return False
+    log.info(f'ID: "{server.id}" - Matched {len(matched_files)} file(s) for deletion')
+    if dry_run:
+        # Showing what would be deleted is the point of a dry run
+        log.info("Matched files:\n%s", "\n".join(matched_files))
+    elif log.isEnabledFor(logging.DEBUG):
+        log.debug("Matched files:\n%s", "\n".join(matched_files))
 
-    if response.status_code != 204:
-        return False
-    return True
+    if not matched_files:
+        log.warning(f"No files matched for deletion.")
+        return True
+
+    # One batched delete per pattern root, with paths relative to that root
+    roots = sorted(groups, key=len, reverse=True)
+    batches: Dict[str, List[str]] = {}
+    for path in matched_files:
+        root = next(root for root in roots if path.startswith(root))
+        batches.setdefault(root, []).append(path[len(root) :])
+
+    # Split large batches so no single request carries thousands of names
+    chunks = [
+        (root, batch[i : i + DELETE_BATCH_SIZE])
+        for root, batch in batches.items()
+        for i in range(0, len(batch), DELETE_BATCH_SIZE)
+    ]
+    archived_bytes: List[int] = []
+
+    def delete_batch(root: str, batch: List[str]) -> bool:
+        if archive_directory:
+            archived = archive_batch(host, server, root, batch, archive_directory)
+            if not archived:
+                log.error(
+                    f'ID: "{server.id}" - Not deleting {len(batch)} file(s) in "/{root}", they could not be archived'
+                )
+                return False
+            archive, size = archived
+            archived_bytes.append(size)
+            # Remove the server-side copy of the archive along with the files
+            batch = batch + [archive]
+        log.debug(
+            'Deleting files: %s in "/%s" on server: "%s" - ID: "%s"',
+            batch,
+            root,
+            server.name,
+            server.id,
+        )
+        response = client.post(
+            f"/api/client/servers/{server.id}/files/delete",
+            json={"root": f"/{root}", "files": batch},
+            # Deleting the same files twice is harmless
+            idempotent=True,
+        )
+        if response.status_code == 422:
+            # Also what a retried delete sees when the first attempt went through
+            log.warning(f'No files matched for deletion in "/{root}".')
+            return True
+        return response.status_code == 204
 
+    if dry_run:
+        for root, batch in batches.items():
+            log.info(f'Would delete {len(batch)} file(s) in "/{root}"')
+        result = True
+    else:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+            results = list(
+                executor.map(
+                    deadline.propagate(lambda item: delete_batch(*item)), chunks
+                )
+            )
+        timings["delete"] = time.monotonic() - started
+        result = all(results)
+        if archive_directory:
+            total = sum(archived_bytes)
+            seconds = timings["delete"]
+            log.info(
+                f'ID: "{server.id}" - Archived {total / 1024 / 1024:.1f} MiB to {archive_directory} in {seconds:.1f}s ({total / 1024 / 1024 / max(seconds, 1e-6):.1f} MiB/s)'
+            )
 
+    timing_report = ", ".join(
+        f"{step} {seconds:.2f}s" for step, seconds in timings.items()
+    )
+    message = f'ID: "{server.id}" - Listed {len(cache)} directories, matched {len(matched_files)} of {len(file_paths)} paths ({timing_report})'
+    if dry_run:
+        log.info(message)
+    else:
+        log.debug(message)
+    return result
+
+
+@metrics.timed
 def stop_server(host: models.Host, server: models.Server) -> bool:
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
-    }
-    time.sleep(1)
-    log.debug(f'Stopping server: "{server.name}" - ID: "{server.id}"')
-    response = requests.post(
-        f"{host.url}/api/client/servers/{server.id}/power",
-        headers=headers,
+    client = get_client(host)
+    log.debug('Stopping server: "%s" - ID: "%s"', server.name, server.id)
+    response = client.post(
+        f"/api/client/servers/{server.id}/power",
         json={"signal": "stop"},
+        idempotent=True,
     )
     if response.status_code != 204:
         return False
     return True
 
 
+@metrics.timed
 def start_server(host: models.Host, server: models.Server) -> bool:
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
-    }
-    time.sleep(1)
-    log.debug(f'Starting server: "{server.name}" - ID: "{server.id}"')
-    response = requests.post(
-        f"{host.url}/api/client/servers/{server.id}/power",
-        headers=headers,
+    client = get_client(host)
+    log.debug('Starting server: "%s" - ID: "%s"', server.name, server.id)
+    response = client.post(
+        f"/api/client/servers/{server.id}/power",
         json={"signal": "start"},
+        idempotent=True,
     )
     if response.status_code != 204:
         return False
     return True
 
 
-def change_seed(host: models.Host, server: models.Server, seed: str, size: str) -> bool:
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
-    }
-    time.sleep(1)
-    log.debug(f'Changing seed to "{seed}" and world size to "{size}')
-    response = requests.put(
-        f"{host.url}/api/client/servers/{server.id}/startup/variable",
-        headers=headers,
-        json={"key": "WORLD_SIZE", "value": size},
-    )
+@metrics.timed
+def get_startup_variables(
+    host: models.Host, server: models.Server
+) -> Dict[str, str] | None:
+    """Current value of every startup variable, or None if they could not be read"""
+    response = get_client(host).get(f"/api/client/servers/{server.id}/startup")
     if response.status_code != 200:
-        log.error(f'Failed to change world size to "{size}"')
-        return False
-    log.debug(f'Changed world size to "{size}"')
-    time.sleep(1)
-    log.debug(f'Changing seed to "{seed}"')
-    response = requests.put(
-        f"{host.url}/api/client/servers/{server.id}/startup/variable",
-        headers=headers,
-        json={"key": "WORLD_SEED", "value": seed},
-    )
+        log.debug(
+            'Failed to read startup variables on server: "%s" - ID: "%s" (status code %s)',
+            server.name,
+            server.id,
+            response.status_code,
+        )
+        return None
+    return {
+        variable["attributes"]["env_variable"]: variable["attributes"]["server_value"]
+        for variable in response.json()["data"]
+    }
 
-    if response.status_code != 200:
-        log.error(f'Failed to change seed to "{seed}"')
-        return False
-    log.debug(f'Changed seed to "{seed}"')
-    return True
 
+@metrics.timed
+def apply_startup_variables(
+    host: models.Host, server: models.Server, variables: Dict[str, str]
+) -> bool:
+    """Set startup variables, skipping ones that already have the value.
 
-def change_custom_map(
-    host: models.Host, server: models.Server, custom_map: models.CustomMap
-):
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {host.api_token}",
-    }
-    time.sleep(1)
-    log.debug(f"Changing map url to {custom_map.map_url}.")
-    response = requests.put(
-        f"{host.url}/api/client/servers/{server.id}/startup/variable",
-        headers=headers,
-        json={"key": "MAP_URL", "value": custom_map.map_url},
-    )
-    if response.status_code != 200:
-        log.error(f"Failed to change map url to {custom_map.map_url}")
-        return False
-    log.debug(f"Changed map url to {custom_map.map_url}.")
+    Reads the current values once, then sends the remaining updates
+    concurrently and checks the panel stored each value.
+    """
+    client = get_client(host)
+    variables = {key: str(value) for key, value in variables.items()}
+    current = get_startup_variables(host, server)
+    if current is None:
+        changes = dict(variables)
+    else:
+        changes = {
+            key: value for key, value in variables.items() if current.get(key) != value
+        }
+        for key in changes:
+            if key not in current:
+                log.warning(
+                    f'ID: "{server.id}" - Startup variable "{key}" does not exist on this server'
+                )
+    if not changes:
+        log.debug('ID: "%s" - Startup variables already up to date', server.id)
+        return True
 
-    return True
+    def update(key: str, value: str) -> bool:
+        log.debug('Changing %s to "%s"', key, value)
+        response = client.put(
+            f"/api/client/servers/{server.id}/startup/variable",
+            json={"key": key, "value": value},
+        )
+        if response.status_code != 200:
+            log.error(
+                f'Failed to change {key} to "{value}" (status code {response.status_code})'
+            )
+            return False
+        stored = response.json().get("attributes", {}).get("server_value")
+        if stored != value:
+            log.error(f'Changed {key} to "{value}" but the panel stored "{stored}"')
+            return False
+        log.debug('Changed %s to "%s"', key, value)
+        return True
+
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+        results = list(
+            executor.map(
+                deadline.propagate(lambda item: update(*item)), changes.items()
+            )
+        )
+    return all(results)
@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Dict
+
+import requests
+
+from setup_logger import log, sampled_debug
+
+# Pterodactyl throttles the client API to 240 requests per minute by default
+PTERO_RATE = 4.0
+PTERO_BURST = 10
+RUSTMAPS_RATE = 1.0
+RUSTMAPS_BURST = 5
+
+
+class RateLimiter:
+    """Token bucket that only blocks once the bucket is empty or the server asked us to back off"""
+
+    def __init__(self, name: str, rate: float, capacity: int, window: float = 60.0):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        # Window that X-RateLimit-Limit refers to
+        self.window = window
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> float:
+        """Take a token, sleeping only as long as needed. Returns the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            sampled_debug(
+                f"ratelimit:{self.name}",
+                10,
+                'Rate limiter "%s" waiting %.2fs',
+                self.name,
+                delay,
+            )
+            time.sleep(delay)
+            waited += delay
+
+    def update(self, response: requests.Response):
+        """Adjust the bucket from X-RateLimit-* and Retry-After response headers"""
+        headers = response.headers
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            limit = parse_number(headers.get("X-RateLimit-Limit"))
+            if limit:
+                self.rate = limit / self.window
+                self.capacity = max(1, min(int(limit), self.capacity))
+
+            remaining = parse_number(headers.get("X-RateLimit-Remaining"))
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+
+            retry_after = parse_number(headers.get("Retry-After"))
+            if retry_after is None and response.status_code == 429:
+                retry_after = parse_number(headers.get("X-RateLimit-Reset-After"))
+                if retry_after is None:
+                    retry_after = self.window / max(1, self.capacity)
+            if retry_after is not None and response.status_code in (429, 503):
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.tokens = 0
+                log.warning(
+                    f'Rate limited by "{self.name}", backing off for {retry_after:.1f}s'
+                )
+
+
+def parse_number(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+limiters: Dict[str, RateLimiter] = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(
+    name: str, rate: float = PTERO_RATE, capacity: int = PTERO_BURST
+) -> RateLimiter:
+    """Return the shared limiter for a host (or API) name, creating it on first use"""
+    with limiters_lock:
+        if name not in limiters:
+            limiters[name] = RateLimiter(name, rate, capacity)
+        return limiters[name]
@@ -0,0 +1,300 @@
+import dataclasses
+import datetime
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import models
+from setup_logger import log
+from utils import prepare, wipe
+from utils.cron import Cron
+
+# Upper bound on a single sleep so shutdown and clock drift are noticed promptly
+MAX_SLEEP = 60
+MAX_WORKERS = 8
+
+
+class SystemClock:
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def sleep(self, seconds: float):
+        time.sleep(min(seconds, MAX_SLEEP))
+
+
+class FakeClock:
+    """Clock whose sleep just moves time forward, for simulating schedules"""
+
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    def sleep(self, seconds: float):
+        self.current += datetime.timedelta(seconds=seconds)
+
+
+class InlineExecutor:
+    """Runs submitted work immediately on the calling thread, for simulations"""
+
+    def submit(self, function: Callable, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+@dataclass
+class PlannedWipe:
+    at: datetime.datetime
+    force: bool
+    # Whether the wipe falls on force wipe day in the schedule's timezone
+    force_wipe_day: bool = False
+
+
+def next_wipe(server: models.Server, after: datetime.datetime) -> PlannedWipe:
+    """Next scheduled wipe for a server strictly after `after` (an aware datetime)"""
+    schedule = server.schedule
+    zone = ZoneInfo(schedule.timezone)
+    cron = Cron(schedule.cron)
+    start = after.astimezone(zone).replace(tzinfo=None)
+    local = start
+    force_time = (
+        datetime.time.fromisoformat(schedule.force_wipe_time)
+        if schedule.force_wipe_time
+        else None
+    )
+
+    while True:
+        candidate = cron.next_after(local)
+        force = False
+        if wipe.is_force_wipe_day(candidate.date()):
+            if not server.wipe_on_force_wipe:
+                log.debug(
+                    'ID: "%s" - Skipping scheduled wipe at %s, it is on force wipe day',
+                    server.id,
+                    candidate,
+                )
+                local = candidate
+                continue
+            # The force wipe itself is handled by force_wipe_time below
+            if force_time:
+                local = candidate
+                continue
+        # Force wipe happens on the first Thursday between `after` and the cron candidate.
+        # Searched from `start`, skipped candidates may lie after an earlier force slot.
+        if force_time and server.wipe_on_force_wipe:
+            day = start.date()
+            while day <= candidate.date():
+                force_at = datetime.datetime.combine(day, force_time)
+                if wipe.is_force_wipe_day(day) and start < force_at <= candidate:
+                    candidate = force_at
+                    force = True
+                    break
+                day += datetime.timedelta(days=1)
+        return PlannedWipe(
+            candidate.replace(tzinfo=zone),
+            force,
+            wipe.is_force_wipe_day(candidate.date()),
+        )
+
+
+def same_target(
+    old: Tuple[models.Host, models.Server], new: Tuple[models.Host, models.Server]
+) -> bool:
+    """Whether a server and its host settings are unchanged, ignoring the host's other servers"""
+    (old_host, old_server), (new_host, new_server) = old, new
+    return old_server == new_server and dataclasses.replace(
+        old_host, servers=[]
+    ) == dataclasses.replace(new_host, servers=[])
+
+
+class Scheduler:
+    """Fires each server's scheduled wipes, running its prepare step ahead of time"""
+
+    def __init__(
+        self,
+        config: models.Config,
+        clock=None,
+        wipe_servers: Callable = wipe.wipe_servers,
+        prepare_servers: Callable = prepare.prepare_servers,
+        executor=None,
+        load_config: Callable[[], models.Config] | None = None,
+    ):
+        self.config = config
+        # Called on each pass of run(), returns the current config (may reload config.json)
+        self.load_config = load_config
+        self.clock = clock or SystemClock()
+        self.wipe_servers = wipe_servers
+        self.prepare_servers = prepare_servers
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=MAX_WORKERS, thread_name_prefix="scheduler"
+        )
+        self.stopped = threading.Event()
+        self.in_flight: Set[str] = set()
+        self.lock = threading.Lock()
+        self.targets = self.scheduled(config)
+        now = self.clock.now()
+        self.planned: Dict[str, PlannedWipe] = {
+            server_id: next_wipe(server, now)
+            for server_id, (_, server) in self.targets.items()
+        }
+        self.prepared_for: Dict[str, datetime.datetime] = {}
+
+    @staticmethod
+    def scheduled(
+        config: models.Config,
+    ) -> Dict[str, Tuple[models.Host, models.Server]]:
+        return {
+            server.id: (host, server)
+            for host in config.hosts
+            for server in host.servers
+            if server.schedule
+        }
+
+    def reload(self):
+        """Pick up a changed config, re-planning only the servers that changed"""
+        if self.load_config is None:
+            return
+        try:
+            config = self.load_config()
+        except Exception as e:
+            log.error(f"Could not reload config, keeping the current schedule: {e}")
+            return
+        if config is self.config:
+            return
+        self.config = config
+        targets = self.scheduled(config)
+        now = self.clock.now()
+        for server_id in self.targets.keys() - targets.keys():
+            log.info(f'ID: "{server_id}" - No longer scheduled')
+            self.planned.pop(server_id, None)
+            self.prepared_for.pop(server_id, None)
+        for server_id, target in targets.items():
+            if server_id in self.targets and same_target(
+                self.targets[server_id], target
+            ):
+                continue
+            planned = self.planned[server_id] = next_wipe(target[1], now)
+            self.prepared_for.pop(server_id, None)
+            log.info(
+                f'ID: "{server_id}" - Schedule changed, next wipe at {planned.at}'
+                + (" (force wipe)" if planned.force else "")
+            )
+        self.targets = targets
+
+    def prepare_at(self, server_id: str) -> datetime.datetime:
+        _, server = self.targets[server_id]
+        return self.planned[server_id].at - datetime.timedelta(
+            minutes=server.schedule.prepare_minutes_before
+        )
+
+    def next_due(self) -> datetime.datetime | None:
+        times = []
+        for server_id, planned in self.planned.items():
+            times.append(planned.at)
+            if self.prepared_for.get(server_id) != planned.at:
+                times.append(self.prepare_at(server_id))
+        return min(times) if times else None
+
+    def _submit(self, kind: str, function: Callable, targets, *args, **kwargs):
+        server_ids = [server.id for _, server in targets]
+        with self.lock:
+            self.in_flight.update(f"{kind}:{server_id}" for server_id in server_ids)
+
+        def run():
+            try:
+                function(self.config, targets, *args, **kwargs)
+            except Exception:
+                log.exception(f"Scheduled {kind} failed for {', '.join(server_ids)}")
+            finally:
+                with self.lock:
+                    self.in_flight.difference_update(
+                        f"{kind}:{server_id}" for server_id in server_ids
+                    )
+
+        return self.executor.submit(run)
+
+    def tick(self) -> List:
+        """Start everything that is due at the current time. Returns the submitted futures"""
+        now = self.clock.now()
+        to_prepare = []
+        # (force, force wipe day) -> servers
+        to_wipe: Dict[Tuple[bool, bool], List[Tuple[models.Host, models.Server]]] = {}
+        for server_id, (host, server) in self.targets.items():
+            planned = self.planned[server_id]
+            if (
+                server.schedule.prepare_minutes_before > 0
+                and self.prepared_for.get(server_id) != planned.at
+                and self.prepare_at(server_id) <= now < planned.at
+            ):
+                self.prepared_for[server_id] = planned.at
+                to_prepare.append((host, server))
+            if planned.at <= now:
+                self.planned[server_id] = next_wipe(server, planned.at)
+                with self.lock:
+                    busy = f"wipe:{server_id}" in self.in_flight
+                if busy:
+                    log.warning(
+                        f'ID: "{server_id}" - Previous wipe still running, skipping wipe scheduled at {planned.at}'
+                    )
+                    continue
+                log.info(f'ID: "{server_id}" - Scheduled wipe due ({planned.at})')
+                to_wipe.setdefault((planned.force, planned.force_wipe_day), []).append(
+                    (host, server)
+                )
+
+        futures = []
+        if to_prepare:
+            futures.append(self._submit("prepare", self.prepare_servers, to_prepare))
+        # Wipes due at the same instant go through one orchestrator call so per-host limits apply
+        # The force wipe day check uses the planned date, a wipe that starts late
+        # or on a machine in another timezone is not cancelled by it
+        for (force, force_wipe_day), targets in to_wipe.items():
+            futures.append(
+                self._submit(
+                    "wipe",
+                    self.wipe_servers,
+                    targets,
+                    force,
+                    force_wipe_day=force_wipe_day,
+                )
+            )
+        return futures
+
+    def run(self, until: datetime.datetime | None = None):
+        log.info(f"Scheduler started with {len(self.targets)} scheduled server(s)")
+        for server_id, planned in sorted(self.planned.items(), key=lambda i: i[1].at):
+            log.info(
+                f'ID: "{server_id}" - Next wipe at {planned.at}'
+                + (" (force wipe)" if planned.force else "")
+            )
+        while not self.stopped.is_set():
+            self.reload()
+            due = self.next_due()
+            if due is None:
+                if self.load_config is None:
+                    log.warning("No scheduled servers, scheduler exiting")
+                    break
+                # Nothing scheduled yet, keep checking config.json for schedules
+                due = self.clock.now() + datetime.timedelta(seconds=MAX_SLEEP)
+            if until is not None and due > until:
+                break
+            wait = (due - self.clock.now()).total_seconds()
+            if wait > 0:
+                self.clock.sleep(wait)
+                continue
+            self.tick()
+
+    def stop(self, wait: bool = True):
+        self.stopped.set()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,98 @@
+import csv
+import os
+import random
+import threading
+from array import array
+from typing import Dict, Iterator, Tuple
+
+from setup_logger import log
+
+SEEDS_DIRECTORY = "seeds"
+# Files larger than this are sampled straight from disk instead of held in memory
+MAX_IN_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+class SeedFile:
+    """Seeds from one CSV file packed into parallel arrays, with a per-size index"""
+
+    def __init__(self, path: str, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.seeds = array("q")
+        self.sizes = array("H")
+        self.by_size: Dict[int, array] = {}
+        for seed, size in read_rows(path):
+            self.by_size.setdefault(size, array("I")).append(len(self.seeds))
+            self.seeds.append(seed)
+            self.sizes.append(size)
+
+    def __len__(self) -> int:
+        return len(self.seeds)
+
+    def pick(self, size: int | None = None) -> Tuple[int, int] | None:
+        if size is None:
+            if not self.seeds:
+                return None
+            index = random.randrange(len(self.seeds))
+        else:
+            indexes = self.by_size.get(size)
+            if not indexes:
+                return None
+            index = indexes[random.randrange(len(indexes))]
+        return self.seeds[index], self.sizes[index]
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, int]]:
+    with open(path, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = [column.strip() for column in next(reader, [])]
+        seed_column, size_column = header.index("seed"), header.index("size")
+        for row in reader:
+            if not row:
+                continue
+            try:
+                yield int(row[seed_column]), int(row[size_column])
+            except (ValueError, IndexError):
+                log.debug("Skipping invalid seed row in %s: %s", path, row)
+
+
+def sample_from_disk(path: str, size: int | None = None) -> Tuple[int, int] | None:
+    """Reservoir-sample a single row without loading the file"""
+    picked = None
+    count = 0
+    for seed, seed_size in read_rows(path):
+        if size is not None and seed_size != size:
+            continue
+        count += 1
+        if random.randrange(count) == 0:
+            picked = (seed, seed_size)
+    return picked
+
+
+class SeedStore:
+    """Loads each seed file once and reloads it only when its mtime changes"""
+
+    def __init__(self, directory: str = SEEDS_DIRECTORY):
+        self.directory = directory
+        self.files: Dict[str, SeedFile] = {}
+        self.lock = threading.Lock()
+
+    def load(self, name: str) -> SeedFile:
+        path = os.path.join(self.directory, name)
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            seed_file = self.files.get(name)
+            if not seed_file or seed_file.mtime != mtime:
+                seed_file = SeedFile(path, mtime)
+                self.files[name] = seed_file
+                log.debug("Loaded %d seeds from %s", len(seed_file), path)
+            return seed_file
+
+    def pick(self, name: str, size: int | None = None) -> Tuple[int, int] | None:
+        path = os.path.join(self.directory, name)
+        if os.path.getsize(path) > MAX_IN_MEMORY_BYTES:
+            return sample_from_disk(path, size)
+        return self.load(name).pick(size)
+
+
+seed_store = SeedStore()
@@ -0,0 +1,358 @@
+import json
+import re
+import threading
+import time
+from typing import Callable, Iterable, List, Pattern, Set
+
+import models
+from setup_logger import log, sampled_debug
+from utils import deadline, metrics, ptero
+from utils.client import get_client
+
+# Backoff used when the websocket is unavailable and we fall back to REST polling
+POLL_INITIAL_INTERVAL = 1
+POLL_MAX_INTERVAL = 15
+RECV_TIMEOUT = 30
+# Colour and cursor escape codes the panel leaves in console lines
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+Listener = Callable[[str, list], None]
+
+
+def connect_websocket(url: str, origin: str):
+    """Open a websocket connection. Any object with send/recv/close can stand in for it"""
+    import websocket
+
+    return websocket.create_connection(url, origin=origin, timeout=RECV_TIMEOUT)
+
+
+class ServerSocket:
+    """Authenticated connection to a server's Pterodactyl websocket that fans events out to listeners"""
+
+    def __init__(
+        self,
+        host: models.Host,
+        server: models.Server,
+        connect: Callable = connect_websocket,
+    ):
+        self.host = host
+        self.server = server
+        self.connect = connect
+        self.connection = None
+        self.listeners: List[Listener] = []
+        self.closed = False
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        # Set once the panel accepts our token, console output only flows after that
+        self.authenticated = threading.Event()
+
+    def add_listener(self, listener: Listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener: Listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def _credentials(self):
+        response = get_client(self.host).get(
+            f"/api/client/servers/{self.server.id}/websocket"
+        )
+        data = response.json()["data"]
+        return data["socket"], data["token"]
+
+    def start(self) -> bool:
+        """Connect and authenticate. Returns False if the websocket is unavailable"""
+        try:
+            socket_url, token = self._credentials()
+            self.connection = self.connect(socket_url, self.host.url)
+            self.send("auth", [token])
+        except Exception as e:
+            log.debug('ID: "%s" - Websocket unavailable: %s', self.server.id, e)
+            self.connection = None
+            return False
+        self.thread = threading.Thread(
+            target=self._read_loop, name=f"ws-{self.server.id}", daemon=True
+        )
+        self.thread.start()
+        return True
+
+    def send(self, event: str, args: list | None = None):
+        self.connection.send(json.dumps({"event": event, "args": args or []}))
+
+    def _dispatch(self, event: str, args: list):
+        if event == "auth success":
+            self.authenticated.set()
+        elif event == "disconnected":
+            self.authenticated.clear()
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(event, args)
+            except Exception:
+                log.exception(f'ID: "{self.server.id}" - Websocket listener failed')
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                raw = self.connection.recv()
+            except Exception as e:
+                if self.closed:
+                    break
+                if type(e).__name__ == "WebSocketTimeoutException":
+                    continue
+                log.debug('ID: "%s" - Websocket closed: %s', self.server.id, e)
+                break
+            if not raw:
+                if self.closed:
+                    break
+                continue
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                continue
+            event = message.get("event")
+            args = message.get("args") or []
+            if event in ("token expiring", "token expired"):
+                try:
+                    _, token = self._credentials()
+                    self.send("auth", [token])
+                except Exception as e:
+                    log.debug(
+                        'ID: "%s" - Failed to refresh websocket token: %s',
+                        self.server.id,
+                        e,
+                    )
+                    break
+                continue
+            self._dispatch(event, args)
+        self._dispatch("disconnected", [])
+
+    def close(self):
+        self.closed = True
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+
+class StateWatcher:
+    """Tracks a server's power state from websocket status events, falling back to REST polling"""
+
+    def __init__(
+        self,
+        host: models.Host,
+        server: models.Server,
+        connect: Callable = connect_websocket,
+    ):
+        self.host = host
+        self.server = server
+        self.state: str | None = None
+        self.live = False
+        self.condition = threading.Condition()
+        self.socket = ServerSocket(host, server, connect)
+        self.socket.add_listener(self._on_event)
+
+    def start(self) -> "StateWatcher":
+        self.live = self.socket.start()
+        if not self.live:
+            log.debug('ID: "%s" - Falling back to polling server state', self.server.id)
+        return self
+
+    def _set_state(self, state: str):
+        with self.condition:
+            if state != self.state:
+                log.debug('ID: "%s" - Server status: "%s"', self.server.id, state)
+            self.state = state
+            self.condition.notify_all()
+
+    def _on_event(self, event: str, args: list):
+        if event == "auth success":
+            # Ask for a stats frame so we learn the current state straight away
+            self.socket.send("send stats")
+        elif event == "status" and args:
+            self._set_state(args[0])
+        elif event == "stats" and args:
+            try:
+                self._set_state(json.loads(args[0])["state"])
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif event == "disconnected":
+            with self.condition:
+                self.live = False
+                self.condition.notify_all()
+
+    def wait_for(
+        self, states: str | Iterable[str], timeout: float | None = None
+    ) -> str:
+        """Block until the server reaches one of `states`, raising TimeoutError after `timeout` seconds
+
+        The timeout is shortened to the current deadline, if there is one.
+        """
+        states = {states} if isinstance(states, str) else set(states)
+        timeout = deadline.cap(timeout)
+        with metrics.span(
+            "wait_state",
+            server=self.server.id,
+            states="|".join(sorted(states)),
+            source="websocket" if self.live else "poll",
+        ):
+            return self._wait_for(states, timeout)
+
+    def _wait_for(self, states: Set[str], timeout: float | None) -> str:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining() -> float | None:
+            return None if deadline is None else deadline - time.monotonic()
+
+        with self.condition:
+            while self.live:
+                if self.state in states:
+                    return self.state
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise TimeoutError(
+                        f'Server "{self.server.id}" did not reach {sorted(states)} within {timeout:.0f}s (last status "{self.state}")'
+                    )
+                self.condition.wait(left)
+
+        interval = POLL_INITIAL_INTERVAL
+        while True:
+            state = ptero.get_server_state(self.host, self.server)
+            self._set_state(state)
+            if state in states:
+                return state
+            left = remaining()
+            if left is not None and left <= 0:
+                raise TimeoutError(
+                    f'Server "{self.server.id}" did not reach {sorted(states)} within {timeout:.0f}s (last status "{state}")'
+                )
+            sampled_debug(
+                f"poll:{self.server.id}",
+                60,
+                'ID: "%s" - Polling for %s, server is "%s"',
+                self.server.id,
+                sorted(states),
+                state,
+            )
+            metrics.sleep(
+                interval if left is None else min(interval, left),
+                "poll",
+                server=self.server.id,
+            )
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+    def close(self):
+        self.socket.close()
+
+
+class ConsoleWaiter:
+    """One pending wait for a console line matching `pattern`"""
+
+    def __init__(self, reader: "ConsoleReader", pattern: Pattern):
+        self.reader = reader
+        self.pattern = pattern
+        self.line: str | None = None
+        self.closed = False
+        self.event = threading.Event()
+
+    def wait(self, timeout: float | None = None) -> str:
+        """Return the matching line, raising TimeoutError if it does not show up in time
+
+        The timeout is shortened to the current deadline, if there is one.
+        """
+        timeout = deadline.cap(timeout)
+        server_id = self.reader.socket.server.id
+        with metrics.span("wait_console", server=server_id):
+            self.event.wait(timeout)
+        if self.line is not None:
+            return self.line
+        if self.closed:
+            raise TimeoutError(
+                f'Console of server "{server_id}" closed while waiting for "{self.pattern.pattern}"'
+            )
+        raise TimeoutError(
+            f'Server "{server_id}" did not log "{self.pattern.pattern}" within {timeout:.0f}s'
+        )
+
+    def __enter__(self) -> "ConsoleWaiter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reader.cancel(self)
+
+
+class ConsoleReader:
+    """Matches a server's console output, streamed over its websocket, against pending waits
+
+    Register the wait before triggering the output, so a quick response is not missed:
+
+        with console.expect(r"^Saved ") as waiter:
+            ptero.send_command(host, server, "save")
+            waiter.wait(60)
+    """
+
+    def __init__(self, socket: ServerSocket):
+        self.socket = socket
+        self.waiters: List[ConsoleWaiter] = []
+        self.lock = threading.Lock()
+        socket.add_listener(self._on_event)
+
+    @property
+    def live(self) -> bool:
+        return self.socket.authenticated.is_set()
+
+    def wait_until_live(self, timeout: float) -> bool:
+        """Wait for the websocket to authenticate. False if console output is unavailable"""
+        if self.socket.connection is None:
+            return False
+        return self.socket.authenticated.wait(deadline.cap(timeout))
+
+    def expect(self, pattern: str | Pattern) -> ConsoleWaiter:
+        waiter = ConsoleWaiter(self, re.compile(pattern))
+        with self.lock:
+            self.waiters.append(waiter)
+        return waiter
+
+    def cancel(self, waiter: ConsoleWaiter):
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def _on_event(self, event: str, args: list):
+        if event == "console output" and args:
+            for line in str(args[0]).splitlines():
+                self._match(ANSI_ESCAPE.sub("", line).strip())
+        elif event == "disconnected":
+            with self.lock:
+                waiters, self.waiters = self.waiters, []
+            for waiter in waiters:
+                waiter.closed = True
+                waiter.event.set()
+
+    def _match(self, line: str):
+        with self.lock:
+            matched = [w for w in self.waiters if w.pattern.search(line)]
+            for waiter in matched:
+                self.waiters.remove(waiter)
+        for waiter in matched:
+            waiter.line = line
+            waiter.event.set()
+
+    def command(
+        self, host: models.Host, command: str, pattern: str | Pattern, timeout: float
+    ) -> str:
+        """Send a console command and return the first output line matching `pattern`
+
+        Raises ConnectionError if the command could not be sent and TimeoutError
+        if no such line is logged within `timeout` seconds.
+        """
+        with self.expect(pattern) as waiter:
+            if not ptero.send_command(host, self.socket.server, command):
+                raise ConnectionError(
+                    f'Failed to send "{command}" to server "{self.socket.server.id}"'
+                )
+            return waiter.wait(timeout)
@@ -1,31 +1,48 @@
-import csv
 import random
 import time
 from typing import TypedDict
 
-import requests
-from rich import inspect
-
 import models
-from setup_logger import log
+from setup_logger import log, sampled_debug
+from utils import deadline, metrics
+from utils.cache import cache
+from utils.client import get_rustmaps_client
+from utils.seeds import seed_store
 
 Seed = TypedDict("Seed", {"seed": str, "size": str})
 
-
-def pick_random_seed(server: models.Server) -> Seed:
-    with open(f"seeds/{server.seeds_file}", "r") as file:
-        csv_reader = csv.DictReader(file)
-        seed = random.choice(list(csv_reader))
-        log.debug(f"Picked seed: {seed['seed']} - size: {seed['size']}")
-        return seed
+# Backoff while waiting for RustMaps to render a map
+MAP_POLL_INITIAL_INTERVAL = 2
+MAP_POLL_MAX_INTERVAL = 30
+MAP_RENDER_TIMEOUT = 15 * 60
+# How long RustMaps lookups stay in the local cache
+MAP_CACHE_TTL = 30 * 24 * 60 * 60
+FILTER_CACHE_TTL = 6 * 60 * 60
+
+
+@metrics.timed
+def pick_random_seed(server: models.Server) -> Seed | None:
+    picked = seed_store.pick(server.seeds_file, server.seeds_size)
+    if not picked:
+        log.error(
+            f"No seeds found in {server.seeds_file}"
+            + (f" with size {server.seeds_size}" if server.seeds_size else "")
+        )
+        return None
+    seed = Seed(seed=str(picked[0]), size=str(picked[1]))
+    log.debug("Picked seed: %s - size: %s", seed["seed"], seed["size"])
+    return seed
 
 
+@metrics.timed
 def generate_rustmaps_map(config: models.Config, seed: str, size: str) -> str | None:
-    headers = {
-        "accept": "application/json",
-        "X-API-Key": config.rustmaps_api_token,
-        "Content-Type": "application/json",
-    }
+    cache_key = f"rustmaps:map_id:{size}:{seed}"
+    map_id = cache.get(cache_key)
+    if map_id:
+        log.debug("Using cached map id for seed: %s - size: %s", seed, size)
+        return map_id
+
+    client = get_rustmaps_client(config)
 
     json_params = {
         "size": size,
@@ -34,11 +51,9 @@ def generate_rustmaps_map(config: models.Config, seed: str, size: str) -> str |
         "barren": False,
     }
 
-    time.sleep(1)
-    log.debug(f"Submitting map generation request for seed: {seed} - size: {size}")
-    response = requests.post(
-        f"https://api.rustmaps.com/v4/maps", json=json_params, headers=headers
-    )
+    log.debug("Submitting map generation request for seed: %s - size: %s", seed, size)
+    # Submitting a map twice just returns the existing one
+    response = client.post("/v4/maps", json=json_params, idempotent=True)
     log.debug(response)
 
     if (
@@ -58,10 +73,9 @@ def generate_rustmaps_map(config: models.Config, seed: str, size: str) -> str |
             "staging": False,
         }
 
-        response = requests.get(
-            f"https://api.rustmaps.com/v4/maps/{size}/{seed}",
+        response = client.get(
+            f"/v4/maps/{size}/{seed}",
             json=params,
-            headers=headers,
         )
         if response.ok or response.status_code == 400:
             data = response.json()
@@ -69,35 +83,60 @@ def generate_rustmaps_map(config: models.Config, seed: str, size: str) -> str |
             if "data" in data:
                 if "id" in data:
                     return data["data"]["id"]
-    return data["data"]["id"]
+    map_id = data["data"]["id"]
+    cache.set(cache_key, map_id, MAP_CACHE_TTL)
+    return map_id
 
 
+@metrics.timed
 def get_generated_map_url(config: models.Config, map_id: str):
-    headers = {
-        "accept": "application/json",
-        "X-API-Key": config.rustmaps_api_token,
-    }
-
-    time.sleep(1)
-    log.debug(f'Getting map url for map id: "{map_id}"')
-    response = requests.get(
-        f"https://api.rustmaps.com/v4/maps/{map_id}", headers=headers
+    cache_key = f"rustmaps:map_url:{map_id}"
+    map_url = cache.get(cache_key)
+    if map_url:
+        return map_url
+
+    client = get_rustmaps_client(config)
+
+    response = client.get(f"/v4/maps/{map_id}")
+    sampled_debug(
+        f"map_url:{map_id}",
+        30,
+        'Getting map url for map id: "%s" - %s',
+        map_id,
+        response,
     )
-    log.debug(response)
 
     # check if the key "imageIconUrl" doesn't exist in the response JSON
-    log.debug(response)
     data = response.json()["data"]
     if "imageIconUrl" not in data:
         return None
+    cache.set(cache_key, data["imageIconUrl"], MAP_CACHE_TTL)
     return data["imageIconUrl"]
 
 
+@metrics.timed
+def wait_for_generated_map_url(
+    config: models.Config, map_id: str, timeout: float = MAP_RENDER_TIMEOUT
+) -> str | None:
+    """Poll RustMaps with exponential backoff until the map image has been rendered"""
+    timeout = deadline.cap(timeout)
+    give_up_at = time.monotonic() + timeout
+    interval = MAP_POLL_INITIAL_INTERVAL
+    while True:
+        map_url = get_generated_map_url(config, map_id)
+        if map_url:
+            return map_url
+        left = give_up_at - time.monotonic()
+        if left <= 0:
+            log.warning(f'Map "{map_id}" was not rendered within {timeout:.0f}s')
+            return None
+        metrics.sleep(min(interval, left), "map_render")
+        interval = min(interval * 2, MAP_POLL_MAX_INTERVAL)
+
+
+@metrics.timed
 def get_random_map_from_filter(config: models.Config, rustmaps_filter: str) -> Seed:
-    headers = {
-        "accept": "application/json",
-        "X-API-Key": config.rustmaps_api_token,
-    }
+    client = get_rustmaps_client(config)
 
     fallback_seeds = [
         {"seed": "1627427312", "size": "3500"},
@@ -120,33 +159,40 @@ def get_random_map_from_filter(config: models.Config, rustmaps_filter: str) -> S
         "page": "0",
     }
 
-    time.sleep(1)
-    log.debug(f'Getting random RustMaps map from filter: "{rustmaps_filter}"')
-    response = requests.get(
-        f"https://api.rustmaps.com/v4/maps/filter/{rustmaps_filter}",
-        params=params,
-        headers=headers,
-    )
+    cache_key = f"rustmaps:filter:{rustmaps_filter}:page:{params['page']}"
+    seeds = cache.get(cache_key)
+    if seeds:
+        log.debug('Using cached RustMaps maps for filter: "%s"', rustmaps_filter)
+    else:
+        log.debug('Getting random RustMaps map from filter: "%s"', rustmaps_filter)
+        response = client.get(
+            f"/v4/maps/filter/{rustmaps_filter}",
+            params=params,
+        )
 
-    data = response.json()
+        data = response.json()
 
-    if "data" not in data:
-        log.debug(
-            f'Failed to get random RustMaps map from filter: "{rustmaps_filter}" - falling back to random seed'
-        )
-        return fallback_seed
+        if "data" not in data:
+            log.debug(
+                'Failed to get random RustMaps map from filter: "%s" - falling back to random seed',
+                rustmaps_filter,
+            )
+            return fallback_seed
 
-    seeds = data["data"]
+        seeds = data["data"]
+        if seeds:
+            cache.set(cache_key, seeds, FILTER_CACHE_TTL)
 
     if len(seeds) <= 0:
         log.debug(
-            f'No seeds found for filter: "{rustmaps_filter}" - falling back to random seed'
+            'No seeds found for filter: "%s" - falling back to random seed',
+            rustmaps_filter,
         )
         return fallback_seed
 
     random_seed = random.choice(seeds)
 
     seed = Seed(seed=random_seed["seed"], size=random_seed["size"])
-    log.debug(f"Picked seed: {seed['seed']} - size: {seed['size']}")
+    log.debug("Picked seed: %s - size: %s", seed["seed"], seed["size"])
 
     return seed
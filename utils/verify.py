@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import models
+from setup_logger import log
+from utils import ptero
+
+# Panel attributes of every server seen during the last verification, by identifier
+server_index: Dict[str, dict] = {}
+
+
+def index_servers(host: models.Host) -> Dict[str, dict]:
+    """Map each server identifier on a host to its panel attributes"""
+    log.info(f'Getting servers from host "{host.name}"...')
+    return {
+        s["attributes"]["identifier"]: s["attributes"] for s in ptero.list_servers(host)
+    }
+
+
+def verify_servers(config: models.Config) -> bool:
+    """Check every configured server exists on its host, querying all hosts concurrently"""
+    if not config.hosts:
+        return True
+
+    with ThreadPoolExecutor(
+        max_workers=len(config.hosts), thread_name_prefix="verify"
+    ) as executor:
+        indexes = list(executor.map(index_servers, config.hosts))
+
+    verified = True
+    for index in indexes:
+        server_index.update(index)
+    for host, index in zip(config.hosts, indexes):
+        for server in host.servers:
+            if server.id in index:
+                log.info(
+                    f'ID "{server.id}" - "{server.name}" found on host "{host.name}"'
+                )
+            else:
+                log.error(
+                    f'ID "{server.id}" - "{server.name}" not found on host "{host.name}". Check config.json file.'
+                )
+                verified = False
+    return verified
@@ -0,0 +1,700 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import requests
+from discord_webhook import DiscordEmbed
+
+import models
+from setup_logger import log, log_context
+from utils import (
+    admission,
+    deadline,
+    metrics,
+    notify,
+    prepare,
+    progress,
+    ptero,
+    utils,
+)
+from utils.journal import WipeRecord, journal
+from utils.state import ConsoleReader, StateWatcher
+
+# Per-host semaphores limiting how many wipes run against a panel at once
+host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+host_semaphores_lock = threading.Lock()
+
+# Servers with a wipe in progress in this process, including its announcement
+running_wipes: Set[str] = set()
+running_wipes_lock = threading.Lock()
+
+# Seconds to wait for each server state before giving up
+OFFLINE_TIMEOUT = 5 * 60
+STARTING_TIMEOUT = 2 * 60
+RUNNING_TIMEOUT = 30 * 60
+# Seconds to queue for a boot slot on the node before starting regardless
+BOOT_QUEUE_TIMEOUT = 15 * 60
+# Seconds to wait for the "Saved" line after "save", big maps take a while
+SAVE_TIMEOUT = 90
+# Rust logs e.g. "Saved 41,290 ents, cache(0.12), write(0.03), disk(0.01)."
+SAVED_PATTERN = r"^Saved [\d,]+ ents"
+
+
+def is_force_wipe_day(today: datetime.date | None = None) -> bool:
+    today = today or datetime.date.today()
+    return today.weekday() == 3 and today.day <= 7
+
+
+def server_today(server: models.Server) -> datetime.date:
+    """Today's date where the server's schedule says it is, else on this machine"""
+    if not server.schedule:
+        return datetime.date.today()
+    return datetime.datetime.now(ZoneInfo(server.schedule.timezone)).date()
+
+
+def get_host_semaphore(host: models.Host) -> threading.BoundedSemaphore:
+    with host_semaphores_lock:
+        if host.name not in host_semaphores:
+            host_semaphores[host.name] = threading.BoundedSemaphore(
+                max(1, host.max_concurrent_wipes)
+            )
+        return host_semaphores[host.name]
+
+
+class Wipe:
+    """A single server wipe, run step by step and journaled so it can resume after a crash"""
+
+    # Everything up to "list_files" runs while players are still online: startup
+    # variables only take effect on the next boot and listing does not need the
+    # server stopped. Downtime is only the steps from "stop" to "running".
+    STEPS = [
+        "choose_map",
+        "change_map",
+        "list_files",
+        "save",
+        "stop",
+        "wait_offline",
+        "delete_files",
+        "start",
+        "wait_starting",
+        "announce",
+    ]
+    # Seconds each step may take before the wipe fails with a clear error
+    STEP_DEADLINES = {
+        "choose_map": 2 * 60,
+        "change_map": 2 * 60,
+        "list_files": 5 * 60,
+        "save": SAVE_TIMEOUT + 30,
+        "stop": 60,
+        "wait_offline": OFFLINE_TIMEOUT,
+        # Generous, archiving a big tree first means downloading it
+        "delete_files": 30 * 60,
+        "start": BOOT_QUEUE_TIMEOUT + 60,
+        "wait_starting": STARTING_TIMEOUT,
+        "announce": utils.MAP_RENDER_TIMEOUT + RUNNING_TIMEOUT,
+    }
+
+    def __init__(
+        self,
+        config: models.Config,
+        host: models.Host,
+        server: models.Server,
+        record: WipeRecord,
+        map_override: models.PreparedMap | None = None,
+    ):
+        self.config = config
+        self.host = host
+        self.server = server
+        self.record = record
+        # Map to use instead of a prepared or freshly chosen one
+        self.map_override = map_override
+        self.watcher: StateWatcher | None = None
+        self.console: ConsoleReader | None = None
+        # Node boot slot held from the start until the server is running
+        self.boot_slot: admission.NodeAdmission | None = None
+        # Directory listings made before the stop, their directories are prefetched by delete_files
+        self.listings: Dict[str, List[models.PteroFile]] = {}
+        self.started = time.monotonic()
+
+    @property
+    def state(self) -> dict:
+        return self.record.state
+
+    @property
+    def custom_map(self) -> models.CustomMap | None:
+        custom_map = self.state.get("custom_map")
+        return models.CustomMap(**custom_map) if custom_map else None
+
+    @property
+    def seed(self) -> utils.Seed | None:
+        return self.state.get("seed")
+
+    def get_watcher(self) -> StateWatcher:
+        if self.watcher is None:
+            self.watcher = StateWatcher(self.host, self.server)
+            # Listen before connecting so no console output is missed
+            self.console = ConsoleReader(self.watcher.socket)
+            self.watcher.start()
+        return self.watcher
+
+    def get_console(self) -> ConsoleReader | None:
+        """Console of the server, None if the websocket is unavailable"""
+        self.get_watcher()
+        if not self.console.wait_until_live(10):
+            return None
+        return self.console
+
+    def finish(self, status: str, error: str | None = None):
+        journal.finish(self.record, status, error)
+        progress.publish(
+            "wipe",
+            self.server.id,
+            status=status,
+            error=error,
+            journal_id=self.record.id,
+        )
+        metrics.record(
+            "wipe",
+            time.monotonic() - self.started,
+            status != "done",
+            server=self.server.id,
+            host=self.host.name,
+        )
+        metrics.write_prometheus_file()
+
+    def release_boot_slot(self):
+        if self.boot_slot is not None:
+            self.boot_slot.release(self.server)
+            self.boot_slot = None
+
+    def close(self):
+        self.release_boot_slot()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+            self.console = None
+        with running_wipes_lock:
+            running_wipes.discard(self.server.id)
+
+    def step_save(self) -> bool:
+        server = self.server
+        log.info(f'ID: "{server.id}" - Saving server')
+        console = self.get_console()
+        if console is None:
+            if not ptero.send_command(self.host, server, "save"):
+                log.warning(
+                    f'ID: "{server.id}" - Failed to send "save" command to server'
+                )
+            # No console to watch, give the server time to finish writing the save
+            metrics.sleep(2, "save", server=server.id)
+            return True
+        try:
+            line = console.command(self.host, "save", SAVED_PATTERN, SAVE_TIMEOUT)
+        except (ConnectionError, TimeoutError) as e:
+            # Stopping saves too, so carry on
+            log.warning(f'ID: "{server.id}" - {e}')
+            return True
+        log.info(f'ID: "{server.id}" - {line}')
+        return True
+
+    def step_list_files(self) -> bool:
+        server = self.server
+        count = ptero.list_files(
+            self.host, server, server.files_to_delete, self.listings
+        )
+        log.info(
+            f'ID: "{server.id}" - Listed {count} path(s) in {len(self.listings)} directories before stopping'
+        )
+        return True
+
+    def step_stop(self) -> bool:
+        server = self.server
+        self.get_watcher()
+        # Wall clock, so downtime survives a restart of the bot mid-wipe
+        self.state.setdefault("stopped_at", time.time())
+        log.info(f'ID: "{server.id}" - Stopping server')
+        if not ptero.stop_server(self.host, server):
+            log.warning(
+                f'ID: "{server.id}" - Failed to stop server (Maybe it\'s already stopped?)'
+            )
+        else:
+            log.info(f'ID: "{server.id}" - Stopped server')
+        return True
+
+    def step_wait_offline(self) -> bool:
+        try:
+            self.get_watcher().wait_for("offline", OFFLINE_TIMEOUT)
+        except TimeoutError as e:
+            log.error(f'ID: "{self.server.id}" - {e}. Cancelling wipe.')
+            return False
+        log.info(f'ID: "{self.server.id}" - Server is offline')
+        return True
+
+    def step_delete_files(self) -> bool:
+        server = self.server
+        archive_directory = None
+        if server.archive_before_delete:
+            archive_directory = os.path.join(
+                ptero.ARCHIVE_DIRECTORY,
+                server.id,
+                datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+            )
+        # The server writes saves and plugin data as it shuts down, so every
+        # directory is listed again. The listing from before the stop only says
+        # which directories exist, so they can all be listed in one round.
+        if not ptero.delete_files(
+            self.host,
+            server,
+            server.files_to_delete,
+            archive_directory=archive_directory,
+            prefetch=list(self.listings),
+        ):
+            # Booting now would announce a wipe that kept the old map and player data
+            log.error(f'ID: "{server.id}" - Failed to delete server files')
+            return False
+        log.info(f'ID: "{server.id}" - Deleted server files')
+        return True
+
+    def step_choose_map(self) -> bool:
+        server = self.server
+        prepared = self.map_override or prepare.load_prepared(server)
+        if prepared:
+            if prepared is self.map_override:
+                log.info(f'ID: "{server.id}" - Using map from override')
+            else:
+                log.info(
+                    f'ID: "{server.id}" - Using map prepared at {prepared.prepared_at}'
+                )
+            custom_map = prepared.custom_map
+            seed = (
+                utils.Seed(seed=prepared.seed, size=prepared.size)
+                if prepared.seed
+                else None
+            )
+            self.state["generated_map_id"] = prepared.generated_map_id
+            self.state["map_image_url"] = prepared.image_url
+        else:
+            custom_map, seed = prepare.choose_map(self.config, server)
+        if not custom_map and not seed:
+            log.error(f'ID: "{server.id}" - No map to wipe to')
+            return False
+        self.state["custom_map"] = (
+            {"map_url": custom_map.map_url, "image_url": custom_map.image_url}
+            if custom_map
+            else None
+        )
+        self.state["seed"] = seed
+        return True
+
+    def step_change_map(self) -> bool:
+        server = self.server
+        custom_map, seed = self.custom_map, self.seed
+
+        # One batched update for the map and any extra startup variables
+        variables = dict(server.startup_variables or {})
+        if custom_map:
+            log.info(f'ID: "{server.id}" - Using custom map url "{custom_map.map_url}"')
+            variables["MAP_URL"] = custom_map.map_url
+        else:
+            variables["WORLD_SIZE"] = str(seed["size"])
+            variables["WORLD_SEED"] = str(seed["seed"])
+        if not ptero.apply_startup_variables(self.host, server, variables):
+            log.warning(f'ID: "{server.id}" - Failed to change startup variables')
+
+        # Custom map
+        if custom_map:
+            log.info(
+                f'ID: "{server.id}" - Changed custom map. Map URL: {custom_map.map_url} - Image URL: {custom_map.image_url}'
+            )
+
+        # Use procedural
+        if not custom_map:
+            log.info(
+                f"ID: \"{server.id}\" - Changed seed. Seed: {seed['seed']} - Size: {seed['size']}"
+            )
+            if not self.state.get("generated_map_id"):
+                # Submit map generation request to RustMaps.com
+                self.state["generated_map_id"] = utils.generate_rustmaps_map(
+                    self.config, seed["seed"], seed["size"]
+                )
+                if not self.state["generated_map_id"]:
+                    log.warning(
+                        f'ID: "{server.id}" - Failed to submit map generation request for seed {seed["seed"]} - size {seed["size"]}'
+                    )
+                log.info(
+                    f'ID: "{server.id}" - Submitted map generation request for seed {seed["seed"]} - size {seed["size"]}'
+                )
+        return True
+
+    def step_start(self) -> bool:
+        server = self.server
+        self.get_watcher()
+        node = admission.get_admission(self.host, server)
+        if node is not None:
+            if node.acquire(self.host, server, BOOT_QUEUE_TIMEOUT):
+                self.boot_slot = node
+            else:
+                log.warning(
+                    f'ID: "{server.id}" - No boot slot on node "{node.name}" after {BOOT_QUEUE_TIMEOUT}s, starting anyway'
+                )
+        log.info(f'ID: "{server.id}" - Starting server')
+        if not ptero.start_server(self.host, server):
+            log.warning(f'ID: "{server.id}" - Server failed to start')
+        log.info(f'ID: "{server.id}" - Server started')
+        # Only used up once the server boots with it, an earlier failure leaves it for the retry
+        prepare.discard_prepared(server)
+        return True
+
+    def step_wait_starting(self) -> bool:
+        try:
+            # A quick boot can skip past "starting" before we look
+            self.get_watcher().wait_for(("starting", "running"), STARTING_TIMEOUT)
+        except TimeoutError as e:
+            log.error(f'ID: "{self.server.id}" - {e}')
+            return False
+        log.info(f'ID: "{self.server.id}" - Server is now starting')
+        return True
+
+    def step_announce(self) -> bool:
+        server = self.server
+        custom_map, seed = self.custom_map, self.seed
+        # Wait until the server is "running" and free its boot slot before waiting
+        # on the map image, which can take minutes and doesn't need the node
+        try:
+            self.get_watcher().wait_for("running", RUNNING_TIMEOUT)
+        except TimeoutError as e:
+            log.error(f'ID: "{server.id}" - {e}. Not sending webhook.')
+            return False
+        finally:
+            self.release_boot_slot()
+        # Measured before the image wait so it reflects when players can join
+        stopped_at = self.state.get("stopped_at")
+        if stopped_at:
+            downtime = time.time() - stopped_at
+            self.state["downtime_seconds"] = round(downtime, 3)
+            metrics.record("downtime", downtime, server=server.id, host=self.host.name)
+            log.info(f'ID: "{server.id}" - Server was down for {downtime:.1f}s')
+        embed_description = None
+        if not custom_map:
+            embed_description = f"{server.discord.embed.description}\n\n**🗺️ Map Link**\nClick [here](https://rustmaps.com/map/{seed['size']}_{seed['seed']}) to view the map"
+        else:
+            embed_description = (
+                f"{server.discord.embed.description}\n\n**🗺️ Map Type**\nCustom Map"
+            )
+        embed = DiscordEmbed(
+            title=f"**{server.name} just wiped!**",
+            description=embed_description,
+        )
+        if not custom_map:
+            generated_map_id = self.state.get("generated_map_id")
+            generated_map_url = self.state.get("map_image_url")
+            if not generated_map_url and generated_map_id:
+                log.debug(
+                    'ID: "%s" - Waiting for generated map image url for seed %s - size %s',
+                    server.id,
+                    seed["seed"],
+                    seed["size"],
+                )
+                generated_map_url = utils.wait_for_generated_map_url(
+                    self.config, generated_map_id
+                )
+            if generated_map_url:
+                embed.set_image(url=generated_map_url)
+                log.debug(
+                    'ID: "%s" - Retrieved generated map image url "%s..."',
+                    server.id,
+                    generated_map_url[:25],
+                )
+        if custom_map:
+            embed.set_image(url=custom_map.image_url)
+        if not custom_map:
+            embed.add_embed_field(
+                name="🌱 Seed", value=f"```{seed['seed']}```", inline=True
+            )
+            embed.add_embed_field(
+                name="📏 Size", value=f"```{seed['size']}```", inline=True
+            )
+        embed.add_embed_field(
+            name="🖥️ Connect",
+            value=f"```{server.connect_address}```",
+            inline=False,
+        )
+        embed.add_embed_field(
+            name="🔗 Direct Join",
+            value=f"steam://connect/{server.connect_address}",
+            inline=False,
+        )
+        embed.set_color(server.discord.embed.color[1:])
+        log.info(f"\nServer {server.name} is now running. Sending webhook...")
+
+        notify.dispatcher.submit(
+            notify.Announcement(
+                webhook_url=server.discord.webhook,
+                embed=embed,
+                server_id=server.id,
+                server_name=server.name,
+                ping_everyone=server.discord.ping_everyone,
+                ping_role=server.discord.ping_role,
+            )
+        )
+        return True
+
+    def run_step(self, step: str) -> bool:
+        with log_context(server_id=self.server.id, step=step):
+            progress.publish("step", self.server.id, step=step, status="started")
+            try:
+                with metrics.span(
+                    "wipe_step", step=step, server=self.server.id, host=self.host.name
+                ), deadline.deadline(self.STEP_DEADLINES[step], f'step "{step}"'):
+                    ok = getattr(self, f"step_{step}")()
+            except (requests.RequestException, TimeoutError) as e:
+                # Dead hosts and blown deadlines are expected failures, no traceback needed
+                log.error(f'ID: "{self.server.id}" - Step "{step}" failed: {e}')
+                progress.publish(
+                    "step", self.server.id, step=step, status="failed", error=str(e)
+                )
+                self.finish("failed", f'Step "{step}" failed: {e}')
+                self.close()
+                return False
+            except Exception as e:
+                progress.publish(
+                    "step", self.server.id, step=step, status="failed", error=repr(e)
+                )
+                self.finish("failed", f'Step "{step}" raised {e!r}')
+                self.close()
+                raise
+            if not ok:
+                progress.publish("step", self.server.id, step=step, status="failed")
+                self.finish("failed", f'Step "{step}" failed')
+                self.close()
+                return False
+            journal.complete_step(self.record, step)
+            progress.publish("step", self.server.id, step=step, status="done")
+            return True
+
+    def run(self) -> bool:
+        """Run the remaining steps. The final announcement runs in the background"""
+        done = self.STEPS.index(self.record.step) + 1 if self.record.step else 0
+        for step in self.STEPS[done:]:
+            if step == "announce":
+                threading.Thread(
+                    target=self.run_announce, name=f"announce-{self.server.id}"
+                ).start()
+                return True
+            if not self.run_step(step):
+                return False
+        self.finish("done")
+        self.close()
+        return True
+
+    def run_announce(self):
+        try:
+            if self.run_step("announce"):
+                self.finish("done")
+        except Exception:
+            log.exception(f'ID: "{self.server.id}" - Failed to announce wipe')
+        finally:
+            self.close()
+
+
+def wipe_server(
+    config: models.Config,
+    host: models.Host,
+    server: models.Server,
+    force: bool = False,
+    map_override: models.PreparedMap | None = None,
+    resume: bool = False,
+    force_wipe_day: bool | None = None,
+) -> bool:
+    """Wipe a server, continuing its interrupted wipe if there is one
+
+    With `resume`, continue the server's last wipe even if it failed instead
+    of starting a new one. `force_wipe_day` is decided by the caller (the
+    scheduler knows the day the wipe was planned for), else it is checked for
+    today in the server's schedule timezone.
+    """
+    with running_wipes_lock:
+        if server.id in running_wipes:
+            log.error(f'ID: "{server.id}" - A wipe is already running for this server')
+            return False
+        running_wipes.add(server.id)
+
+    record = journal.resumable(server.id) if resume else journal.active(server.id)
+    if resume and not record:
+        log.error(
+            f'ID: "{server.id}" - There is no failed or interrupted wipe to resume'
+        )
+        with running_wipes_lock:
+            running_wipes.discard(server.id)
+        return False
+    if record and not journal.claim(record):
+        log.error(
+            f'ID: "{server.id}" - Another process ({record.owner}) is wiping this server'
+        )
+        with running_wipes_lock:
+            running_wipes.discard(server.id)
+        return False
+    if record:
+        log.info(
+            f'Resuming wipe for server "{server.name}" - ID: "{server.id}" after step "{record.step}"'
+        )
+        if map_override:
+            log.warning(
+                f'ID: "{server.id}" - Ignoring the map override, the resumed wipe keeps its map'
+            )
+    else:
+        previous = journal.latest(server.id)
+        if previous and previous.status == "failed":
+            log.info(
+                f'ID: "{server.id}" - Last wipe failed ({previous.error}), starting a new one. Use "resume" to continue it instead'
+            )
+        if force_wipe_day is None:
+            force_wipe_day = is_force_wipe_day(server_today(server))
+        if force_wipe_day and not server.wipe_on_force_wipe and not force:
+            log.error(
+                f'ID: "{server.id}" - Today is the first Thursday of the month. Cancelling wipe.'
+            )
+            log.error('Run with "force" at the end to force wipe')
+            with running_wipes_lock:
+                running_wipes.discard(server.id)
+            return False
+        log.info(
+            f'Starting wipe process for server "{server.name}" - ID: "{server.id}"'
+        )
+        record = journal.begin(server.id, force)
+        if record is None:
+            log.error(f'ID: "{server.id}" - Another process started wiping this server')
+            with running_wipes_lock:
+                running_wipes.discard(server.id)
+            return False
+    progress.publish(
+        "wipe",
+        server.id,
+        status="resumed" if record.step else "started",
+        journal_id=record.id,
+    )
+    with log_context(server_id=server.id):
+        return Wipe(config, host, server, record, map_override).run()
+
+
+def abandon_wipe(server: models.Server) -> bool:
+    """Mark the server's failed or interrupted wipe as abandoned so it is never resumed"""
+    with running_wipes_lock:
+        if server.id in running_wipes:
+            log.error(f'ID: "{server.id}" - A wipe is running for this server')
+            return False
+    record = journal.resumable(server.id)
+    if not record:
+        log.error(
+            f'ID: "{server.id}" - There is no failed or interrupted wipe to abandon'
+        )
+        return False
+    if journal.owned_elsewhere(record):
+        log.error(
+            f'ID: "{server.id}" - Wipe #{record.id} is running in another process ({record.owner})'
+        )
+        return False
+    if not journal.abandon(record):
+        log.error(
+            f'ID: "{server.id}" - Wipe #{record.id} was picked up while abandoning it, try again'
+        )
+        return False
+    log.info(
+        f'ID: "{server.id}" - Abandoned wipe #{record.id} (last step "{record.step}")'
+    )
+    return True
+
+
+def resume_wipes(config: models.Config) -> Dict[str, bool]:
+    """Resume wipes that were still in flight when the process last stopped"""
+    servers = {s.id: (h, s) for h in config.hosts for s in h.servers}
+    targets = []
+    for record in journal.in_flight():
+        target = servers.get(record.server_id)
+        if not target:
+            log.warning(
+                f'Cannot resume wipe for server ID "{record.server_id}", it is no longer in config.json'
+            )
+            journal.finish(record, "failed", "Server removed from config")
+            continue
+        targets.append(target)
+    if not targets:
+        return {}
+    log.info(f"Resuming {len(targets)} interrupted wipe(s)")
+    return wipe_servers(config, targets)
+
+
+def wipe_servers(
+    config: models.Config,
+    targets: List[Tuple[models.Host, models.Server]],
+    force: bool = False,
+    forced: Set[str] | None = None,
+    map_overrides: Dict[str, models.PreparedMap] | None = None,
+    parallelism: int | None = None,
+    resume: bool = False,
+    force_wipe_day: bool | None = None,
+) -> Dict[str, bool]:
+    """Wipe several servers concurrently, limited per host by `max_concurrent_wipes`
+
+    `forced` force-wipes individual servers, `map_overrides` replaces the map
+    chosen for a server and `parallelism` caps how many wipes run at once overall.
+    `resume` continues each server's failed or interrupted wipe instead.
+    `force_wipe_day` is passed to wipe_server.
+    """
+    forced = forced or set()
+    map_overrides = map_overrides or {}
+
+    def run(host: models.Host, server: models.Server) -> bool:
+        with get_host_semaphore(host):
+            try:
+                return wipe_server(
+                    config,
+                    host,
+                    server,
+                    force or server.id in forced,
+                    map_overrides.get(server.id),
+                    resume,
+                    force_wipe_day,
+                )
+            except Exception:
+                log.exception(f'ID: "{server.id}" - Wipe failed')
+                return False
+
+    if not targets:
+        return {}
+
+    log.info(f"Wiping {len(targets)} server(s)...")
+    started = time.monotonic()
+    with ThreadPoolExecutor(
+        max_workers=min(len(targets), parallelism or len(targets)),
+        thread_name_prefix="wipe",
+    ) as executor:
+        futures = {
+            server.id: executor.submit(run, host, server) for host, server in targets
+        }
+        results = {server_id: f.result() for server_id, f in futures.items()}
+
+    succeeded = [server_id for server_id, ok in results.items() if ok]
+    failed = [server_id for server_id, ok in results.items() if not ok]
+    log.info(
+        f"Wiped {len(succeeded)}/{len(results)} server(s) in {time.monotonic() - started:.1f}s"
+    )
+    if failed:
+        log.warning(f"Failed to wipe: {', '.join(failed)}")
+    return results
+
+
+def wait_for_wipes(timeout: float | None = None) -> bool:
+    """Wait until no wipe, including its background announcement, is running. False on timeout"""
+    give_up_at = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with running_wipes_lock:
+            if not running_wipes:
+                return True
+        if give_up_at is not None and time.monotonic() > give_up_at:
+            return False
+        time.sleep(0.1)